@@ -1,21 +1,28 @@
 #!/usr/bin/env python3
 # -*- coding:utf-8 -*-
 
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
 import threading
-import queue
-from urllib.request import urlopen, Request
+import argparse
+import json
+import re
+import time
+import sys
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from urllib.parse import quote, quote_plus, urlparse
-from hashlib import md5
 import os
-from enum import Enum
 from html.parser import HTMLParser
 from PIL import Image
-from io import BytesIO, StringIO
+from io import BytesIO
+import codecs
+import zipfile
+import sqlite3
+import itertools
+import functools
 
-import ssl
-ssl._create_default_https_context = ssl._create_unverified_context
+from download_core import SESSION, BUDGET, ThreadDownloader, HostScheduler
+
+
+WEB_PAGE = 'index.html'  # web page of a chapter, kept in its folder until all images are downloaded
 
 
 def url_image_name(url):
@@ -38,11 +45,14 @@ def url_quote(url):
     return result
 
 
+def wildcard(template: str, order: int, pattern: str):
+    order = '{order:{width}}'.format(order=order, width=pattern).strip()
+    return template.replace('(*)', order)
+
+
 def batch_jobs(template: str, from_: int, to_: int, pattern: str):
     for i in range(from_, to_ + 1):
-        order = '{order:{width}}'.format(order=i, width=pattern).strip()
-        entity = template.replace('(*)', order)
-        yield entity, i
+        yield wildcard(template, i, pattern), i
     yield None, None
 
 
@@ -51,14 +61,39 @@ class WebPageHandler(HTMLParser):
     def __init__(self, *a, **kw):
         super().__init__(*a, **kw)
         self._images = []
+        self._on_image = None
+        self._decoder = None
 
     def feed_file(self, web_page_file):
-        self._images[:] = []
+        self.begin()
         web_page_file.seek(0)
         self.feed(web_page_file.read())
         self.close()
         return self._images
 
+    def begin(self, on_image=None):
+        """
+        start incremental parsing: web page is fed by feed_bytes() a chunk at a time, then finish().
+        @param on_image: callback(sn, url) as soon as an image is found. sn starts from 1.
+        """
+        self.reset()
+        self._images[:] = []
+        self._on_image = on_image
+        self._decoder = codecs.getincrementaldecoder('utf8')(errors='replace')
+
+    def feed_bytes(self, chunk):
+        self.feed(self._decoder.decode(chunk))
+
+    def finish(self):
+        self.feed(self._decoder.decode(b'', final=True))
+        self.close()
+        return self._images
+
+    def add_image(self, url):
+        self._images.append(url.strip())
+        if self._on_image is not None:
+            self._on_image(len(self._images), self._images[-1])
+
     @staticmethod
     def attrs_has_attr(attrs, attr):
         for i in attrs:
@@ -82,12 +117,13 @@ class WebPageHandler(HTMLParser):
 
 
 class HachiRawHandler(WebPageHandler):
-    def __init__(self, *a, **kw):
-        super().__init__(*a, **kw)
+    domain_name = 'hachiraw.com'
+
+    def reset(self):
+        super().reset()
         self._chapter_pages_found = False
         self._chapter_page_found = False
         self._image_found = False
-        self.domain_name = 'hachiraw.com'
 
     def handle_starttag(self, tag, attrs):
         if not self._chapter_pages_found:
@@ -97,8 +133,7 @@ class HachiRawHandler(WebPageHandler):
             if tag == 'div' and self.attrs_has_attr(attrs, ('class', 'chapter-page')):
                 self._chapter_page_found = True
         elif tag == 'img' and self.attrs_has_name(attrs, 'src'):
-            url = self.attrs_get_value(attrs, 'src')
-            self._images.append(url.strip())
+            self.add_image(self.attrs_get_value(attrs, 'src'))
 
     def handle_endtag(self, tag):
         if self._chapter_pages_found and self._chapter_page_found:
@@ -107,9 +142,10 @@ class HachiRawHandler(WebPageHandler):
 
 
 class ParallelParadiseOnlineHandler(WebPageHandler):
-    def __init__(self, *a, **kw):
-        super().__init__(*a, **kw)
-        self.domain_name = 'www.parallelparadise.online'
+    domain_name = 'www.parallelparadise.online'
+
+    def reset(self):
+        super().reset()
         self._reading_content_found = False
         self._page_break_found = False
 
@@ -121,8 +157,7 @@ class ParallelParadiseOnlineHandler(WebPageHandler):
             if tag == 'div' and self.attrs_has_attr(attrs, ('class', 'page-break ')):
                 self._page_break_found = True
         elif tag == 'img' and self.attrs_has_attr(attrs, ('class', 'wp-manga-chapter-img')):
-            url = self.attrs_get_value(attrs, 'src')
-            self._images.append(url.strip())
+            self.add_image(self.attrs_get_value(attrs, 'src'))
 
     def handle_endtag(self, tag):
         if self._reading_content_found and self._page_break_found:
@@ -130,434 +165,744 @@ class ParallelParadiseOnlineHandler(WebPageHandler):
                 self._page_break_found = False
 
 
-class DownloadStatus(Enum):
-    Unknown = 0
-    Failed = 1
-    Downloaded = 2
-    Successful = 3
-
+# domain name --> handler class
+HANDLERS = {cls.domain_name: cls for cls in (HachiRawHandler, ParallelParadiseOnlineHandler)}
+
+
+def webp_to_jpeg(job):
+    """
+    download callback: my manga reader doesn't support webp, so transcode it before written to disk.
+    """
+    assert isinstance(job, ThreadDownloader)
+    if not job.is_downloaded():
+        return
+    filepath, filename = os.path.split(job._dst)
+    basename, ext = os.path.splitext(filename)
+    if ext != '.webp' or job.downloaded_size() == 0:
+        return
+    with Image.open(BytesIO(job.content())) as img:
+        jpg_data = BytesIO()
+        img.convert('RGB').save(jpg_data, format='JPEG')
+    job.set_content(jpg_data.getvalue(), os.path.join(filepath, '{}.jpg'.format(basename)))
+
+
+def shrink_image(data, width=None, height=None, grey=True, quality=80):
+    """
+    e-reader output: fit image into width x height, convert it to greyscale, and re-encode it as JPEG.
+    EXIF and ICC profile aren't copied, so metadata is stripped too.
+    It runs in a worker process: bytes in and bytes out, no matter image is a file or in an archive.
+    @return: bytes of JPEG image
+    """
+    with Image.open(BytesIO(data)) as img:
+        img = img.convert('L' if grey else 'RGB')
+        if width is not None or height is not None:
+            img.thumbnail((width or img.width, height or img.height), Image.LANCZOS)  # keep ratio, never enlarge
+        jpg_data = BytesIO()
+        img.save(jpg_data, format='JPEG', quality=quality, optimize=True)
+    return jpg_data.getvalue()
+
+
+class ImagePostProcessor:
+    """
+    Images are shrunk by a process pool as soon as they're downloaded, instead of another pass by KindleSprite.
+    Download workers wait for the result, while CPU work runs in parallel out of GIL.
+    """
+    def __init__(self, pool, width=None, height=None, grey=True, quality=80):
+        """
+        @param pool: ProcessPoolExecutor, shared by all series
+        """
+        self._pool = pool
+        self._settings = {'width': width, 'height': height, 'grey': grey, 'quality': quality}
 
-class ThreadDownloader(threading.Thread):
-    def __init__(self, url, dst, timeout=3, retry=1, callback=None):
-        threading.Thread.__init__(self)
-        self._url = url  # source URL
-        self._dst = dst  # destination folder
-        self._timeout = timeout
-        self._retry = retry
-        self._cb = callback
-        self._status = DownloadStatus.Unknown
-        self._content = None
-
-    def run(self):
-        user_agent = {'User-Agent': 'Mozilla/5.0 (Macintosh; U; Intel Mac OS X 10_6_8; en-us) AppleWebKit/534.50'}
-        req = Request(self._url, headers=user_agent, unverifiable=True)
-        for i in range(0, self._retry):
-            try:
-                ifo = urlopen(req, timeout=self._timeout)
-                self._content = ifo.read()
-                ifo.close()
-                break
-            except Exception as e:
-                print('%s: %s' % (self._url, e))
-        # 失败
-        if self._content is None:
-            self._status = DownloadStatus.Failed
-            if self._cb is not None:
-                self._cb(self)
-            return
-        # 成功下载，有一次回调
-        self._status = DownloadStatus.Downloaded
-        if self._cb is not None:
-            self._cb(self)
-        # 写完本地文件，有一次回调
-        if not self.file_exists(self._content):
-            with open(self._dst, 'wb') as ofo:
-                ofo.write(self._content)
-        self._status = DownloadStatus.Successful
-        if self._cb is not None:
-            self._cb(self)
-
-    def file_exists(self, content):
-        """
-        check if file exists already on local disk.
-        @param filename: local disk filename (full dir + base name)
-        @param content: is belonging to remote resource.
-        @return: True if it exists
-        """
-        if not os.path.exists(self._dst):
-            return False
-        if not os.path.isfile(self._dst):
-            return False
-        if os.path.getsize(self._dst) != len(content):
-            return False
-        with open(self._dst, 'rb') as ofo:
-            old = ofo.read()
-            digest1 = md5(old).digest()
-            digest2 = md5(content).digest()
-            return digest1 == digest2
-
-    def is_successful(self):
-        return self._status == DownloadStatus.Successful
-
-    def is_downloaded(self):
-        return self._status == DownloadStatus.Downloaded
-
-    def is_failed(self):
-        return self._status == DownloadStatus.Failed
-
-    def file_path(self):
-        return self._dst
-
-
-class MainWnd(tk.Frame):
-    WND_TITLE = 'Manga Crawler'
-    WEB_PAGE = 'index.html'
-
-    def __init__(self, master, *a, **kw):
-        tk.Frame.__init__(self, master, *a, **kw)
-        #
-        frame = tk.Frame(self)
-        frame.pack(side=tk.TOP, expand=tk.NO, fill=tk.BOTH)
-        lbl = tk.Label(frame, text='URL:')
-        lbl.pack(side=tk.LEFT)
-        lbl.bind('<Double-Button-1>', lambda _: self._url.set(''))
-        self._url = tk.StringVar()
-        tk.Entry(frame, textvariable=self._url).pack(side=tk.LEFT, expand=tk.YES, fill=tk.X)
-        btn = tk.Button(frame, text='Download', command=self.onclick_analyze_url)  # download m3u8 file (index file)
-        btn.pack(side=tk.LEFT)
-        tk.Button(frame, text='Paste from CB', command=self.paste_from_clipboard).pack(side=tk.LEFT)
-        #
-        frame = tk.Frame(self)
-        frame.pack(side=tk.TOP, expand=tk.NO, fill=tk.BOTH)
-        tk.Label(frame, text='Dir:').pack(side=tk.LEFT)
-        self._tmp_dir = tk.StringVar()
-        tk.Entry(frame, textvariable=self._tmp_dir).pack(side=tk.LEFT, expand=tk.YES, fill=tk.X)
-        tk.Button(frame, text='Save to Dir', command=self.onclick_browse_dir).pack(side=tk.LEFT)
-        #
-        frame = tk.Frame(self)
-        frame.pack(side=tk.TOP, expand=tk.NO, fill=tk.BOTH)
-        tk.Label(frame, text='Wild Card Pattern:').pack(side=tk.LEFT)
-        self._wildcard_pattern = tk.StringVar(value='01')
-        tk.Entry(frame, textvariable=self._wildcard_pattern, width=4).pack(side=tk.LEFT, expand=tk.NO)
-        tk.Label(frame, text='Range:').pack(side=tk.LEFT)
-        self._wildcard_from = tk.IntVar(value=1)
-        tk.Spinbox(frame, textvariable=self._wildcard_from, from_=1, to=999, width=3).pack(side=tk.LEFT)
-        tk.Label(frame, text='-->').pack(side=tk.LEFT)
-        self._wildcard_to = tk.IntVar(value=99)
-        tk.Spinbox(frame, textvariable=self._wildcard_to, from_=1, to=999, width=3).pack(side=tk.LEFT)
-        #
-        frame = tk.Frame(self)
-        frame.pack(side=tk.TOP, expand=tk.NO, fill=tk.BOTH)
-        tk.Label(frame, text='Hanlder:').pack(side=tk.LEFT)
-        self._handlers = dict()
-        for handler in [HachiRawHandler(), ParallelParadiseOnlineHandler()]:
-            self._handlers[handler.domain_name] = handler
-        self._active_handler = tk.StringVar()
-        tk.OptionMenu(frame, self._active_handler, *self._handlers.keys()).pack(side=tk.LEFT)
-        #
-        group = tk.LabelFrame(self, text='Links')
-        group.pack(side=tk.TOP, expand=tk.YES, fill=tk.BOTH)
-        # row 1 -- step 2
-        frame = tk.Frame(group, padx=5, pady=5)
-        frame.pack(side=tk.TOP, expand=tk.YES, fill=tk.BOTH)
-        self._links = ttk.Treeview(frame, selectmode=tk.EXTENDED, show='headings', columns=('sn', 'url', 'state'))
-        self._links.pack(side=tk.LEFT, expand=tk.YES, fill=tk.BOTH)
-        yscroll = tk.Scrollbar(frame, orient=tk.VERTICAL, command=self._links.yview)
-        yscroll.pack(side=tk.RIGHT, expand=tk.NO, fill=tk.Y)
-        self._links['yscrollcommand'] = yscroll.set
-        xscroll = tk.Scrollbar(group, orient=tk.HORIZONTAL, command=self._links.xview)
-        xscroll.pack(side=tk.TOP, expand=tk.NO, fill=tk.X)
-        self._links['xscrollcommand'] = xscroll.set
-        self._links.bind('<Key-K>', self.onkey_tree_delete)
-        self._links.bind('<1>', self.onkey_tree_click)
-        self._links.heading('sn', text='SN')
-        self._links.heading('url', text='URL')  # '#0' column is icon and it's hidden here
-        self._links.heading('state', text='State')    # we only need two columns: '#1' and '#2'
-        self._links.column('sn', width=40, stretch=False)
-        self._links.column('state', width=50, stretch=False, anchor=tk.CENTER)
-        #
-        frame = tk.Frame(group)
-        frame.pack(side=tk.TOP, expand=tk.NO, fill=tk.BOTH)
-        tk.Label(frame, text='Progress: ').pack(side=tk.LEFT)
-        self._progress = tk.IntVar()
-        self._progressbar = ttk.Progressbar(frame, mode='determinate', variable=self._progress)
-        self._progressbar.pack(side=tk.LEFT, expand=tk.YES, fill=tk.X)
-        #
-        frame = tk.Frame(self)
-        frame.pack(side=tk.TOP, expand=tk.NO, fill=tk.BOTH)
-        tk.Button(frame, text='Read Local Web Page', command=self.load_local_web_page).pack(side=tk.LEFT)
-        tk.Label(frame, text='Threads:').pack(side=tk.LEFT)
-        self._job_num = tk.IntVar()
-        tk.Spinbox(frame, textvariable=self._job_num, from_=1, to=20, width=2).pack(side=tk.LEFT)
-        tk.Label(frame, text='Timeout:').pack(side=tk.LEFT)
-        self._timeout = tk.IntVar()
-        tk.Spinbox(frame, textvariable=self._timeout, from_=3, to=30, width=2).pack(side=tk.LEFT)
-        tk.Label(frame, text='Retry:').pack(side=tk.LEFT)
-        self._retry = tk.IntVar()
-        tk.Spinbox(frame, textvariable=self._retry, from_=1, to=30, width=2).pack(side=tk.LEFT)
-        self._btn = tk.Button(frame, text='Download Images', command=self.onclick_download_images)
-        self._btn.pack(side=tk.LEFT)
-        #
-        self._auto = tk.BooleanVar(value=True)
-        tk.Checkbutton(frame, text='Auto', variable=self._auto).pack(side=tk.RIGHT)
-
-        self._job_queue = queue.Queue()
-        self._downloaders = []
-        self._running = False
-        self._url_generator = None
-        self._dir_generator = None
-        self._save_dir = None
-
-    def onclick_analyze_url(self):
-        url = self._url.get().strip()
-        dst = self._tmp_dir.get().strip()
-        if len(url) == 0 or len(dst) == 0:
+    def process(self, job):
+        """
+        download callback: replace content by shrunk JPEG image before it's written to disk or archive.
+        webp is transcoded here too.
+        """
+        assert isinstance(job, ThreadDownloader)
+        if not job.is_downloaded() or job.downloaded_size() == 0:
             return
-        wildcard_url = '(*)' in url
-        wildcard_dst = '(*)' in dst
-        if any([wildcard_url, wildcard_dst]) and not all([wildcard_url, wildcard_dst]):
-            messagebox.askquestion(MainWnd.WND_TITLE, 'wild card pattern not match')
+        try:
+            data = self._pool.submit(shrink_image, job.content(), **self._settings).result()
+        except Exception as e:
+            print('%s: %s' % (job._url, e))
+            webp_to_jpeg(job)  # keep original image
             return
-        if wildcard_url:
-            self._url_generator = batch_jobs(url, self._wildcard_from.get(), self._wildcard_to.get(), self._wildcard_pattern.get())
-            url, current = next(self._url_generator)
-            if url is None:
-                return
-        if wildcard_dst:
-            self._dir_generator = batch_jobs(dst, self._wildcard_from.get(), self._wildcard_to.get(), self._wildcard_pattern.get())
-            dst, current = next(self._dir_generator)
-            if dst is None:
+        basename, _ = os.path.splitext(job.file_path())
+        job.set_content(data, basename + '.jpg')
+
+
+def archive_image(archive, sn, job):
+    """
+    download callback in CBZ output mode: image is added into chapter archive instead of written to disk.
+    Image should be transcoded before.
+    """
+    if job.is_successful() and job.is_discarded():
+        archive.skip(sn)
+    elif job.is_successful():
+        archive.add(sn, os.path.basename(job.file_path()), job.content())
+        job.free()  # archive holds it now
+    elif job.is_failed():
+        archive.add(sn, None, None)
+
+
+class ChapterArchive:
+    """
+    Output mode: images of a chapter are streamed into one .cbz file (zip, stored without compression).
+    Images are written in page order. Pages arriving early wait in memory until all pages before them are in,
+    held in BUDGET meanwhile, so they count against memory limit as downloads in flight do.
+    Archive is named *.cbz.part until it's complete, so an unfinished one can be completed by next run.
+    """
+    def __init__(self, path, pages=()):
+        """
+        @param path: path of .cbz file
+        @param pages: numbers of all pages in chapter, or use expect() if pages are found one by one.
+        """
+        self._path = path
+        self._part = path + '.part'
+        self._lock = threading.Lock()
+        try:
+            self._zip = zipfile.ZipFile(self._part, 'a', zipfile.ZIP_STORED)
+        except zipfile.BadZipFile:  # left by a crash
+            self._zip = zipfile.ZipFile(self._part, 'w', zipfile.ZIP_STORED)
+        self._existing = {ChapterArchive.page_of(i) for i in self._zip.namelist()}
+        self._pages = sorted(set(pages) - self._existing)
+        self._next = 0  # index of next page to be written in self._pages
+        self._pending = dict()  # page number --> (entry name, image data)
+        self._missing = []
+
+    @staticmethod
+    def path_of(chapter_dir):
+        return '{}.cbz'.format(chapter_dir.rstrip('/\\'))
+
+    @staticmethod
+    def page_of(name):
+        """
+        @param name: entry name in archive, like 'img_0001.jpg'
+        """
+        basename, _ = os.path.splitext(name)
+        return int(basename.split('_')[-1])
+
+    def contains(self, sn):
+        return sn in self._existing
+
+    def expect(self, sn):
+        """
+        @param sn: number of a page just found, which is larger than all previous ones.
+        """
+        with self._lock:
+            if sn not in self._existing:
+                self._pages.append(sn)
+
+    def add(self, sn, name, data):
+        """
+        @param data: None if page is failed to download
+        """
+        with self._lock:
+            if sn in self._existing:
                 return
-            else:
-                self._wildcard_from.set(current)
-        if not os.path.exists(dst):
-            os.mkdir(dst)
-        url = url_quote(url)
-        self._save_dir = dst
-        job = ThreadDownloader(url=url, dst=os.path.join(self._save_dir, MainWnd.WEB_PAGE),
-                               timeout=self._timeout.get(), retry=self._retry.get(),
-                               callback=self.on_web_page_downloaded)
-        job.start()
+            if self._pending.get(sn, (None, None))[1] is not None:  # replaced
+                BUDGET.unhold(len(self._pending[sn][1]))
+            self._pending[sn] = (name, data)
+            if data is not None:
+                BUDGET.hold(len(data))
+            while self._next < len(self._pages) and self._pages[self._next] in self._pending:
+                self.write(self._pages[self._next])
+                self._next += 1
+
+    def skip(self, sn):
+        """
+        page isn't wanted in archive, e.g. it's a duplicate.
+        """
+        self.add(sn, None, b'')
 
-    def on_web_page_downloaded(self, job: ThreadDownloader):
-        if job.is_failed():
-            messagebox.showerror(MainWnd.WND_TITLE, 'Failed to download web page:\n%s' % job._url)
+    def write(self, sn):
+        name, data = self._pending.pop(sn)
+        if data is None:
+            self._missing.append(sn)
             return
-        if job.is_successful():
-            return;
-        # 使用内存文件加快速度
-        parse_result = urlparse(job._url)
-        if parse_result.netloc not in self._handlers:
-            return
-        self._active_handler.set(parse_result.netloc)
-        content = job._content.decode(encoding='utf8')
-        with StringIO(content) as file:
-            self.load_links(file, parse_result.netloc)
-
-    def load_local_web_page(self):
-        dst = self._tmp_dir.get().strip()
-        if len(dst) == 0 or '(*)' in dst:
-            return
-        web_page = os.path.join(dst.strip(), MainWnd.WEB_PAGE)
-        if not os.path.exists(web_page):
-            return
-        active_handler = self._active_handler.get()
-        if len(active_handler) == 0:
-            messagebox.askquestion(MainWnd.WND_TITLE, 'Web content cannot be parsed without handler specified')
-            return
-        self._save_dir = dst.strip()
-        with open(web_page) as file:
-            self.load_links(file, active_handler)
-
-    def load_links(self, file_obj, active_handler):
-        links = self._handlers[active_handler].feed_file(file_obj)
-        self._links.delete(*self._links.get_children())
-        for i, url in enumerate(links, start=1):
-            iid = 'I%04d' % i
-            self._links.insert('', tk.END, iid=iid, values=(i, url, ''))
-        if self._auto.get():
-            self.enqueue_all_jobs()
-
-    def paste_from_clipboard(self):
-        url = self.clipboard_get().strip()
-        if len(url) > 0:
-            self._url.set(url)
-
-    def onclick_browse_dir(self):
-        a_dir = filedialog.askdirectory()
-        if a_dir == '':
-            return
-        self._tmp_dir.set(a_dir)
+        try:
+            if name is not None:
+                self._zip.writestr(name, data)
+        finally:
+            BUDGET.unhold(len(data))
 
-    def onkey_tree_delete(self, _):
-        # keep treeview items intact when downloading, because jobs are in queue.
-        if self._running:
+    def close(self):
+        """
+        @return: True if all pages are in archive, which is then renamed to .cbz
+        """
+        with self._lock:
+            for sn in sorted(self._pending.keys()):  # pages after a page which never arrives
+                self.write(sn)
+            complete = len(self._missing) == 0 and self._next == len(self._pages)
+            empty = len(self._zip.namelist()) == 0
+            self._zip.close()
+        if empty:
+            os.remove(self._part)
+            return False
+        if complete:
+            with open(self._part, 'rb+') as ofo:
+                os.fsync(ofo.fileno())
+            os.replace(self._part, self._path)
+        return complete
+
+
+class ImageHashIndex:
+    """
+    Perceptual hash (dHash) index of pages downloaded in a series, persisted in a file in series' folder.
+    Sites insert same ad/credit pages into every chapter. A page is regarded as such a banner
+    once it's seen (within a small Hamming distance) in 'repeat' chapters.
+    After that, banner pages are skipped (mode 'skip') or hard-linked to the first copy (mode 'link'),
+    and URLs known to be banners aren't downloaded at all.
+    """
+    FILE_NAME = '.phash.json'
+    HASH_SIZE = 8  # 64-bit hash
+
+    def __init__(self, path, mode='skip', distance=4, repeat=3):
+        """
+        @param path: index file of series, see series_file()
+        """
+        self._path = path
+        self._mode = mode
+        self._distance = distance
+        self._repeat = repeat
+        self._lock = threading.Lock()
+        self._entries = []  # {'hash': int, 'chapters': [...], 'urls': [...], 'path': first copy}
+        self._urls = dict()  # url --> entry
+        # pigeonhole: 2 hashes within distance d have at least one of (d + 1) bands equal
+        bits = ImageHashIndex.HASH_SIZE * ImageHashIndex.HASH_SIZE
+        width = bits // (distance + 1)
+        self._bands = [(i * width, bits if i == distance else (i + 1) * width) for i in range(distance + 1)]
+        self._buckets = [dict() for _ in self._bands]  # band value --> entries
+        if os.path.exists(self._path):
+            with open(self._path, encoding='utf8') as file:
+                for entry in json.load(file)['entries']:
+                    entry['hash'] = int(entry['hash'], 16)
+                    self.insert(entry)
+
+    @staticmethod
+    def dhash(data):
+        """
+        difference hash: shrink to 9x8 greyscale, then compare each pixel with its right neighbour.
+        """
+        size = ImageHashIndex.HASH_SIZE
+        with Image.open(BytesIO(data)) as img:
+            pixels = list(img.convert('L').resize((size + 1, size), Image.LANCZOS).getdata())
+        value = 0
+        for row in range(size):
+            for col in range(size):
+                left = pixels[row * (size + 1) + col]
+                value = (value << 1) | (left > pixels[row * (size + 1) + col + 1])
+        return value
+
+    def insert(self, entry):
+        self._entries.append(entry)
+        for url in entry['urls']:
+            self._urls[url] = entry
+        for (start, end), bucket in zip(self._bands, self._buckets):
+            band = (entry['hash'] >> start) & ((1 << (end - start)) - 1)
+            bucket.setdefault(band, []).append(entry)
+
+    def match(self, value):
+        """
+        @return: entry of the nearest hash within distance, or None
+        """
+        best, best_distance = None, self._distance + 1
+        for (start, end), bucket in zip(self._bands, self._buckets):
+            band = (value >> start) & ((1 << (end - start)) - 1)
+            for entry in bucket.get(band, []):
+                distance = bin(entry['hash'] ^ value).count('1')
+                if distance < best_distance:
+                    best, best_distance = entry, distance
+        return best
+
+    def is_banner(self, entry):
+        return len(entry['chapters']) >= self._repeat
+
+    def check_url(self, job):
+        """
+        before download: URL of a known banner needn't be downloaded.
+        """
+        with self._lock:
+            entry = self._urls.get(job._url)
+            if entry is None or not self.is_banner(entry):
+                return
+            path = entry['path']
+        self.drop(job, path)
+
+    def check(self, job, chapter):
+        """
+        download callback: record hash of page, and drop it if it's a banner.
+        @param chapter: name of chapter which the page belongs to
+        """
+        if not job.is_downloaded():
             return
-        #
-        selected = self._links.selection()
-        num = len(selected)
-        if num == 0:
+        try:
+            value = ImageHashIndex.dhash(job.content())
+        except Exception as e:  # not an image PIL knows
+            print('%s: %s' % (job._url, e))
             return
-        if num == 1:
-            msg = 'Are you sure to delete\n\n%s\n\n?' % selected[0]
-        else:
-            msg = 'Are you sure to delete %d jobs?' % num
-        if not messagebox.askokcancel(MainWnd.WND_TITLE, msg):
+        with self._lock:
+            entry = self.match(value)
+            if entry is None:
+                entry = {'hash': value, 'chapters': [], 'urls': [], 'path': None}
+                self.insert(entry)
+            if chapter not in entry['chapters']:
+                entry['chapters'].append(chapter)
+            if job._url not in self._urls:
+                entry['urls'].append(job._url)
+                self._urls[job._url] = entry
+            banner = self.is_banner(entry) and entry['path'] != job.file_path()
+            if entry['path'] is None and not job.is_in_memory():
+                entry['path'] = job.file_path()  # first copy, to be linked by duplicates
+            path = entry['path']
+        if banner:
+            self.drop(job, path)
+
+    def drop(self, job, path):
+        job.discard()
+        dst = job.file_path()
+        if self._mode != 'link' or job.is_in_memory() or path is None or os.path.exists(dst):
             return
-        self._links.delete(*selected)
+        try:
+            os.link(path, dst)
+        except OSError as e:  # first copy is gone, or file system doesn't support hard links
+            print('%s: %s' % (dst, e))
+
+    def save(self):
+        with self._lock:
+            entries = [dict(i, hash='%016x' % i['hash']) for i in self._entries]
+        with open(self._path + '.part', 'w', encoding='utf8') as file:
+            json.dump({'entries': entries}, file, ensure_ascii=False)
+        os.replace(self._path + '.part', self._path)
+
+
+def load_job_file(path):
+    """
+    Job file is JSON (or YAML if PyYAML is installed), for example:
+    {
+      "connections": 8,         # global budget of simultaneous connections
+      "per_host": 2,            # politeness: simultaneous connections to one host
+      "delay": 0.5,             # politeness: minimum seconds between two requests to one host
+      "max_delay": 60,          # upper limit of delay when a host answers 429/503
+      "memory_budget": 256,     # optional: MB of bodies in flight; new downloads wait until memory is freed
+      "output": "files",        # "files": an image file per page; "cbz": a .cbz archive per chapter
+      "dedup": "skip",          # optional: banner pages repeated in chapters are skipped, or "link"ed
+      "probe": 1,               # sync: how many missing chapters in a row mean no more new chapters
+      "post_process": {"width": 1072, "height": 1448, "grey": true, "quality": 80},
+                                # optional: images are shrunk for e-reader as soon as they're downloaded
+      "timeout": 10,
+      "retry": 3,
+      "series": [
+        {"name": "foo",
+         "url": "https://hachiraw.com/manga/foo/chapter-(*)",
+         "dir": "/volume1/manga/foo/(*)",
+         "from": 1, "to": 30, "pattern": "03"}
+      ]
+    }
+    "handler" can be given in a series if URL's domain name isn't the handler's.
+    "output", "dedup" and "post_process" can be given in a series too.
+    """
+    with open(path, encoding='utf8') as file:
+        if os.path.splitext(path)[1].lower() in ('.yaml', '.yml'):
+            import yaml  # optional, only needed by YAML job files
+            return yaml.safe_load(file)
+        return json.load(file)
+
+
+def series_chapters(series, frm=None, to=None):
+    """
+    @param frm, to: override range in job file. Negative 'to' means no end.
+    @return: generator of (chapter URL, chapter dir, chapter number) of a series in job file
+    """
+    url, dst = series['url'], series['dir']
+    if '(*)' not in url and '(*)' not in dst:
+        yield url, dst, None
+        return
+    if '(*)' not in url or '(*)' not in dst:
+        raise ValueError('wild card pattern not match: %s' % series.get('name', url))
+    frm = int(series.get('from', 1)) if frm is None else frm
+    to = int(series.get('to', 99)) if to is None else to
+    pattern = str(series.get('pattern', '01'))
+    for i in itertools.count(frm) if to < 0 else range(frm, to + 1):
+        yield wildcard(url, i, pattern), wildcard(dst, i, pattern), i
+
+
+def series_dir(series):
+    """
+    @return: folder holding all chapters of a series in job file
+    """
+    dst = series['dir']
+    if '(*)' in dst:
+        return os.path.dirname(dst[:dst.index('(*)')])
+    return os.path.dirname(dst.rstrip('/\\'))
+
+
+def series_file(series, file_name):
+    """
+    Series of templates like /manga/foo_(*) and /manga/bar_(*) share a folder, but not their state:
+    file name is tagged by chapter folder's template, e.g. .crawl.sqlite --> .crawl.foo_.sqlite
+    @param file_name: like '.crawl.sqlite'
+    @return: path of a state file of series, in series_dir()
+    """
+    tag = re.sub(r'[^\w.-]+', '_', os.path.basename(series['dir'].rstrip('/\\')).replace('(*)', ''))
+    if tag:
+        base, ext = os.path.splitext(file_name)
+        file_name = '%s.%s%s' % (base, tag, ext)
+    return os.path.join(series_dir(series), file_name)
+
+
+class CrawlReport:
+    def __init__(self, name):
+        self.name = name
+        self.chapters = 0
+        self.failed_chapters = []
+        self.images = 0
+        self.failed_images = []
+        self.bytes = 0
+        self.banners = 0  # duplicate pages skipped or linked
+        self.elapsed = 0.0
+
+    def as_dict(self):
+        return {'name': self.name,
+                'chapters': self.chapters,
+                'failed_chapters': self.failed_chapters,
+                'images': self.images,
+                'failed_images': self.failed_images,
+                'bytes': self.bytes,
+                'banners': self.banners,
+                'seconds': round(self.elapsed, 2)}
+
+    def __str__(self):
+        return '%s: %d chapters (%d failed), %d images (%d failed, %d banners), %.1fMB in %.1f seconds' % (
+            self.name, self.chapters, len(self.failed_chapters), self.images, len(self.failed_images),
+            self.banners, self.bytes / 1024 / 1024, self.elapsed)
+
+
+class CrawlState:
+    """
+    Crawl state of a series, stored in a sqlite database in series' folder, see series_file().
+    Chapters and pages already done are neither downloaded nor checked again,
+    and a series can be synchronized by retrying chapters not done and probing chapters after the last one done.
+    """
+    FILE_NAME = '.crawl.sqlite'
+    DONE = 'done'
+    FAILED = 'failed'
+    BANNER = 'banner'  # page discarded as duplicate
+
+    def __init__(self, path):
+        self._con = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()  # pages are recorded by scheduler's workers
+        with self._lock, self._con:
+            self._con.execute('''
+                CREATE TABLE IF NOT EXISTS chapters (
+                    number   INTEGER  PRIMARY KEY,
+                    url      TEXT,
+                    status   TEXT,
+                    pages    INTEGER,
+                    updated  TEXT);''')
+            self._con.execute('''
+                CREATE TABLE IF NOT EXISTS pages (
+                    chapter  INTEGER,
+                    page     INTEGER,
+                    url      TEXT,
+                    file     TEXT,
+                    status   TEXT,
+                    size     INTEGER,
+                    digest   TEXT,
+                    updated  TEXT,
+                    PRIMARY KEY (chapter, page));''')
 
-    def onkey_tree_click(self, _):
-        selected = self._links.selection()
-        if len(selected) == 0:
-            return
-        _, url, _ = self._links.item(selected[0], 'values')
-        self.clipboard_clear()
-        self.clipboard_append(url)
-
-    def onclick_download_images(self):
-        if self._running:
-            self._running = False   # global signal to stop running jobs
-            self._btn.config(text='Download')
-            for i in self._downloaders:
-                i.join()
-            self._downloaders[:] = []
-            return
-        #
-        self.enqueue_all_jobs()
+    @staticmethod
+    def now():
+        return time.strftime('%Y-%m-%d %H:%M:%S')
 
-    def enqueue_all_jobs(self):
-        urls = self._links.get_children()
-        if len(urls) == 0:
-            return
-        #
-        self._running = True
-        self._btn.config(text='Cancel')
-        #
-        self.clear_queue()
-        for i in urls:
-            self._job_queue.put(i)
-            self._links.set(i, column='state', value='')
-        #
-        self._progress.set(0)
-        self._progressbar.config(maximum=self._job_queue.qsize())
-        #
-        self.after(100, self.update_progress)
-
-    def clear_queue(self):
-        self._downloaders[:] = []
-        while not self._job_queue.empty():
-            self._job_queue.get()
-
-    def update_progress(self):
-        """
-        update UI
-        """
-        if not self._running:
-            return
+    def last_chapter(self):
+        """
+        @return: number of the last chapter done, or None
+        """
+        with self._lock:
+            row = self._con.execute('SELECT MAX(number) FROM chapters WHERE status=?', (CrawlState.DONE,)).fetchone()
+        return row[0]
+
+    def is_chapter_done(self, number):
+        with self._lock:
+            row = self._con.execute('SELECT status FROM chapters WHERE number=?', (number,)).fetchone()
+        return row is not None and row[0] == CrawlState.DONE
 
-        finished = 0
-        for i in self._downloaders[:]:
-            if i.isAlive():
+    def is_page_done(self, chapter, page, chapter_dir=None):
+        """
+        @param chapter_dir: if given, page file must exist in it too
+        """
+        with self._lock:
+            row = self._con.execute('SELECT status, file FROM pages WHERE chapter=? AND page=?',
+                                    (chapter, page)).fetchone()
+        if row is None or row[0] == CrawlState.FAILED:
+            return False
+        return row[0] == CrawlState.BANNER or chapter_dir is None or os.path.exists(os.path.join(chapter_dir, row[1]))
+
+    def record_page(self, chapter, page, job):
+        if job.is_failed():
+            status, size, digest = CrawlState.FAILED, 0, None
+        else:
+            status = CrawlState.BANNER if job.is_discarded() else CrawlState.DONE
+            size, digest = job.downloaded_size(), None if job.is_discarded() else job.digest()
+        with self._lock:
+            self._con.execute('INSERT OR REPLACE INTO pages VALUES (?,?,?,?,?,?,?,?)',
+                              (chapter, page, job._url, os.path.basename(job.file_path()), status, size, digest,
+                               CrawlState.now()))
+
+    def finish_chapter(self, number, url, pages, done):
+        with self._lock, self._con:  # commit pages of chapter too
+            self._con.execute('INSERT OR REPLACE INTO chapters VALUES (?,?,?,?,?)',
+                              (number, url, CrawlState.DONE if done else CrawlState.FAILED, pages, CrawlState.now()))
+
+    def close(self):
+        with self._lock:
+            self._con.commit()
+            self._con.close()
+
+
+class SeriesJob:
+    """
+    settings and bookkeeping of a series in job file, shared by all its chapters.
+    """
+    def __init__(self, series, output='files', dedup=None, post_process=None, pool=None):
+        """
+        @param post_process: settings of ImagePostProcessor, e.g. {"width": 1072, "height": 1448}
+        @param pool: ProcessPoolExecutor of post-processing
+        """
+        self.series = series
+        self.handler = series.get('handler')
+        self.output = series.get('output', output)  # 'files' (an image file per page) or 'cbz' (archive per chapter)
+        os.makedirs(series_dir(series), exist_ok=True)
+        dedup = series.get('dedup', dedup)
+        if dedup is not None:
+            self.dedup = ImageHashIndex(series_file(series, ImageHashIndex.FILE_NAME), dedup)
+        else:
+            self.dedup = None
+        post_process = series.get('post_process', post_process)
+        self.post_processor = ImagePostProcessor(pool, **post_process) if post_process is not None else None
+        self.state = CrawlState(series_file(series, CrawlState.FILE_NAME))
+        self.report = CrawlReport(series.get('name', series['url']))
+
+
+class BatchCrawler:
+    """
+    Headless counterpart of MangaCrawlerGui.MainWnd: crawl all series listed in a job file.
+    Series are crawled concurrently, chapters of a series one by one.
+    All requests go through a HostScheduler: 'connections' is the global budget,
+    and each host sees at most 'per_host' connections, 'delay' seconds apart.
+    """
+    def __init__(self, connections=8, per_host=2, timeout=10, retry=3, delay=0.5, max_delay=60.0, output='files',
+                 dedup=None, probe=1, post_process=None, memory_budget=0):
+        self._timeout = timeout
+        self._retry = retry
+        self._output = output  # default output mode of series
+        self._dedup = dedup    # default dedup mode of series: None, 'skip' or 'link'
+        self._probe = probe    # sync: how many missing chapters in a row before giving up
+        self._post_process = post_process  # default post-processing settings of series
+        BUDGET.set_limit(memory_budget * 1024 * 1024)  # MB of bodies in flight, 0: no limit
+        self._process_pool = None
+        self._lock = threading.Lock()  # protects reports
+        self._scheduler = HostScheduler(connections, per_host, delay, max_delay)
+
+    def fetch(self, url, dst, callback=None, in_memory=False, on_chunk=None, dedup=None, compress=False):
+        """
+        download in calling thread, which is one of scheduler's workers.
+        @param url: quoted URL
+        @param dedup: ImageHashIndex, which may discard the job before download
+        @param compress: ask for compressed body, e.g. web page
+        """
+        job = ThreadDownloader(url, dst, self._timeout, self._retry, callback, self._scheduler, in_memory, on_chunk,
+                               compress)
+        if dedup is not None:
+            dedup.check_url(job)
+        job.run()
+        return job
+
+    def run(self, all_series, sync=False):
+        """
+        @param all_series: list of series (dict) in job file
+        @param sync: retry chapters not done, and look for chapters after the last one done, ignoring end of range
+                     in job file
+        @return: list of CrawlReport, one per series
+        """
+        if self._post_process is not None or any('post_process' in i for i in all_series):
+            self._process_pool = ProcessPoolExecutor()
+        try:
+            with ThreadPoolExecutor(max_workers=max(len(all_series), 1)) as series_pool:
+                return list(series_pool.map(functools.partial(self.crawl_series, sync=sync), all_series))
+        finally:
+            self._scheduler.shutdown()
+            SESSION.close()
+            if self._process_pool is not None:
+                self._process_pool.shutdown()
+                self._process_pool = None
+
+    def crawl_series(self, series, sync=False):
+        job = SeriesJob(series, self._output, self._dedup, self._post_process, self._process_pool)
+        start = time.time()
+        last = job.state.last_chapter() if sync else None
+        chapters = series_chapters(series, None, -1 if sync else None)
+        misses = 0
+        for url, dst, number in chapters:
+            if job.state.is_chapter_done(number or 0):
                 continue
-            # visualize task state: completion or failure
-            if i.is_successful():
-                self._links.delete(i.iid)
+            if self.crawl_chapter(url, dst, number or 0, job) > 0:
+                misses = 0
+            elif sync:
+                if last is not None and number is not None and number < last:
+                    continue  # a gap in chapters done, not the end
+                misses += 1  # no such chapter (yet)
+                if misses >= self._probe:
+                    break
             else:
-                self._links.set(i.iid, column='state', value='X')
-            self._downloaders.remove(i)
-            finished += 1
-        if finished > 0:
-            self._progress.set(self._progress.get() + finished)
-        #
-        free_slots = max(self._job_num.get() - len(self._downloaders), 0)
-        to_be_added = min(free_slots, self._job_queue.qsize())
-        for i in range(0, to_be_added):
-            iid = self._job_queue.get()
-            #  [ Important Point about ttk.Treeview ]
-            # no matter what type it was when inserted into 'values',
-            # it is str of type now when being retrieved.
-            #
-            # In short, be careful of below 'sn' in this app.
-            sn, url, state = self._links.item(iid, 'values')
-            _, ext = url_image_name(url)
-            url = url_quote(url)
-            dst = os.path.join(self._save_dir, 'img_%04d%s' % (int(sn), ext))
-            job = ThreadDownloader(url, dst, self._timeout.get(), self._retry.get(), self.on_image_downloaded)
-            job.iid = iid  # attach a temporary attribute
-            self._downloaders.append(job)
-            job.start()
-            self._links.set(iid, column='state', value='...')
-        #
-        if len(self._downloaders) > 0:
-            self.after(100, self.update_progress)
-            return
+                job.report.failed_chapters.append(url)
+            if job.dedup is not None:
+                job.dedup.save()
+        job.state.close()
+        job.report.elapsed = time.time() - start
+        print(job.report)
+        return job.report
+
+    def crawl_chapter(self, url, dst, number, job):
+        """
+        Web page is parsed while it's downloading, and each image is queued as soon as it's found.
+        @param job: SeriesJob
+        @return: number of images in chapter, 0 if chapter isn't found.
+        """
+        report = job.report
+        if job.output == 'cbz' and os.path.exists(ChapterArchive.path_of(dst)):
+            with self._lock:
+                report.chapters += 1
+            return 1
+        url = url_quote(url)
+        handler_name = job.handler or urlparse(url).netloc
+        if handler_name not in HANDLERS:
+            return 0
+        os.makedirs(dst, exist_ok=True)
+        web_page = os.path.join(dst, WEB_PAGE)
+        archive = ChapterArchive(ChapterArchive.path_of(dst)) if job.output == 'cbz' else None
+        futures = dict()  # page number --> Future
+        handler = HANDLERS[handler_name]()
+
+        def on_image(sn, link):
+            if sn in futures:
+                return  # web page restarts
+            if archive is not None:
+                if archive.contains(sn):
+                    return  # done by last run
+                archive.expect(sn)
+            elif job.state.is_page_done(number, sn, dst):
+                return  # done by last run
+            futures[sn] = self.submit_image(link, dst, number, sn, archive, job)
+
+        def on_chunk(chunk):
+            if chunk is None:
+                handler.begin(on_image)
+            else:
+                handler.feed_bytes(chunk)
+
+        handler.begin(on_image)
+        page = self._scheduler.submit(url, self.fetch, url, web_page, on_chunk=on_chunk, compress=True).result()
+        links = handler.finish() if not page.is_failed() else []
+        futures = [futures[sn] for sn in sorted(futures.keys())]
+        failed = 0
+        for future in futures:
+            image = future.result()
+            with self._lock:
+                if image.is_successful():
+                    report.images += 1
+                    report.bytes += image.downloaded_size()
+                    report.banners += image.is_discarded()
+                else:
+                    report.failed_images.append(image._url)
+                    failed += 1
+        if archive is not None and not archive.close():
+            failed = max(failed, 1)
+        if len(links) == 0:
+            if len(os.listdir(dst)) == 0:
+                os.rmdir(dst)
+            return 0
+        job.state.finish_chapter(number, url, len(links), failed == 0)
+        with self._lock:
+            if failed > 0:
+                report.failed_chapters.append(url)
+            else:
+                report.chapters += 1
         # 任务全部下载完，无需保留网页
-        if len(self._links.get_children()) == 0:
-            os.remove(os.path.join(self._save_dir, MainWnd.WEB_PAGE))
-        # 如果不继续，提醒
-        if not self.can_automate_next():
-            self.after(100, self.notify_finish)
-            return
-        # 尝试下一链接
-        url, current = next(self._url_generator)
-        dst, current = next(self._dir_generator)
-        if url is None or dst is None:
-            self._url_generator = None
-            self._dir_generator = None
-            self.after(100, self.notify_finish)
-            return
-        # 正式下载下一链接
-        if not os.path.exists(dst):
-            os.mkdir(dst)
-        self._wildcard_from.set(current)
+        if failed == 0:
+            os.remove(web_page)
+            if archive is not None and len(os.listdir(dst)) == 0:
+                os.rmdir(dst)
+        return len(links)
+
+    def submit_image(self, url, dst_dir, chapter, sn, archive, job):
+        _, ext = url_image_name(url)
+        dst = os.path.join(dst_dir, 'img_%04d%s' % (sn, ext))
         url = url_quote(url)
-        self._save_dir = dst
-        job = ThreadDownloader(url=url, dst=os.path.join(dst, MainWnd.WEB_PAGE),
-                               timeout=self._timeout.get(), retry=self._retry.get(),
-                               callback=self.on_web_page_downloaded)
-        job.start()
-
-    def notify_finish(self):
-        self._running = False
-        self._btn.config(text='Download')
-        messagebox.showinfo(MainWnd.WND_TITLE, 'All segments are downloaded.')
+        callback = functools.partial(BatchCrawler.on_image_downloaded, chapter, sn, os.path.basename(dst_dir),
+                                     archive, job)
+        # low page number first: reading can start while chapter is downloading
+        return self._scheduler.submit_priority(url, sn, self.fetch, url, dst, callback, archive is not None,
+                                               dedup=job.dedup)
 
-    def on_choose_handler(self, _):
-        pass
-
-    def on_image_downloaded(self, job):
-        assert isinstance(job, ThreadDownloader)
-        if not job.is_downloaded():
-            return
-        filepath, filename = os.path.split(job._dst)
-        basename, ext = os.path.splitext(filename)
-        if ext != '.webp':
-            return
-        # 我的漫画软件不支持webp格式
-        job._dst = os.path.join(filepath, '{}.jpg'.format(basename))
-        with Image.open(BytesIO(job._content)) as img:
-            jpg_data = BytesIO()
-            img.convert('RGB').save(jpg_data, format='JPEG')
-            job._content = jpg_data.getvalue()
-
-    def can_automate_next(self):
-        if self._auto.get() is False:
-            return False
-        if len(self._links.get_children()) > 0:
-            return False
-        if self._url_generator is None or self._dir_generator is None:
-            return False
-        return True
+    @staticmethod
+    def on_image_downloaded(chapter, sn, chapter_name, archive, job, image):
+        # hash and first copy are of final image
+        if job.post_processor is not None:
+            job.post_processor.process(image)
+        else:
+            webp_to_jpeg(image)
+        if job.dedup is not None:
+            job.dedup.check(image, chapter_name)
+        if archive is not None:
+            archive_image(archive, sn, image)
+        if image.is_successful() or image.is_failed():
+            job.state.record_page(chapter, sn, image)
+
+
+def run_jobs(jobs, report_file=None, sync=False):
+    """
+    library entry point of headless crawling.
+    @param jobs: job file path, or its content (dict). See load_job_file.
+    @param report_file: optional path of summary report (JSON)
+    @param sync: sync series: only look for new chapters after the last one done
+    @return: list of CrawlReport
+    """
+    if isinstance(jobs, str):
+        jobs = load_job_file(jobs)
+    crawler = BatchCrawler(connections=jobs.get('connections', 8), per_host=jobs.get('per_host', 2),
+                           timeout=jobs.get('timeout', 10), retry=jobs.get('retry', 3),
+                           delay=jobs.get('delay', 0.5), max_delay=jobs.get('max_delay', 60.0),
+                           output=jobs.get('output', 'files'), dedup=jobs.get('dedup'), probe=jobs.get('probe', 1),
+                           post_process=jobs.get('post_process'), memory_budget=jobs.get('memory_budget', 0))
+    start = time.time()
+    reports = crawler.run(jobs['series'], sync)
+    report_file = report_file or jobs.get('report')
+    if report_file is not None:
+        summary = {'seconds': round(time.time() - start, 2),
+                   'series': [i.as_dict() for i in reports]}
+        with open(report_file, 'w', encoding='utf8') as file:
+            json.dump(summary, file, indent=2, ensure_ascii=False)
+    return reports
 
 
 def main():
-    try:
-        root = tk.Tk()
-        root.title(MainWnd.WND_TITLE)
-        MainWnd(root).pack(fill=tk.BOTH, expand=tk.YES, padx=5, pady=5)
-        root.mainloop()
-    except Exception as e:
-        print(e)
+    parser = argparse.ArgumentParser(description='Manga Crawler. GUI is shown if no job file is given.')
+    parser.add_argument('-j', '--job', help='job file (JSON, or YAML if PyYAML is installed)')
+    parser.add_argument('-r', '--report', help='summary report (JSON) written at the end')
+    parser.add_argument('-s', '--sync', action='store_true',
+                        help='sync series: retry chapters not done, and look for new chapters after the last one done')
+    args = parser.parse_args()
+    if args.job is not None:
+        reports = run_jobs(args.job, args.report, args.sync)
+        if any(len(i.failed_chapters) > 0 for i in reports):
+            sys.exit(1)
+        return
+    import MangaCrawlerGui  # Tk is needed by GUI only, not by job files run on a headless host
+    MangaCrawlerGui.main()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+Benchmark and replay harness of MangaCrawler, without hitting live sites.
+
+Recorded web pages and images are kept in a fixtures folder, one sub-folder per host:
+  fixtures/hachiraw.com/manga/foo/chapter-1/index.html
+  fixtures/cdn.hachiraw.com/images/0001.jpg
+They're served by a local HTTP server, which rewrites absolute links in web pages to itself,
+and can inject latency, 503 responses and dropped connections.
+
+  record: MangaCrawlerBench.py -f fixtures --record https://hachiraw.com/manga/foo/chapter-1
+  replay: MangaCrawlerBench.py -f fixtures --latency 0.05 --fail 0.02 \
+            --config '{"connections": 4}' --config '{"connections": 16, "per_host": 16, "output": "cbz"}'
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+import tracemalloc
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from io import StringIO
+from urllib.parse import urlparse, unquote
+
+import MangaCrawler
+from download_core import SESSION, METRICS, ThreadDownloader
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """
+    serve fixtures/<host>/<path> for request path /<host>/<path>
+    """
+    fixtures = None
+    latency = 0.0  # seconds before response
+    fail = 0.0     # ratio of requests answered by 503
+    drop = 0.0     # ratio of responses cut in the middle of body
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *a):
+        pass
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        if random.random() < self.fail:
+            self.send_response(503)
+            self.send_header('Retry-After', '1')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        path = os.path.normpath(os.path.join(self.fixtures, unquote(urlparse(self.path).path).lstrip('/')))
+        if not path.startswith(self.fixtures) or not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, 'rb') as ifo:
+            content = ifo.read()
+        if path.endswith('.html'):  # links to live sites --> links to replay server
+            local = 'http://%s:%d/' % self.server.server_address
+            content = re.sub(rb'https?://', local.encode(), content)
+        start = 0
+        match = re.match(r'bytes=(\d+)-', self.headers.get('Range', ''))
+        if match is not None and int(match.group(1)) < len(content):
+            start = int(match.group(1))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(content) - 1, len(content)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(content) - start))
+        self.end_headers()
+        if random.random() < self.drop:
+            self.wfile.write(content[start:start + (len(content) - start) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(content[start:])
+
+
+def serve(fixtures, latency, fail, drop, pipe):
+    ReplayHandler.fixtures = os.path.abspath(fixtures)
+    ReplayHandler.latency = latency
+    ReplayHandler.fail = fail
+    ReplayHandler.drop = drop
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ReplayHandler)
+    pipe.send(server.server_address[1])
+    server.serve_forever()
+
+
+def web_pages(fixtures):
+    """
+    @return: list of (handler's domain name, path of recorded web page)
+    """
+    pages = []
+    for host in sorted(os.listdir(fixtures)):
+        if host not in MangaCrawler.HANDLERS:
+            continue
+        for folder, _, files in os.walk(os.path.join(fixtures, host)):
+            pages.extend((host, os.path.join(folder, i)) for i in sorted(files) if i.endswith('.html'))
+    return pages
+
+
+def record(url, fixtures):
+    """
+    save a chapter web page and all its images into fixtures.
+    """
+    def download(link):
+        parts = urlparse(link)
+        path = parts.path if not parts.path.endswith('/') else parts.path + 'index.html'
+        dst = os.path.join(fixtures, parts.netloc, path.lstrip('/'))
+        if not os.path.splitext(dst)[1]:
+            dst = os.path.join(dst, 'index.html')
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        headers = {'User-Agent': ThreadDownloader.USER_AGENT}
+        with SESSION.open(MangaCrawler.url_quote(link), headers, 30, compress=True) as ifo, \
+                open(dst, 'wb') as ofo:
+            content = ifo.read()
+            ofo.write(content)
+        return content
+    content = download(url)
+    handler = MangaCrawler.HANDLERS[urlparse(url).netloc]()
+    with StringIO(content.decode(encoding='utf8')) as file:
+        links = handler.feed_file(file)
+    for i in links:
+        download(i)
+    print('%s: %d images recorded' % (url, len(links)))
+
+
+def bench_handlers(fixtures, rounds=20):
+    """
+    @return: pages/sec and images/sec of handlers parsing recorded web pages
+    """
+    pages = web_pages(fixtures)
+    contents = []
+    for host, path in pages:
+        with open(path, 'rb') as ifo:
+            contents.append((host, ifo.read()))
+    images = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for host, content in contents:
+            handler = MangaCrawler.HANDLERS[host]()
+            handler.begin()
+            handler.feed_bytes(content)
+            images += len(handler.finish())
+    elapsed = time.perf_counter() - start
+    return {'pages/sec': len(contents) * rounds / elapsed, 'images/sec': images / elapsed}
+
+
+def bench_download(fixtures, port, config):
+    """
+    crawl all recorded web pages from replay server through the full download path.
+    @param config: settings of job file, like {"connections": 8, "output": "cbz"}
+    """
+    output = tempfile.mkdtemp(prefix='manga_bench_')
+    series = []
+    for n, (host, path) in enumerate(web_pages(fixtures), start=1):
+        rel = os.path.relpath(path, fixtures).replace(os.sep, '/')
+        series.append({'name': rel, 'url': 'http://127.0.0.1:%d/%s' % (port, rel),
+                       'dir': os.path.join(output, 'series%04d' % n, 'chapter'), 'handler': host})
+    jobs = dict({'delay': 0, 'timeout': 10, 'retry': 3}, **config)
+    jobs['series'] = series
+    METRICS.reset()
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        reports = MangaCrawler.run_jobs(jobs)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        shutil.rmtree(output, ignore_errors=True)
+    images = sum(i.images for i in reports)
+    size = sum(i.bytes for i in reports)
+    return {'config': config,
+            'pages/sec': len(series) / elapsed,
+            'images/sec': images / elapsed,
+            'MB/s': size / 1024 / 1024 / elapsed,
+            'peak MB': peak / 1024 / 1024,
+            'failed images': sum(len(i.failed_images) for i in reports),
+            'metrics': METRICS.snapshot()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark MangaCrawler against recorded sites.')
+    parser.add_argument('-f', '--fixtures', required=True, help='folder of recorded web pages and images')
+    parser.add_argument('--record', action='append', default=[], help='record a chapter web page into fixtures')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before each response')
+    parser.add_argument('--fail', type=float, default=0.0, help='ratio of requests answered by 503')
+    parser.add_argument('--drop', type=float, default=0.0, help='ratio of responses cut in the middle')
+    parser.add_argument('--config', action='append', default=[], help='job file settings (JSON) to be compared')
+    parser.add_argument('-o', '--output', help='write results (JSON)')
+    args = parser.parse_args()
+    if len(args.record) > 0:
+        for url in args.record:
+            record(url, args.fixtures)
+        return
+    #
+    results = {'handlers': bench_handlers(args.fixtures), 'download': []}
+    print('handlers: %(pages/sec).1f pages/sec, %(images/sec).1f images/sec' % results['handlers'])
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    server = multiprocessing.Process(target=serve, args=(args.fixtures, args.latency, args.fail, args.drop, sender),
+                                     daemon=True)
+    server.start()
+    try:
+        port = receiver.recv()
+        for config in args.config or ['{}']:
+            result = bench_download(args.fixtures, port, json.loads(config))
+            results['download'].append(result)
+            print('%s: %.1f pages/sec, %.1f images/sec, %.2f MB/s, peak %.1f MB, %d failed, %d connections' % (
+                json.dumps(result['config']), result['pages/sec'], result['images/sec'], result['MB/s'],
+                result['peak MB'], result['failed images'], result['metrics'].get('connections', 0)))
+    finally:
+        server.terminate()
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf8') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+GUI of MangaCrawler: crawl a chapter, or chapters by a wild card URL, with live progress.
+Kept apart from MangaCrawler, so that job files run on a host without Tk.
+"""
+
+import tkinter as tk
+from tkinter import ttk, filedialog, messagebox
+import queue
+import os
+import functools
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlparse
+
+from MangaCrawler import HANDLERS, WEB_PAGE, url_image_name, url_quote, batch_jobs, webp_to_jpeg, archive_image, \
+    ChapterArchive, ImagePostProcessor
+from download_core import BUDGET, ThreadDownloader, HostScheduler
+
+
+class MainWnd(tk.Frame):
+    WND_TITLE = 'Manga Crawler'
+    WEB_PAGE = WEB_PAGE
+    READER_SIZE = (1072, 1448)  # Kindle PW2
+
+    def __init__(self, master, *a, **kw):
+        tk.Frame.__init__(self, master, *a, **kw)
+        #
+        frame = tk.Frame(self)
+        frame.pack(side=tk.TOP, expand=tk.NO, fill=tk.BOTH)
+        lbl = tk.Label(frame, text='URL:')
+        lbl.pack(side=tk.LEFT)
+        lbl.bind('<Double-Button-1>', lambda _: self._url.set(''))
+        self._url = tk.StringVar()
+        tk.Entry(frame, textvariable=self._url).pack(side=tk.LEFT, expand=tk.YES, fill=tk.X)
+        btn = tk.Button(frame, text='Download', command=self.onclick_analyze_url)  # download m3u8 file (index file)
+        btn.pack(side=tk.LEFT)
+        tk.Button(frame, text='Paste from CB', command=self.paste_from_clipboard).pack(side=tk.LEFT)
+        #
+        frame = tk.Frame(self)
+        frame.pack(side=tk.TOP, expand=tk.NO, fill=tk.BOTH)
+        tk.Label(frame, text='Dir:').pack(side=tk.LEFT)
+        self._tmp_dir = tk.StringVar()
+        tk.Entry(frame, textvariable=self._tmp_dir).pack(side=tk.LEFT, expand=tk.YES, fill=tk.X)
+        tk.Button(frame, text='Save to Dir', command=self.onclick_browse_dir).pack(side=tk.LEFT)
+        #
+        frame = tk.Frame(self)
+        frame.pack(side=tk.TOP, expand=tk.NO, fill=tk.BOTH)
+        tk.Label(frame, text='Wild Card Pattern:').pack(side=tk.LEFT)
+        self._wildcard_pattern = tk.StringVar(value='01')
+        tk.Entry(frame, textvariable=self._wildcard_pattern, width=4).pack(side=tk.LEFT, expand=tk.NO)
+        tk.Label(frame, text='Range:').pack(side=tk.LEFT)
+        self._wildcard_from = tk.IntVar(value=1)
+        tk.Spinbox(frame, textvariable=self._wildcard_from, from_=1, to=999, width=3).pack(side=tk.LEFT)
+        tk.Label(frame, text='-->').pack(side=tk.LEFT)
+        self._wildcard_to = tk.IntVar(value=99)
+        tk.Spinbox(frame, textvariable=self._wildcard_to, from_=1, to=999, width=3).pack(side=tk.LEFT)
+        #
+        frame = tk.Frame(self)
+        frame.pack(side=tk.TOP, expand=tk.NO, fill=tk.BOTH)
+        tk.Label(frame, text='Hanlder:').pack(side=tk.LEFT)
+        self._handlers = dict()
+        for domain_name, cls in HANDLERS.items():
+            self._handlers[domain_name] = cls()
+        self._active_handler = tk.StringVar()
+        tk.OptionMenu(frame, self._active_handler, *self._handlers.keys()).pack(side=tk.LEFT)
+        #
+        group = tk.LabelFrame(self, text='Links')
+        group.pack(side=tk.TOP, expand=tk.YES, fill=tk.BOTH)
+        # row 1 -- step 2
+        frame = tk.Frame(group, padx=5, pady=5)
+        frame.pack(side=tk.TOP, expand=tk.YES, fill=tk.BOTH)
+        self._links = ttk.Treeview(frame, selectmode=tk.EXTENDED, show='headings', columns=('sn', 'url', 'state'))
+        self._links.pack(side=tk.LEFT, expand=tk.YES, fill=tk.BOTH)
+        yscroll = tk.Scrollbar(frame, orient=tk.VERTICAL, command=self._links.yview)
+        yscroll.pack(side=tk.RIGHT, expand=tk.NO, fill=tk.Y)
+        self._links['yscrollcommand'] = yscroll.set
+        xscroll = tk.Scrollbar(group, orient=tk.HORIZONTAL, command=self._links.xview)
+        xscroll.pack(side=tk.TOP, expand=tk.NO, fill=tk.X)
+        self._links['xscrollcommand'] = xscroll.set
+        self._links.bind('<Key-K>', self.onkey_tree_delete)
+        self._links.bind('<1>', self.onkey_tree_click)
+        self._links.heading('sn', text='SN')
+        self._links.heading('url', text='URL')  # '#0' column is icon and it's hidden here
+        self._links.heading('state', text='State')    # we only need two columns: '#1' and '#2'
+        self._links.column('sn', width=40, stretch=False)
+        self._links.column('state', width=50, stretch=False, anchor=tk.CENTER)
+        #
+        frame = tk.Frame(group)
+        frame.pack(side=tk.TOP, expand=tk.NO, fill=tk.BOTH)
+        tk.Label(frame, text='Progress: ').pack(side=tk.LEFT)
+        self._progress = tk.IntVar()
+        self._progressbar = ttk.Progressbar(frame, mode='determinate', variable=self._progress)
+        self._progressbar.pack(side=tk.LEFT, expand=tk.YES, fill=tk.X)
+        tk.Label(frame, text='Reading:').pack(side=tk.LEFT)
+        self._cursor = tk.IntVar(value=0)  # page being read: pages near it come first. 0: low pages first
+        spinbox = tk.Spinbox(frame, textvariable=self._cursor, from_=0, to=999, width=3,
+                             command=self.reprioritize_jobs)
+        spinbox.pack(side=tk.LEFT)
+        spinbox.bind('<Return>', lambda _: self.reprioritize_jobs())
+        tk.Label(frame, text='Memory(MB):').pack(side=tk.LEFT)
+        self._memory = tk.IntVar(value=0)  # budget of images in flight. 0: no limit
+        tk.Spinbox(frame, textvariable=self._memory, from_=0, to=4096, increment=16, width=4).pack(side=tk.LEFT)
+        #
+        frame = tk.Frame(self)
+        frame.pack(side=tk.TOP, expand=tk.NO, fill=tk.BOTH)
+        tk.Button(frame, text='Read Local Web Page', command=self.load_local_web_page).pack(side=tk.LEFT)
+        tk.Label(frame, text='Threads:').pack(side=tk.LEFT)
+        self._job_num = tk.IntVar()
+        tk.Spinbox(frame, textvariable=self._job_num, from_=1, to=20, width=2).pack(side=tk.LEFT)
+        tk.Label(frame, text='Timeout:').pack(side=tk.LEFT)
+        self._timeout = tk.IntVar()
+        tk.Spinbox(frame, textvariable=self._timeout, from_=3, to=30, width=2).pack(side=tk.LEFT)
+        tk.Label(frame, text='Retry:').pack(side=tk.LEFT)
+        self._retry = tk.IntVar()
+        tk.Spinbox(frame, textvariable=self._retry, from_=1, to=30, width=2).pack(side=tk.LEFT)
+        tk.Label(frame, text='Delay:').pack(side=tk.LEFT)
+        self._delay = tk.DoubleVar(value=0.5)
+        tk.Spinbox(frame, textvariable=self._delay, from_=0, to=10, increment=0.1, width=3).pack(side=tk.LEFT)
+        self._btn = tk.Button(frame, text='Download Images', command=self.onclick_download_images)
+        self._btn.pack(side=tk.LEFT)
+        #
+        self._auto = tk.BooleanVar(value=True)
+        tk.Checkbutton(frame, text='Auto', variable=self._auto).pack(side=tk.RIGHT)
+        self._cbz = tk.BooleanVar(value=False)  # all images of a chapter go into a .cbz file
+        tk.Checkbutton(frame, text='CBZ', variable=self._cbz).pack(side=tk.RIGHT)
+        self._grey = tk.BooleanVar(value=False)  # images are shrunk for e-reader
+        tk.Checkbutton(frame, text='E-Reader', variable=self._grey).pack(side=tk.RIGHT)
+
+        self._job_queue = queue.PriorityQueue()  # (priority, sn, iid)
+        self._downloaders = []
+        self._running = False
+        self._url_generator = None
+        self._dir_generator = None
+        self._save_dir = None
+        self._throttle = None  # no worker: only used to slow down requests and back off
+        self._archive = None
+        self._post_processor = None
+        self._process_pool = None  # created when E-Reader is checked
+        self._job_total = 0
+        self._web_page_job = None
+        self._found_links = queue.Queue()  # (sn, url) found in web page which is downloading
+
+    def onclick_analyze_url(self):
+        url = self._url.get().strip()
+        dst = self._tmp_dir.get().strip()
+        if len(url) == 0 or len(dst) == 0:
+            return
+        wildcard_url = '(*)' in url
+        wildcard_dst = '(*)' in dst
+        if any([wildcard_url, wildcard_dst]) and not all([wildcard_url, wildcard_dst]):
+            messagebox.askquestion(MainWnd.WND_TITLE, 'wild card pattern not match')
+            return
+        if wildcard_url:
+            self._url_generator = batch_jobs(url, self._wildcard_from.get(), self._wildcard_to.get(), self._wildcard_pattern.get())
+            url, current = next(self._url_generator)
+            if url is None:
+                return
+        if wildcard_dst:
+            self._dir_generator = batch_jobs(dst, self._wildcard_from.get(), self._wildcard_to.get(), self._wildcard_pattern.get())
+            dst, current = next(self._dir_generator)
+            if dst is None:
+                return
+            else:
+                self._wildcard_from.set(current)
+        self.download_web_page(url, dst)
+
+    def download_web_page(self, url, dst):
+        """
+        Web page is parsed while it's downloading. Images found are shown (and queued if 'Auto') at once.
+        """
+        if not os.path.exists(dst):
+            os.mkdir(dst)
+        url = url_quote(url)
+        self._save_dir = dst
+        self._links.delete(*self._links.get_children())
+        on_chunk = None
+        netloc = urlparse(url).netloc
+        if netloc in HANDLERS:  # otherwise, choose a handler and read local web page
+            self._active_handler.set(netloc)
+            handler = HANDLERS[netloc]()
+            handler.begin(lambda sn, link: self._found_links.put((sn, link)))
+            on_chunk = functools.partial(self.on_web_page_chunk, handler)
+            self._web_page_job = ThreadDownloader(url=url, dst=os.path.join(dst, MainWnd.WEB_PAGE),
+                                                  timeout=self._timeout.get(), retry=self._retry.get(),
+                                                  callback=functools.partial(self.on_web_page_downloaded, handler),
+                                                  on_chunk=on_chunk, compress=True)
+            self.after(100, self.poll_found_links)
+        else:
+            self._web_page_job = ThreadDownloader(url=url, dst=os.path.join(dst, MainWnd.WEB_PAGE),
+                                                  timeout=self._timeout.get(), retry=self._retry.get(),
+                                                  compress=True)
+        self._web_page_job.start()
+
+    def on_web_page_chunk(self, handler, chunk):
+        """
+        called in downloader thread. Images found go to UI thread by queue.
+        """
+        if chunk is None:  # web page restarts
+            handler.begin(lambda sn, link: self._found_links.put((sn, link)))
+        else:
+            handler.feed_bytes(chunk)
+
+    def on_web_page_downloaded(self, handler, job: ThreadDownloader):
+        if job.is_failed():
+            messagebox.showerror(MainWnd.WND_TITLE, 'Failed to download web page:\n%s' % job._url)
+            return
+        if job.is_downloaded():
+            handler.finish()
+
+    def web_page_done(self):
+        return self._web_page_job is None or not self._web_page_job.is_alive()
+
+    def poll_found_links(self):
+        """
+        show images found in web page, until it's downloaded.
+        """
+        found = []
+        while not self._found_links.empty():
+            sn, url = self._found_links.get()
+            iid = 'I%04d' % sn
+            if self._links.exists(iid):  # web page restarts
+                continue
+            self._links.insert('', tk.END, iid=iid, values=(sn, url, ''))
+            found.append(iid)
+        if len(found) > 0 and self._auto.get():
+            if self._running:
+                for iid in found:
+                    self.enqueue_job(iid)
+            else:
+                self.enqueue_all_jobs()
+        if not self.web_page_done() or not self._found_links.empty():
+            self.after(100, self.poll_found_links)
+
+    def load_local_web_page(self):
+        dst = self._tmp_dir.get().strip()
+        if len(dst) == 0 or '(*)' in dst:
+            return
+        web_page = os.path.join(dst.strip(), MainWnd.WEB_PAGE)
+        if not os.path.exists(web_page):
+            return
+        active_handler = self._active_handler.get()
+        if len(active_handler) == 0:
+            messagebox.askquestion(MainWnd.WND_TITLE, 'Web content cannot be parsed without handler specified')
+            return
+        self._save_dir = dst.strip()
+        with open(web_page) as file:
+            self.load_links(file, active_handler)
+
+    def load_links(self, file_obj, active_handler):
+        links = self._handlers[active_handler].feed_file(file_obj)
+        self._links.delete(*self._links.get_children())
+        for i, url in enumerate(links, start=1):
+            iid = 'I%04d' % i
+            self._links.insert('', tk.END, iid=iid, values=(i, url, ''))
+        if self._auto.get():
+            self.enqueue_all_jobs()
+
+    def paste_from_clipboard(self):
+        url = self.clipboard_get().strip()
+        if len(url) > 0:
+            self._url.set(url)
+
+    def onclick_browse_dir(self):
+        a_dir = filedialog.askdirectory()
+        if a_dir == '':
+            return
+        self._tmp_dir.set(a_dir)
+
+    def onkey_tree_delete(self, _):
+        # keep treeview items intact when downloading, because jobs are in queue.
+        if self._running:
+            return
+        #
+        selected = self._links.selection()
+        num = len(selected)
+        if num == 0:
+            return
+        if num == 1:
+            msg = 'Are you sure to delete\n\n%s\n\n?' % selected[0]
+        else:
+            msg = 'Are you sure to delete %d jobs?' % num
+        if not messagebox.askokcancel(MainWnd.WND_TITLE, msg):
+            return
+        self._links.delete(*selected)
+
+    def onkey_tree_click(self, _):
+        selected = self._links.selection()
+        if len(selected) == 0:
+            return
+        _, url, _ = self._links.item(selected[0], 'values')
+        self.clipboard_clear()
+        self.clipboard_append(url)
+
+    def onclick_download_images(self):
+        if self._running:
+            self._running = False   # global signal to stop running jobs
+            self._btn.config(text='Download')
+            for i in self._downloaders:
+                i.join()
+            self._downloaders[:] = []
+            self.close_archive()
+            return
+        #
+        self.enqueue_all_jobs()
+
+    def enqueue_all_jobs(self):
+        urls = self._links.get_children()
+        if len(urls) == 0:
+            return
+        #
+        self._running = True
+        self._btn.config(text='Cancel')
+        #
+        self.clear_queue()
+        self.close_archive()
+        if self._cbz.get():
+            self._archive = ChapterArchive(ChapterArchive.path_of(self._save_dir))
+        self._post_processor = None
+        if self._grey.get():
+            if self._process_pool is None:
+                self._process_pool = ProcessPoolExecutor()
+            self._post_processor = ImagePostProcessor(self._process_pool, *MainWnd.READER_SIZE)
+        self._progress.set(0)
+        self._job_total = 0
+        for i in urls:
+            self.enqueue_job(i)
+        self._throttle = HostScheduler(workers=0, delay=self._delay.get())
+        BUDGET.set_limit(self._memory.get() * 1024 * 1024)
+        #
+        self.after(100, self.update_progress)
+
+    def enqueue_job(self, iid):
+        sn = int(self._links.set(iid, column='sn'))
+        if self._archive is not None:
+            if self._archive.contains(sn):
+                self._links.delete(iid)  # done by last run
+                return
+            self._archive.expect(sn)
+        self._job_queue.put((self.page_priority(sn), sn, iid))
+        self._links.set(iid, column='state', value='')
+        self._job_total += 1
+        self._progressbar.config(maximum=self._job_total)
+
+    def page_priority(self, sn):
+        """
+        @return: smaller value is downloaded first
+        """
+        try:
+            cursor = self._cursor.get()
+        except tk.TclError:  # being edited
+            cursor = 0
+        if cursor <= 0:
+            return sn
+        # reading cursor: pages ahead of it come before pages behind it at the same distance
+        return abs(sn - cursor) * 2 + (sn < cursor)
+
+    def reprioritize_jobs(self):
+        """
+        reading cursor moves: queued jobs are reordered.
+        """
+        jobs = []
+        while not self._job_queue.empty():
+            jobs.append(self._job_queue.get())
+        for _, sn, iid in jobs:
+            self._job_queue.put((self.page_priority(sn), sn, iid))
+
+    def clear_queue(self):
+        self._downloaders[:] = []
+        while not self._job_queue.empty():
+            self._job_queue.get()
+
+    def update_progress(self):
+        """
+        update UI
+        """
+        if not self._running:
+            return
+
+        finished = 0
+        for i in self._downloaders[:]:
+            if i.isAlive():
+                continue
+            # visualize task state: completion or failure
+            if i.is_successful():
+                self._links.delete(i.iid)
+            else:
+                self._links.set(i.iid, column='state', value='X')
+            self._downloaders.remove(i)
+            finished += 1
+        if finished > 0:
+            self._progress.set(self._progress.get() + finished)
+        #
+        free_slots = max(self._job_num.get() - len(self._downloaders), 0)
+        to_be_added = min(free_slots, self._job_queue.qsize())
+        for i in range(0, to_be_added):
+            _, _, iid = self._job_queue.get()
+            #  [ Important Point about ttk.Treeview ]
+            # no matter what type it was when inserted into 'values',
+            # it is str of type now when being retrieved.
+            #
+            # In short, be careful of below 'sn' in this app.
+            sn, url, state = self._links.item(iid, 'values')
+            _, ext = url_image_name(url)
+            url = url_quote(url)
+            dst = os.path.join(self._save_dir, 'img_%04d%s' % (int(sn), ext))
+            job = ThreadDownloader(url, dst, self._timeout.get(), self._retry.get(), self.on_image_downloaded,
+                                   throttle=self._throttle, in_memory=self._archive is not None)
+            job.iid = iid  # attach a temporary attribute
+            job.sn = int(sn)
+            self._downloaders.append(job)
+            job.start()
+            self._links.set(iid, column='state', value='...')
+        #
+        if len(self._downloaders) > 0 or not self.web_page_done() or not self._found_links.empty():
+            self.after(100, self.update_progress)
+            return
+        cbz = self.close_archive()
+        # 任务全部下载完，无需保留网页
+        if len(self._links.get_children()) == 0:
+            os.remove(os.path.join(self._save_dir, MainWnd.WEB_PAGE))
+            if cbz and len(os.listdir(self._save_dir)) == 0:
+                os.rmdir(self._save_dir)
+        # 如果不继续，提醒
+        if not self.can_automate_next():
+            self.after(100, self.notify_finish)
+            return
+        # 尝试下一链接
+        url, current = next(self._url_generator)
+        dst, current = next(self._dir_generator)
+        if url is None or dst is None:
+            self._url_generator = None
+            self._dir_generator = None
+            self.after(100, self.notify_finish)
+            return
+        # 正式下载下一链接
+        self._wildcard_from.set(current)
+        self._running = False  # restarted by links found in next web page
+        self._btn.config(text='Download')
+        self.download_web_page(url, dst)
+
+    def notify_finish(self):
+        self._running = False
+        self._btn.config(text='Download')
+        messagebox.showinfo(MainWnd.WND_TITLE, 'All segments are downloaded.')
+
+    def on_choose_handler(self, _):
+        pass
+
+    def on_image_downloaded(self, job):
+        if self._post_processor is not None:
+            self._post_processor.process(job)
+        else:
+            # 我的漫画软件不支持webp格式
+            webp_to_jpeg(job)
+        if self._archive is not None:
+            archive_image(self._archive, job.sn, job)
+
+    def close_archive(self):
+        """
+        @return: True if chapter archive is complete
+        """
+        if self._archive is None:
+            return False
+        archive, self._archive = self._archive, None
+        return archive.close()
+
+    def can_automate_next(self):
+        if self._auto.get() is False:
+            return False
+        if len(self._links.get_children()) > 0:
+            return False
+        if self._url_generator is None or self._dir_generator is None:
+            return False
+        return True
+
+
+def main():
+    try:
+        root = tk.Tk()
+        root.title(MainWnd.WND_TITLE)
+        MainWnd(root).pack(fill=tk.BOTH, expand=tk.YES, padx=5, pady=5)
+        root.mainloop()
+    except Exception as e:
+        print(e)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,73 +1,560 @@
-﻿#!/usr/bin/python
+#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
 """
   Resynchronize subtitles for specified range.
-  Only SRT and ASS format supported at present.
+  SRT, ASS/SSA and WebVTT formats supported, and converted to each other.
 
   Jia Xiaodong
   2016.05.14: srt format
   2018.09.14: ass format, file encoding detection
-  tested against Python 2.7 on Windows/Mac OSX
+  2026.10: ported to Python 3
 """
 
 import logging
-import Tkinter as tk, ttk
-import tkFileDialog, tkMessageBox
-import datetime
 import re
 import codecs, io
+import array
+import bisect
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+try:
+    import numpy  # optional: vectorized time operations
+except ImportError:
+    numpy = None
 
 logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', datefmt='%H:%M:%S', level=logging.INFO)
 
-class SubtitleItem(object):
+class TimeTable(object):
+    """
+    Start times and end times (milliseconds) of all subtitles, kept in two int64 arrays next to subtitle texts,
+    instead of an object with two timestamps per subtitle.
+    Shift, scale and removal of a range are single vectorized operations if NumPy is installed,
+    or slice assignments of array.array if not.
+    """
+    TYPECODE = 'q'
+
     def __init__(self):
+        self.starts = array.array(TimeTable.TYPECODE)
+        self.ends = array.array(TimeTable.TYPECODE)
+        self.index = None  # see build_index(), dropped whenever times are changed
+
+    def __len__(self):
+        return len(self.starts)
+
+    def append(self, start, end):
         """
-        contains a subtitle (can be multi-lined by '\n') and its start time and end time (precision of millisecond)
+        called while parsing. array.array grows cheaply, so it's converted to NumPy in freeze().
         """
-        self.time_start = self.time_end = None
+        self.starts.append(start)
+        self.ends.append(end)
 
-    @property
-    def ts(self):
-        return self.time_start, self.time_end
+    def freeze(self):
+        """
+        parsing is done
+        """
+        self.index = None
+        if numpy is not None:
+            self.starts = numpy.array(self.starts, dtype=numpy.int64)
+            self.ends = numpy.array(self.ends, dtype=numpy.int64)
+
+    def get(self, idx):
+        return int(self.starts[idx]), int(self.ends[idx])
+
+    def shift(self, frm, to, ms):
+        """
+        @param frm, to: slice of subtitles, 0-based and 'to' excluded
+        @param ms: milliseconds
+        """
+        self.index = None
+        if numpy is not None:
+            self.starts[frm:to] += ms
+            self.ends[frm:to] += ms
+            return
+        for times in (self.starts, self.ends):
+            times[frm:to] = array.array(TimeTable.TYPECODE, [t + ms for t in times[frm:to]])
+
+    def scale(self, frm, to, factor, anchor=0):
+        """
+        t --> anchor + (t - anchor) * factor, e.g. framerate conversion 25 / 23.976
+        @param anchor: milliseconds, which isn't moved
+        """
+        self.index = None
+        if numpy is not None:
+            for times in (self.starts, self.ends):
+                times[frm:to] = numpy.rint((times[frm:to] - anchor) * factor) + anchor
+            return
+        for times in (self.starts, self.ends):
+            times[frm:to] = array.array(TimeTable.TYPECODE,
+                                        [int(round((t - anchor) * factor)) + anchor for t in times[frm:to]])
 
-    def delay(self, value):
+    def warp(self, indices, targets):
         """
-        @param value: is object of datetime.timedelta
+        Piecewise linear time map, e.g. framerate drift plus ad breaks, in one pass over all subtitles.
+        Start time of subtitle indices[k] is moved to targets[k]. Subtitles between two anchors are mapped by
+        the line through them; those before the first (after the last) anchor by the first (last) line.
+        A single anchor is a constant shift.
+        @param indices: 0-based, ascending
+        @param targets: milliseconds
+        @return: segments of the map, see residues()
         """
-        self.time_start += value
-        self.time_end += value
+        sources = [int(self.starts[i]) for i in indices]
+        slopes = TimeTable.slopes(indices, sources, targets)
+        segments = [(indices[k] if k > 0 else 0, indices[k + 1] if k + 1 < len(slopes) else len(self),
+                     sources[k], targets[k], slope) for k, slope in enumerate(slopes)]
+        self.index = None
+        if numpy is not None:
+            # segment of each subtitle: indices[k] <= idx < indices[k + 1]
+            segment = numpy.searchsorted(numpy.asarray(indices), numpy.arange(len(self)), 'right') - 1
+            segment = numpy.clip(segment, 0, len(slopes) - 1)
+            x = numpy.asarray(sources, dtype=numpy.int64)[segment]
+            y = numpy.asarray(targets, dtype=numpy.int64)[segment]
+            slope = numpy.asarray(slopes)[segment]
+            self.starts = numpy.rint((self.starts - x) * slope).astype(numpy.int64) + y
+            self.ends = numpy.rint((self.ends - x) * slope).astype(numpy.int64) + y
+            return segments
+        for frm, to, x, y, slope in segments:
+            for times in (self.starts, self.ends):
+                times[frm:to] = array.array(TimeTable.TYPECODE,
+                                            [int(round((t - x) * slope)) + y for t in times[frm:to]])
+        return segments
+
+    @staticmethod
+    def slopes(indices, sources, targets):
+        """
+        @param sources: start times of anchored subtitles before mapped
+        @return: slope of each segment between two anchors, see warp()
+        """
+        if len(indices) == 1:
+            return [1.0]  # constant shift
+        slopes = []
+        for k in range(len(indices) - 1):
+            if sources[k + 1] <= sources[k]:
+                raise ValueError('subtitles %d and %d are not in time order' % (indices[k] + 1, indices[k + 1] + 1))
+            slopes.append(float(targets[k + 1] - targets[k]) / (sources[k + 1] - sources[k]))
+        return slopes
+
+    def remove(self, frm, to):
+        """
+        @return: times removed, see insert()
+        """
+        self.index = None
+        if numpy is not None:
+            removed = self.starts[frm:to].copy(), self.ends[frm:to].copy()
+            self.starts = numpy.delete(self.starts, numpy.s_[frm:to])
+            self.ends = numpy.delete(self.ends, numpy.s_[frm:to])
+            return removed
+        removed = self.starts[frm:to], self.ends[frm:to]
+        del self.starts[frm:to]
+        del self.ends[frm:to]
+        return removed
+
+    def insert(self, frm, starts, ends):
+        """
+        undo of remove()
+        """
+        self.index = None
+        if numpy is not None:
+            self.starts = numpy.insert(self.starts, frm, starts)
+            self.ends = numpy.insert(self.ends, frm, ends)
+            return
+        self.starts[frm:frm] = starts
+        self.ends[frm:frm] = ends
+
+    def snapshot(self):
+        """
+        @return: copies of all times, for undo of changes which can't be reversed exactly (rounded)
+        """
+        if numpy is not None:
+            return self.starts.copy(), self.ends.copy()
+        return self.starts[:], self.ends[:]
+
+    def restore(self, snapshot):
+        self.index = None
+        self.starts, self.ends = snapshot
+
+    def inverse(self, segments):
+        """
+        @param segments: see residues()
+        @return: copies of start times and end times mapped back by inverse lines, before residues are added
+        """
+        result = []
+        for times in (self.starts, self.ends):
+            times = times.copy() if numpy is not None else times[:]
+            for frm, to, x, y, slope in segments:
+                if numpy is not None:
+                    times[frm:to] = numpy.rint((times[frm:to] - y) / slope) + x
+                else:
+                    times[frm:to] = array.array(TimeTable.TYPECODE,
+                                                [int(round((t - y) / slope)) + x for t in times[frm:to]])
+            result.append(times)
+        return result
+
+    def residues(self, segments, snapshot):
+        """
+        Undo of scale and warp by their lines, instead of a snapshot of all times: inverse lines miss times
+        before only by rounding, which are few unless times are compressed much, e.g. by 23.976 / 25.
+        @param segments: list of (frm, to, x, y, slope), times[frm:to] were mapped by t --> (t - x) * slope + y
+        @param snapshot: times before they were mapped
+        @return: (indices, differences) of start times and of end times where inverse lines miss,
+                 or None if lines can't be inverted or residues are more than times
+        """
+        if any(slope == 0 for _, _, _, _, slope in segments):
+            return None
+        residues = []
+        for before, after in zip(snapshot, self.inverse(segments)):
+            if numpy is not None:
+                diff = before - after
+                indices = numpy.flatnonzero(diff)
+                residues.append((indices, diff[indices]))
+            else:
+                indices = array.array(TimeTable.TYPECODE, [i for i, t in enumerate(after) if t != before[i]])
+                residues.append((indices, array.array(TimeTable.TYPECODE, [before[i] - after[i] for i in indices])))
+        if sum(len(indices) for indices, _ in residues) > len(self):
+            return None
+        return residues
+
+    def unmap(self, segments, residues):
+        """
+        undo of scale() or warp() exactly, see residues()
+        """
+        self.index = None
+        self.starts, self.ends = self.inverse(segments)
+        for times, (indices, diff) in zip((self.starts, self.ends), residues):
+            if numpy is not None:
+                times[indices] += diff
+                continue
+            for i, d in zip(indices, diff):
+                times[i] += d
+
+    def tolist(self):
+        """
+        @return: lists of start times and end times, which are fast to iterate when saving
+        """
+        return self.starts.tolist(), self.ends.tolist()
+
+    def build_index(self):
+        """
+        Subtitles sorted by start time (events of ASS needn't be), and a max-tree of their end times,
+        so that subtitles shown at a time are found by bisect and tree descent instead of a linear scan,
+        even if they overlap or a sign lasts whole video.
+        @return: (order, sorted start times, tree, leaf count), order[k] is index of k-th subtitle started
+        """
+        if self.index is not None:
+            return self.index
+        starts, ends = self.tolist()
+        if numpy is not None:
+            order = numpy.argsort(self.starts, kind='mergesort').tolist()
+        else:
+            order = sorted(range(len(starts)), key=starts.__getitem__)
+        size = 1
+        while size < len(order):
+            size *= 2
+        # node i covers children 2i and 2i+1, leaves are from tree[size]
+        tree = [-sys.maxsize] * size + [ends[i] for i in order] + [-sys.maxsize] * (size - len(order))
+        for i in range(size - 1, 0, -1):
+            tree[i] = max(tree[2 * i], tree[2 * i + 1])
+        self.index = (order, [starts[i] for i in order], tree, size)
+        return self.index
+
+    def at(self, ms):
+        """
+        @return: indices of subtitles shown at ms (start <= ms < end), latest started first
+        """
+        order, starts, tree, size = self.build_index()
+        count = bisect.bisect_right(starts, ms)  # subtitles started
+        found = []
+        stack = [(1, 0, size)]
+        while stack:
+            node, lo, hi = stack.pop()
+            if lo >= count or tree[node] <= ms:
+                continue
+            if node >= size:
+                found.append(order[lo])
+                continue
+            mid = (lo + hi) // 2
+            stack.append((2 * node, lo, mid))
+            stack.append((2 * node + 1, mid, hi))
+        return found
+
+    def find(self, ms):
+        """
+        @return: index of subtitle shown at ms, or the next one if none is shown (the last one after all), or -1
+        """
+        found = self.at(ms)
+        if found:
+            return found[0]
+        order, starts, _, _ = self.build_index()
+        if len(order) == 0:
+            return -1
+        return order[min(bisect.bisect_right(starts, ms), len(order) - 1)]
+
+    def sweep(self, min_gap=0):
+        """
+        overlaps and gaps of all subtitles in one pass by start time
+        @param min_gap: milliseconds
+        @return: indices of subtitles started while an earlier one is still shown,
+                 and (index, milliseconds) of gaps not shorter than min_gap before a subtitle
+        """
+        order, starts, _, _ = self.build_index()
+        ends = self.ends.tolist()
+        overlaps, gaps = [], []
+        shown_until = None
+        for start, i in zip(starts, order):
+            if shown_until is None:
+                shown_until = ends[i]
+                continue
+            if start < shown_until:
+                overlaps.append(i)
+            elif start - shown_until >= min_gap:
+                gaps.append((i, start - shown_until))
+            shown_until = max(shown_until, ends[i])
+        return overlaps, gaps
 
 
 class Formatter(object):
+    SNIFF_SIZE = 1 << 16
+    # tried in turn if file has no BOM, when a guess by sample fails
+    ENCODINGS = ('utf-8', 'utf-16', 'utf-32', 'gb2312', 'big5', 'big5hkscs', 'gbk', 'gb18030')
+    ENCODING = None  # encoding required by format, e.g. UTF-8 of WebVTT
+    UNDO_LEVELS = 100
+    # frequent characters and words in Chinese subtitles, both simplified and traditional, see cjk_score()
+    COMMON_HANZI = '的一是不了我你他她们們这這个個在有人来來到说說就要没沒么麼好吗嗎什那会會去'
+    COMMON_BIGRAMS = ('我们', '我們', '你们', '你們', '他们', '他們', '什么', '什麼', '怎么', '怎麼',
+                      '没有', '沒有', '这个', '這個', '现在', '現在', '一个', '一個', '知道', '不是')
+
     def __init__(self):
-        self.subtitles = []
+        self.times = TimeTable()
+        self.texts = []  # texts of subtitles, in the same order as self.times
+        self.newline = '\r\n'  # line ending of file read, for index, timing and header lines if endings are kept
+        # undo records, latest last. They are small deltas: ('shift', frm, to, ms),
+        # ('remove', frm, starts, ends, texts), or ('map', segments, residues) for scale and warp,
+        # which is ('times', snapshot of times) if it can't be inverted, see TimeTable.residues
+        self.journal = []
 
     def parse(self):
-        self.subtitles = []
+        self.times = TimeTable()
+        self.texts = []
+        self.journal = []
+
+    def record(self, entry):
+        self.journal.append(entry)
+        del self.journal[:-Formatter.UNDO_LEVELS]
+
+    def record_map(self, segments, snapshot):
+        """
+        @param snapshot: times before they were mapped by segments
+        """
+        residues = self.times.residues(segments, snapshot)
+        self.record(('times', snapshot) if residues is None else ('map', segments, residues))
+
+    def undo(self):
+        """
+        @return: False if there's nothing to undo
+        """
+        if len(self.journal) == 0:
+            return False
+        entry = self.journal.pop()
+        if entry[0] == 'shift':
+            _, frm, to, shift = entry
+            self.times.shift(frm - 1, to, -shift)
+        elif entry[0] == 'remove':
+            frm, starts, ends, texts = entry[1:5]  # a format may record more after them, see AssFormatter
+            self.times.insert(frm - 1, starts, ends)
+            self.texts[frm - 1:frm - 1] = texts
+        elif entry[0] == 'map':
+            self.times.unmap(entry[1], entry[2])
+        elif entry[0] == 'times':
+            self.times.restore(entry[1])
+        return True
+
+    def cues(self, lines):
+        """
+        generator of (start, end, text) of subtitles, so that a huge file is processed one subtitle by one
+        @param lines: any iterable of lines, e.g. a file object
+        """
+        return iter([])
+
+    def track_newline(self, lines):
+        """
+        line ending of first line is taken as self.newline
+        @return: lines, from the first one
+        """
+        lines = iter(lines)
+        first = next(lines, '')
+        self.newline = '\n' if first.endswith('\n') and not first.endswith('\r\n') else '\r\n'
+        return itertools.chain((first,), lines)
+
+    def head_text(self):
+        return ''
+
+    def cue_text(self, no, start, end, text):
+        """
+        @param no: subtitle's order in file written
+        @return: a subtitle formatted, ended by line ending
+        """
+        return ''
+
+    def tail_text(self):
+        """
+        @return: lines after last subtitle, ended by line ending
+        """
+        return ''
+
+    def write_head(self, fo, encoding='utf-8', newline='\r\n'):
+        """
+        incremental writer, see stream_resync
+        """
+        encoding = self.ENCODING or encoding
+        fo.write(Formatter.bom(encoding) + Formatter.encode(Formatter.newlines(self.head_text(), newline), encoding))
+
+    def write_cue(self, fo, no, start, end, text, encoding='utf-8', newline='\r\n'):
+        fo.write(Formatter.encode(Formatter.newlines(self.cue_text(no, start, end, text), newline),
+                                  self.ENCODING or encoding))
+
+    def write_tail(self, fo, encoding='utf-8', newline='\r\n'):
+        fo.write(Formatter.encode(Formatter.newlines(self.tail_text(), newline), self.ENCODING or encoding))
+
+    def dumps(self, source, encoding='utf-8', newline='\r\n'):
+        """
+        Whole file is joined and encoded once, instead of encoding and writing a few pieces per subtitle.
+        @param source: Formatter whose subtitles are written in this format, may be self
+        @param newline: see newlines()
+        @return: bytes of file
+        """
+        encoding = self.ENCODING or encoding
+        self.newline = source.newline
+        starts, ends = source.times.tolist()
+        cue_text, convert = self.cue_text, self.convert
+        content = ''.join([self.head_text()] + [cue_text(i + 1, starts[i], ends[i], convert(text, source))
+                                                for i, text in enumerate(source.texts)] + [self.tail_text()])
+        return Formatter.bom(encoding) + Formatter.encode(Formatter.newlines(content, newline), encoding)
 
     def shift_ts(self, frm, to, shift):
-        for i in range(frm - 1, to):
-            self.subtitles[i].delay(shift)
+        """
+        @param shift: milliseconds
+        """
+        self.times.shift(frm - 1, to, shift)
+        self.record(('shift', frm, to, shift))
+
+    def scale_ts(self, frm, to, factor, anchor=0, shift=0):
+        """
+        t --> anchor + (t - anchor) * factor + shift, undone as one step
+        """
+        snapshot = self.times.snapshot()
+        self.times.scale(frm - 1, to, factor, anchor)
+        if shift:
+            self.times.shift(frm - 1, to, shift)
+        self.record_map([(frm - 1, to, anchor, anchor + shift, factor)], snapshot)
+
+    def warp_ts(self, anchors):
+        """
+        @param anchors: list of (subtitle's order, milliseconds)
+        """
+        anchors = sorted(anchors)
+        orders = [n for n, _ in anchors]
+        if len(anchors) == 0 or orders[0] < 1 or orders[-1] > len(self.times):
+            raise ValueError('anchors out of range 1 - %d' % len(self.times))
+        if len(set(orders)) != len(orders):
+            raise ValueError('duplicated anchors')
+        snapshot = self.times.snapshot()
+        segments = self.times.warp([n - 1 for n in orders], [ms for _, ms in anchors])
+        self.record_map(segments, snapshot)
 
     def remove_sub(self, frm, to):
-        self.subtitles = self.subtitles[:frm - 1] + self.subtitles[to:]
+        starts, ends = self.times.remove(frm - 1, to)
+        self.record(('remove', frm, starts, ends, self.texts[frm - 1:to]))
+        del self.texts[frm - 1:to]
 
-    def save(self, filename, encoding='utf-8'):
-        pass
+    def save(self, filename, encoding='utf-8', newline='\r\n'):
+        Formatter.write_atomic(filename, self.dumps(self, encoding, newline))
 
     def subtitles_count(self):
-        return len(self.subtitles)
+        return len(self.texts)
+
+    def pure_sub(self, idx):
+        return self.texts[idx]
+
+    def to_plain(self, text):
+        """
+        @param text: text of a subtitle in this format
+        @return: common text of subtitle for conversion: lines joined by '\n', with <i>, <b> and <u> tags
+        """
+        return text.replace('\r\n', '\n').rstrip('\n')
+
+    def from_plain(self, text):
+        """
+        @return: text of a subtitle in this format
+        """
+        lines = [line for line in text.split('\n') if line.strip()]  # a blank line ends subtitle of SRT
+        return ''.join(line + self.newline for line in lines)
+
+    def convert(self, text, source):
+        """
+        @param source: Formatter which text is read by
+        @return: text of a subtitle in this format
+        """
+        if type(source) is type(self):
+            return text
+        return self.from_plain(source.to_plain(text))
+
+    def passed_lines(self, text):
+        """
+        @param text: text of a subtitle in this format
+        @return: lines before it which aren't subtitles but written unchanged, e.g. comments of ASS
+        """
+        return ''
+
+    def keep_passed(self, lines, text=None):
+        """
+        lines passed through before removed subtitles are written before the next one
+        @param text: text of the next subtitle, None if they are after all subtitles
+        @return: text of the next subtitle with them
+        """
+        return text
 
     @staticmethod
-    def write_file_bom(fo, encoding):
+    def bom(encoding):
         for bom, encodings in\
             (codecs.BOM_UTF8,     ('utf-8-sig',)),\
             (codecs.BOM_UTF16_LE, ('utf-16', 'utf-16-le')),\
             (codecs.BOM_UTF16_BE, ('utf-16-be',)):
             if any(e == encoding for e in encodings):
-                fo.write(bom)
-                return
+                return bom
+        return b''
+
+    @staticmethod
+    def newlines(content, newline):
+        """
+        @param newline: '\r\n' or '\n' for all lines, or None to keep line endings as read,
+                        where lines made by formatter, e.g. index and timing of SRT, end by its newline
+        """
+        if newline is None:
+            return content
+        content = content.replace('\r\n', '\n')
+        return content if newline == '\n' else content.replace('\n', newline)
+
+    @staticmethod
+    def write_atomic(filename, data):
+        """
+        written to a temporary file next to it, which then replaces it, so a crash never leaves a half-written file
+        """
+        temp = filename + '.tmp'
+        try:
+            with open(temp, 'wb') as fo:
+                fo.write(data)
+                fo.flush()
+                os.fsync(fo.fileno())
+            os.replace(temp, filename)
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
 
     @staticmethod
     def detect_encoding_by_bom(bytes):
@@ -79,80 +566,182 @@ class Formatter(object):
                 return enc
         return None
 
+    @staticmethod
+    def sniff(prefix, final=False):
+        """
+        Guess encoding by a sample instead of decoding whole file by each codec in turn:
+        BOM, then zero bytes of UTF-16/32 without BOM, then UTF-8, then GB or Big5 by frequent Chinese characters.
+        GB18030 and Big5-HKSCS are returned for their families, as they decode all files of GB2312/GBK and Big5.
+        @param prefix: first bytes of file, may end in the middle of a character
+        @param final: prefix is whole file
+        @return: encoding
+        """
+        encoding = Formatter.detect_encoding_by_bom(prefix)
+        if encoding:
+            return encoding
+        sample = prefix[:4096]
+        quarter = len(sample) // 4
+        if quarter > 0:
+            zeros = [sample[i::4].count(b'\x00') for i in range(4)]
+            if min(zeros[2:]) > quarter * 0.9:  # two high bytes of UTF-32 are zeros in BMP
+                return 'utf-32-le'
+            if min(zeros[:2]) > quarter * 0.9:
+                return 'utf-32-be'
+            even, odd = zeros[0] + zeros[2], zeros[1] + zeros[3]
+            if odd > quarter * 0.6 and even < quarter * 0.1:  # ASCII of UTF-16 is half zeros
+                return 'utf-16-le'
+            if even > quarter * 0.6 and odd < quarter * 0.1:
+                return 'utf-16-be'
+        try:
+            codecs.getincrementaldecoder('utf-8')().decode(prefix, final)
+            return 'utf-8'
+        except UnicodeDecodeError:
+            pass
+        best = None
+        for enc in ('gb18030', 'big5hkscs'):
+            try:
+                score = Formatter.cjk_score(codecs.getincrementaldecoder(enc)().decode(prefix, final))
+            except UnicodeDecodeError:
+                continue
+            if best is None or score > best[0]:
+                best = (score, enc)
+        if best is None:
+            raise Exception('UnicodeDecodeError', 'cannot decode file content')
+        return best[1]
+
+    @staticmethod
+    def cjk_score(text):
+        """
+        Bytes of Big5 are mostly valid GB18030 and vice versa, but decoded by wrong codec they are rare characters.
+        @return: frequent characters and words per non-ASCII character
+        """
+        chars = sum(text.count(c) for c in Formatter.COMMON_HANZI)
+        bigrams = sum(text.count(w) for w in Formatter.COMMON_BIGRAMS)
+        non_ascii = len(text) - len(text.encode('ascii', 'ignore'))
+        return (chars + 4.0 * bigrams) / max(non_ascii, 1)
+
+    @staticmethod
+    def open_lines(filename, encoding=None):
+        """
+        Encoding is guessed by first 64KB, then file is decoded line by line,
+        instead of holding raw bytes, decoded content and its lines of a huge file at once.
+        @param encoding: known encoding of file, e.g. cached by batch run, not to be guessed again
+        @return: file object iterating unicode lines (line endings kept), and its encoding
+        """
+        if encoding is None:
+            with io.open(filename, 'rb') as fo:
+                prefix = fo.read(Formatter.SNIFF_SIZE)
+            encoding = Formatter.sniff(prefix, len(prefix) < Formatter.SNIFF_SIZE)
+        return io.open(filename, 'r', encoding=encoding, newline=''), encoding
+
+    @staticmethod
+    def decode(raw):
+        """
+        @param raw: bytes of whole file
+        @return: content (unicode) and its encoding
+        """
+        encoding = Formatter.detect_encoding_by_bom(raw)
+        if encoding:
+            return raw.decode(encoding), encoding
+        for enc in Formatter.ENCODINGS:
+            try:
+                return raw.decode(enc), enc
+            except UnicodeDecodeError as e:
+                pass
+        raise Exception('UnicodeDecodeError', 'cannot decode file content')
+
+    @staticmethod
+    def detect_encoding(filename):
+        """
+        Fallback when the guess by first 64KB fails later in file, e.g. a GBK file of ASCII only in its beginning.
+        Same as decode(), but all candidates decode whole file together in one pass of 1MB chunks,
+        instead of holding whole file in memory. UTF-16/32 without BOM are left to sniff().
+        @return: first of ENCODINGS decoding whole file
+        """
+        with io.open(filename, 'rb') as fo:
+            chunk = fo.read(1 << 20)
+            encoding = Formatter.detect_encoding_by_bom(chunk)
+            if encoding:
+                return encoding
+            decoders = [(enc, codecs.getincrementaldecoder(enc)()) for enc in Formatter.ENCODINGS]
+            while decoders:
+                final = len(chunk) == 0
+                passed = []
+                for enc, decoder in decoders:
+                    try:
+                        decoder.decode(chunk, final)
+                        passed.append((enc, decoder))
+                    except UnicodeError:  # incremental UTF-16/32 decoders require BOM
+                        pass
+                decoders = passed
+                if final:
+                    break
+                chunk = fo.read(1 << 20)
+        if not decoders:
+            raise Exception('UnicodeDecodeError', 'cannot decode file content')
+        return decoders[0][0]
+
     @staticmethod
     def encode(s, encoding='utf-8'):
         if encoding=='utf-16':
             encoding = 'utf-16le'
+        elif encoding=='utf-8-sig':
+            encoding = 'utf-8'  # BOM is written once, see bom()
         return s.encode(encoding=encoding)
 
 
-class SrtSubtitleItem(SubtitleItem):
+class SrtFormatter(Formatter):
     SUB_NO = 0
     SUB_TS = 1
     SUB_TXT = 2
+    # 'H:MM:SS,mmm': width of hour or fraction may vary in broken files
+    TIME_PATTERN = re.compile(r'(\d+):(\d{1,2}):(\d{1,2})[\.,](\d+)')
 
     def __init__(self):
-        super(SrtSubtitleItem, self).__init__()
-        self.subtitle = ''
-
-    @property
-    def sub(self):
-        return self.subtitle
-
-    def set_ts(self, value, handle):
-        self.time_start, self.time_end = handle(value)
-
-    def set_sub(self, value):
-        """
-        can be multi-lined by appending another line of subtitle
-        @param value: a new line of subtitle
-        """
-        self.subtitle += value
-
-    @property
-    def pure_sub(self):
-        return self.subtitle
-
-
-class SrtFormatter(Formatter):
-    TIME_FORMAT = None
+        super().__init__()
+        self.decimal_mark = None  # ',' or '.', as the file parsed. It's kept when saved.
 
     def parse(self, lines):
-        super(SrtFormatter, self).parse()
+        super().parse()
+        for start, end, text in self.cues(lines):
+            self.times.append(start, end)
+            self.texts.append(text)
+        self.times.freeze()
 
+    def cues(self, lines):
         patt_line_no = re.compile(r'\d+')
         patt_timestamp = re.compile(r'\d{2}:\d{2}:\d{2}')
 
-        step = SrtSubtitleItem.SUB_NO
-        for line in lines:
-            if step == SrtSubtitleItem.SUB_NO:
+        step = SrtFormatter.SUB_NO
+        for line in self.track_newline(lines):
+            if step == SrtFormatter.SUB_NO:
                 if patt_line_no.search(line):
-                    step = SrtSubtitleItem.SUB_TS
-            elif step == SrtSubtitleItem.SUB_TS:
+                    step = SrtFormatter.SUB_TS
+            elif step == SrtFormatter.SUB_TS:
                 result = patt_timestamp.findall(line)
                 if len(result) == 2:
-                    subtitle = SrtSubtitleItem()
-                    subtitle.set_ts(line.rstrip('\r\n'), SrtFormatter.time_from_str)
-                    step = SrtSubtitleItem.SUB_TXT
+                    start, end = SrtFormatter.time_from_str(line.rstrip('\r\n'))
+                    if self.decimal_mark is None:
+                        self.decimal_mark = '.' if '.' in line.partition(SrtFormatter.sep())[0] else ','
+                    text = []  # can be multi-lined
+                    step = SrtFormatter.SUB_TXT
                 else:
                     raise ValueError('Subtitle format error')
-            elif step == SrtSubtitleItem.SUB_TXT:
+            elif step == SrtFormatter.SUB_TXT:
                 if len(line.rstrip('\r\n')) > 0:
-                    subtitle.set_sub(line)
+                    text.append(line)
                 else:
-                    self.subtitles.append(subtitle)
-                    step = SrtSubtitleItem.SUB_NO
-
-    def save(self, filename, encoding='utf-8'):
-        all_lines = []
-        for i, subtitle in enumerate(self.subtitles):
-            all_lines.append(Formatter.encode('%d\r\n' % (i + 1), encoding))
-            all_lines.append(Formatter.encode(SrtFormatter.time_to_str(*subtitle.ts), encoding))
-            all_lines.append(Formatter.encode(subtitle.sub, encoding))
-            all_lines.append(Formatter.encode('\r\n', encoding))
-        with open(filename, 'w') as fo:
-            Formatter.write_file_bom(fo, encoding)
-            fo.writelines(all_lines)
+                    yield start, end, ''.join(text)
+                    step = SrtFormatter.SUB_NO
+        if step == SrtFormatter.SUB_TXT:  # no blank line at end of file
+            if text and not text[-1].endswith('\n'):
+                text[-1] += self.newline
+            yield start, end, ''.join(text)
+
+    def cue_text(self, no, start, end, text):
+        newline = self.newline
+        return '%d%s%s%s%s' % (no, newline, SrtFormatter.time_to_str(start, end, self.decimal_mark or ',', newline),
+                               text, newline)
 
     # separator
     @staticmethod
@@ -163,51 +752,45 @@ class SrtFormatter(Formatter):
     def time_from_str(time_str):
         """
         @param time_str: time string, which format is like '00:00:16,660 --> 00:00:19,630'
+        @return: start time and end time in milliseconds
         """
         (start, _, end) = time_str.partition(SrtFormatter.sep())
-        if not SrtFormatter.TIME_FORMAT:
-            decimal = re.search('[\.,]', start).group(0)
-            SrtFormatter.TIME_FORMAT = '%%H:%%M:%%S%s%%f' % decimal
-        time_start = datetime.datetime.strptime(start + '000', SrtFormatter.TIME_FORMAT)
-        time_end = datetime.datetime.strptime(end + '000', SrtFormatter.TIME_FORMAT)
-        return time_start, time_end
+        return SrtFormatter.ms_from_str(start.strip()), SrtFormatter.ms_from_str(end.strip())
 
     @staticmethod
-    def time_to_str(start, end):
+    def ms_from_str(text):
         """
-        @param start:
-        @param end: are datetime objects
-        @return: a string can be written to file
+        strptime is slow. Well-formed '00:00:16,660' is sliced at fixed offsets, others go to regex.
         """
-        time_start = start.strftime(SrtFormatter.TIME_FORMAT)[:-3] # microsecond -> millisecond
-        time_end = end.strftime(SrtFormatter.TIME_FORMAT)[:-3]     # microsecond -> millisecond
-        return '%s%s%s\r\n' % (time_start, SrtFormatter.sep(), time_end)
-
-
-class AssSubtitleItem(SubtitleItem):
-    indices = (0,0,0) # Start, End, Text
-    rx = re.compile(r'({.+?})') # use non-greedy search pattern
+        if len(text) == 12 and text[2] == ':' and text[5] == ':':
+            return int(text[:2]) * 3600000 + int(text[3:5]) * 60000 + int(text[6:8]) * 1000 + int(text[9:])
+        match = SrtFormatter.TIME_PATTERN.match(text)
+        if match is None:
+            raise ValueError('Subtitle format error: %s' % text)
+        h, m, s, fraction = match.groups()
+        return int(h) * 3600000 + int(m) * 60000 + int(s) * 1000 + int(fraction[:3].ljust(3, '0'))
 
-    def __init__(self, fields):
-        self.fields = fields
     @staticmethod
-    def set_indices(i1, i2, i3):
-        AssSubtitleItem.indices = (i1, i2, i3)
-    def set_ts(self, handle):
-        self.time_start = handle(self.fields[self.indices[0]])
-        self.time_end = handle(self.fields[self.indices[1]])
-    def update_ts(self, handle):
-        self.fields[self.indices[0]] = handle(self.time_start)
-        self.fields[self.indices[1]] = handle(self.time_end)
-    @property
-    def sub(self):
-        return ','.join(self.fields)
+    def ms_to_str(ms, mark=','):
+        h, ms = divmod(max(ms, 0), 3600000)
+        m, ms = divmod(ms, 60000)
+        s, ms = divmod(ms, 1000)
+        return '%02d:%02d:%02d%s%03d' % (h, m, s, mark, ms)
 
-    @property
-    def pure_sub(self):
-        text = self.fields[self.indices[2]]
-        content = self.rx.sub(lambda match: '', text)
-        return content.replace('\\N', '\n').rstrip()
+    @staticmethod
+    def time_to_str(start, end, mark=',', newline='\r\n'):
+        """
+        @param start:
+        @param end: are milliseconds
+        @param mark: decimal mark, ',' or '.'
+        @param newline: line ending
+        @return: a string can be written to file
+        """
+        # one format of both times, it is called twice per subtitle saved
+        start, end = max(start, 0), max(end, 0)
+        return '%02d:%02d:%02d%s%03d --> %02d:%02d:%02d%s%03d%s' % (
+            start // 3600000, start // 60000 % 60, start // 1000 % 60, mark, start % 1000,
+            end // 3600000, end // 60000 % 60, end // 1000 % 60, mark, end % 1000, newline)
 
 
 class AssFormatter(Formatter):
@@ -222,26 +805,61 @@ class AssFormatter(Formatter):
     It's ISO 639-2 language code.
     """
     DIALOG_FORMAT = None
-    TIME_FORMAT_1 = '%H:%M:%S.%f'
-    TIME_FORMAT_2 = '%-H:%M:%S.%f'  # Kodi Player can't recognize '00:01:59'. Leading zero must be stripped.
+    TIME_PATTERN = re.compile(r'(\d+):(\d{1,2}):(\d{1,2})\.(\d+)')
+    TAG_PATTERN = re.compile(r'({.+?})')  # use non-greedy search pattern
+    STYLE_PATTERN = re.compile(r'\\([biu])([01])(?!\d)')  # italic, bold and underline in override tags
+    HTML_PATTERN = re.compile(r'<(/?)([biu])>', re.IGNORECASE)
+    # for a file converted from other formats
+    DEFAULT_HEADER = '[Script Info]\r\nScriptType: v4.00+\r\n\r\n[V4+ Styles]\r\n' \
+                     'Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, ' \
+                     'Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, ' \
+                     'Shadow, Alignment, MarginL, MarginR, MarginV, Encoding\r\n' \
+                     'Style: Default,Arial,20,&H00FFFFFF,&H000000FF,&H00000000,&H00000000,' \
+                     '0,0,0,0,100,100,0,0,1,2,2,2,10,10,10,1\r\n\r\n[Events]\r\n'
+    DEFAULT_FORMAT = 'Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\r\n'
+    DEFAULT_FIELDS = ('0', '', '', 'Default', '', '0', '0', '0', '', '')
 
     def __init__(self):
+        super().__init__()
         self.header = ''
+        self.indices = (0, 0, 0)  # Start, End, Text
+        self.trailer = ''  # lines after all dialogues, e.g. [Fonts] section
 
     def parse(self, lines):
-        super(AssFormatter, self).parse()
+        super().parse()
+        for start, end, fields in self.cues(lines):
+            self.times.append(start, end)
+            self.texts.append(fields)
+        self.times.freeze()
+
+    def cues(self, lines):
+        """
+        header and format are kept as soon as they are passed.
+        Other lines after format, e.g. comments, blank lines and other sections, are written unchanged:
+        those before a dialogue are appended to its fields, those after all dialogues are kept as trailer.
+        @return: (start, end, fields of dialogue)
+        @raise ValueError: a line is wrong, not to take subtitles before it as the whole file
+        """
         SUB_HEAD = 0
         SUB_FORMAT = 1
         SUB_CONTENT = 2
         step = SUB_HEAD
+        i = 0
+        passed = []
         try:
-            for i, line in enumerate(lines):
+            for i, line in enumerate(self.track_newline(lines)):
                 if step == SUB_CONTENT:
-                    if len(line) < len('Dialogue: '):
-                        return
-                    subtitle = AssSubtitleItem(line[len('Dialogue: '):].split(',', len(self.DIALOG_FORMAT)-1))
-                    subtitle.set_ts(AssFormatter.time_from_str)
-                    self.subtitles.append(subtitle)
+                    if not line.startswith('Dialogue:'):
+                        passed.append(line)
+                        continue
+                    # texts are fields of dialogue, whose Start and End are formatted when saved
+                    fields = line[len('Dialogue:'):].lstrip(' ').split(',', len(self.DIALOG_FORMAT)-1)
+                    if len(fields) < len(self.DIALOG_FORMAT):
+                        raise Exception()
+                    fields.append(''.join(passed))
+                    passed = []
+                    yield (AssFormatter.time_from_str(fields[self.indices[0]]),
+                           AssFormatter.time_from_str(fields[self.indices[1]]), fields)
                 elif step == SUB_HEAD:
                     self.header += line
                     if line.startswith('[Events]'):
@@ -253,68 +871,249 @@ class AssFormatter(Formatter):
                         mapping = dict(zip(self.DIALOG_FORMAT, range(len(self.DIALOG_FORMAT))))
                         start = mapping['Start']
                         end   = mapping['End']
-                        keys  = filter(lambda key: key.startswith('Text'), self.DIALOG_FORMAT)
-                        text  = mapping[keys[0]]
-                        AssSubtitleItem.set_indices(start, end, text)
+                        key   = next(key for key in self.DIALOG_FORMAT if key.startswith('Text'))
+                        text  = mapping[key]
+                        self.indices = (start, end, text)
                     else:
                         raise Exception()
                 else:  # error
                     raise Exception()
-        except Exception as e:
-            print('Line %d is wrong' % i+1)
+        except UnicodeDecodeError:  # file is decoded while read, see Formatter.open_lines
+            raise
+        except Exception:
+            raise ValueError('Line %d is wrong' % (i + 1))
+        self.trailer = ''.join(passed)
 
-    def shift_ts(self, frm, to, shift):
-        super(AssFormatter, self).shift_ts(frm, to, shift)
-        for i in range(frm - 1, to):
-            self.subtitles[i].update_ts(AssFormatter.time_to_str)
-
-    def save(self, filename, encoding='utf-8'):
-        with open(filename, 'w') as fo:
-            Formatter.write_file_bom(fo, encoding)
-            fo.write(Formatter.encode(self.header, encoding))
-            fo.write(Formatter.encode('Format: %s' % ', '.join(self.DIALOG_FORMAT), encoding))
-            for subtitle in self.subtitles:
-                fo.write(Formatter.encode('Dialogue: %s' % subtitle.sub, encoding))
+    def remove_sub(self, frm, to):
+        """
+        lines passed through before removed dialogues are kept before the next one,
+        which and trailer are recorded too, so that undo takes them back
+        """
+        passed = ''.join(self.passed_lines(fields) for fields in self.texts[frm - 1:to])
+        super().remove_sub(frm, to)
+        if passed:
+            following = self.texts[frm - 1] if frm - 1 < len(self.texts) else None
+            self.journal[-1] += (following, self.trailer)
+            if following is not None:
+                self.texts[frm - 1] = self.keep_passed(passed, following)
+            else:
+                self.keep_passed(passed)
+
+    def undo(self):
+        entry = self.journal[-1] if self.journal else None
+        if not super().undo():
+            return False
+        if entry[0] == 'remove' and len(entry) > 5:
+            following, self.trailer = entry[5:]
+            if following is not None:
+                self.texts[entry[1] - 1 + len(entry[4])] = following
+        return True
+
+    def passed_lines(self, fields):
+        return fields[-1]
+
+    def keep_passed(self, lines, fields=None):
+        if fields is None:
+            self.trailer = lines + self.trailer
+            return None
+        return fields[:-1] + [lines + fields[-1]]
+
+    def pure_sub(self, idx):
+        text = self.texts[idx][self.indices[2]]
+        content = AssFormatter.TAG_PATTERN.sub(lambda match: '', text)
+        return content.replace('\\N', '\n').rstrip()
+
+    def use_default_header(self):
+        """
+        for a file converted from other formats
+        """
+        if self.DIALOG_FORMAT is None:
+            self.header = AssFormatter.DEFAULT_HEADER.replace('\r\n', self.newline)
+            self.DIALOG_FORMAT = AssFormatter.DEFAULT_FORMAT.replace('\r\n', self.newline).split(', ')
+            self.indices = (1, 2, 9)
+
+    def to_plain(self, fields):
+        def html(match):
+            return ''.join(('<%s>' if on == '1' else '</%s>') % tag
+                           for tag, on in AssFormatter.STYLE_PATTERN.findall(match.group(1)))
+        text = AssFormatter.TAG_PATTERN.sub(html, fields[self.indices[2]].rstrip('\r\n'))
+        return text.replace('\\N', '\n').replace('\\n', '\n').replace('\\h', ' ')
+
+    def from_plain(self, text):
+        self.use_default_header()
+        text = AssFormatter.HTML_PATTERN.sub(
+            lambda match: '{\\%s%s}' % (match.group(2).lower(), '0' if match.group(1) else '1'), text)
+        text = re.sub(r'<[^>]*>', '', text)  # other tags, e.g. font of SRT
+        fields = list(AssFormatter.DEFAULT_FIELDS)
+        fields[self.indices[2]] = text.replace('\n', '\\N') + self.newline
+        fields.append('')  # no lines passed through
+        return fields
+
+    def head_text(self):
+        self.use_default_header()
+        return '%sFormat: %s' % (self.header, ', '.join(self.DIALOG_FORMAT))
+
+    def cue_text(self, no, start, end, fields):
+        i_start, i_end, _ = self.indices
+        fields[i_start] = AssFormatter.time_to_str(start)
+        fields[i_end] = AssFormatter.time_to_str(end)
+        return '%sDialogue: %s' % (fields[-1], ','.join(fields[:-1]))
+
+    def tail_text(self):
+        return self.trailer
 
     @staticmethod
     def time_from_str(time_str):
         """
-        @param time_str: time string, which format is like '0:00:16.66'
+        @param time_str: time string, which format is like '0:00:16.66' (centiseconds)
+        @return: milliseconds
         """
-        return datetime.datetime.strptime(time_str + '0000', AssFormatter.TIME_FORMAT_1)
+        if len(time_str) == 10 and time_str[1] == ':' and time_str[4] == ':':
+            return int(time_str[0]) * 3600000 + int(time_str[2:4]) * 60000 + int(time_str[5:7]) * 1000 + \
+                int(time_str[8:]) * 10
+        match = AssFormatter.TIME_PATTERN.match(time_str.strip())
+        if match is None:
+            raise ValueError('Subtitle format error: %s' % time_str)
+        h, m, s, fraction = match.groups()
+        return int(h) * 3600000 + int(m) * 60000 + int(s) * 1000 + int(fraction[:3].ljust(3, '0'))
 
     @staticmethod
-    def time_to_str(tm):
+    def time_to_str(ms):
         """
-        @param tm: is datetime object
-        @return: a string can be written to file
+        @param ms: milliseconds
+        @return: a string can be written to file.
+                 Kodi Player can't recognize '00:01:59'. Leading zero of hour must be stripped.
         """
-        return tm.strftime(AssFormatter.TIME_FORMAT_2)[:-4] # microsecond -> millisecond
+        ms = max(ms, 0)
+        return '%d:%02d:%02d.%02d' % (ms // 3600000, ms // 60000 % 60, ms // 1000 % 60, ms % 1000 // 10)
+
+
+class VttFormatter(Formatter):
+    """
+    WebVTT of HTML5 video, which is always UTF-8.
+    Cue identifiers, cue settings and NOTE/STYLE/REGION blocks are dropped when read.
+    """
+    ENCODING = 'utf-8'
+    TIME_PATTERN = re.compile(r'(?:(\d+):)?(\d{1,2}):(\d{1,2})\.(\d+)')  # hours are optional
+
+    def parse(self, lines):
+        super().parse()
+        for start, end, text in self.cues(lines):
+            self.times.append(start, end)
+            self.texts.append(text)
+        self.times.freeze()
+
+    def cues(self, lines):
+        text = None  # lines of current cue
+        for line in self.track_newline(lines):
+            content = line.rstrip('\r\n')
+            if text is None:
+                if '-->' in content:
+                    start, _, end = content.partition('-->')
+                    start = VttFormatter.ms_from_str(start.strip())
+                    end = VttFormatter.ms_from_str(end.split()[0])  # cue settings may follow
+                    text = []
+            elif len(content) > 0:
+                text.append(line)
+            else:
+                yield start, end, ''.join(text)
+                text = None
+        if text is not None:  # no blank line at end of file
+            text = ''.join(text)
+            yield start, end, text if text.endswith('\n') else text + self.newline
+
+    def head_text(self):
+        return 'WEBVTT' + self.newline * 2
+
+    def cue_text(self, no, start, end, text):
+        newline = self.newline
+        return '%s --> %s%s%s%s' % (VttFormatter.ms_to_str(start), VttFormatter.ms_to_str(end), newline, text, newline)
+
+    def to_plain(self, text):
+        text = re.sub(r'<(?!/?[biu]>)[^>]*>', '', text)  # voice, class and timestamp tags
+        text = text.replace('&lt;', '<').replace('&gt;', '>').replace('&nbsp;', ' ').replace('&amp;', '&')
+        return super().to_plain(text)
+
+    def from_plain(self, text):
+        text = re.sub(r'</?font[^>]*>', '', text).replace('&', '&amp;')
+        text = re.sub(r'<(?!/?[biu]>)', '&lt;', text)
+        return super().from_plain(text.replace('-->', '--&gt;'))
+
+    @staticmethod
+    def ms_from_str(text):
+        match = VttFormatter.TIME_PATTERN.match(text)
+        if match is None:
+            raise ValueError('Subtitle format error: %s' % text)
+        h, m, s, fraction = match.groups()
+        return int(h or 0) * 3600000 + int(m) * 60000 + int(s) * 1000 + int(fraction[:3].ljust(3, '0'))
+
+    @staticmethod
+    def ms_to_str(ms):
+        ms = max(ms, 0)
+        return '%02d:%02d:%02d.%03d' % (ms // 3600000, ms // 60000 % 60, ms // 1000 % 60, ms % 1000)
 
 
 class SubtitleFile:
+    FORMATTERS = {'.srt': SrtFormatter, '.ass': AssFormatter, '.ssa': AssFormatter, '.vtt': VttFormatter}
+
     def __init__(self, filename, lines):
         self.filepath = filename
-        formatter = None
-        if filename.lower().endswith('srt'):
-            formatter = SrtFormatter()
-        elif filename.lower().endswith('ass'):
-            formatter = AssFormatter()
+        formatter = SubtitleFile.formatter_of(filename)
         formatter.parse(lines)
         self.formatter = formatter
 
+    @staticmethod
+    def formatter_of(filename):
+        extension = os.path.splitext(filename)[1].lower()
+        if extension not in SubtitleFile.FORMATTERS:
+            raise ValueError('unsupported subtitle format: %s' % filename)
+        return SubtitleFile.FORMATTERS[extension]()
+
+    @staticmethod
+    def load(filename):
+        """
+        file is parsed while decoded line by line
+        @return: SubtitleFile and encoding of file
+        """
+        lines, encoding = Formatter.open_lines(filename)
+        try:
+            with lines:
+                return SubtitleFile(filename, lines), encoding
+        except UnicodeDecodeError:  # first 64KB isn't enough to tell encoding
+            lines, encoding = Formatter.open_lines(filename, Formatter.detect_encoding(filename))
+            with lines:
+                return SubtitleFile(filename, lines), encoding
+
     @property
     def subtitles_count(self):
         return self.formatter.subtitles_count()
 
-    def shift_ts(self, start, end, shift):
+    def shift_ts(self, start, end, shift, scale=1.0):
         """
         Shift time-stamps (ts)
         @param shift: number, positive means delay subtitles a few seconds; negative for the vice versa.
         @param start, end: subtitle's order (1 --> largest)
+        @param scale: drift, time-stamps are scaled before shifted: t --> t * scale + shift
+        """
+        if scale != 1.0:
+            self.formatter.scale_ts(start, end, scale, shift=int(round(shift * 1000)))
+        else:
+            self.formatter.shift_ts(start, end, int(round(shift * 1000)))
+
+    def scale_ts(self, start, end, factor, anchor=0):
+        """
+        Stretch time-stamps, e.g. 25 / 23.976 when subtitle is made for another framerate.
+        @param anchor: seconds, time which isn't moved
+        """
+        self.formatter.scale_ts(start, end, factor, int(round(anchor * 1000)))
+
+    def warp_ts(self, anchors):
+        """
+        Map time-stamps by anchors, replacing rounds of range shift and scale,
+        e.g. [(1, 12.5), (420, 1510.0), (421, 1800.0), (900, 3300.0)]: drift, then an ad break after 420th subtitle.
+        @param anchors: list of (subtitle's order, seconds where it should start)
         """
-        dt = datetime.timedelta(seconds=shift)
-        self.formatter.shift_ts(start, end, dt)
+        self.formatter.warp_ts([(n, int(round(t * 1000))) for n, t in anchors])
 
     def remove_subtitles(self, start, end):
         """
@@ -323,250 +1122,402 @@ class SubtitleFile:
         """
         self.formatter.remove_sub(start, end)
 
+    def undo(self):
+        """
+        undo last shift, scale, anchor mapping or removal, up to Formatter.UNDO_LEVELS
+        @return: False if there's nothing to undo
+        """
+        return self.formatter.undo()
+
     def get_sub(self, idx):
-        return self.formatter.subtitles[idx].pure_sub
-
-    def save(self, encoding):
-        self.formatter.save(self.filepath, encoding)
-
-
-class GUI(tk.Tk):
-    def __init__(self, *args, **kwargs):
-        tk.Tk.__init__(self, *args, **kwargs)
-
-        ROW_SRT_PATH = 0
-        ROW_RANGE_AND_TIME = 1
-        ROW_START = 2
-        ROW_PREVIEW = 3
-
-        self.PLACE_HOLDER = "<file's path>"
-
-        # make children widget are auto-resizable when window's size is changed
-        self.rowconfigure(ROW_SRT_PATH, weight=1)
-        self.rowconfigure(ROW_RANGE_AND_TIME, weight=2)
-        self.rowconfigure(ROW_START, weight=2)
-        self.rowconfigure(ROW_PREVIEW, weight=2)
-        self.columnconfigure(0, weight=2)
-        self.columnconfigure(1, weight=1)
-
-        # application's whole path and extra parameters
-        self.subtitle_filename = tk.StringVar(value=self.PLACE_HOLDER)
-        ctrl = tk.Entry(self, textvariable=self.subtitle_filename)
-        ctrl.grid(column=0, row=ROW_SRT_PATH, sticky=tk.NSEW, padx=5, pady=5)
-        ctrl.bind('<FocusIn>', lambda e: self.toggle_placeholder(False))
-        ctrl.bind('<FocusOut>', lambda e: self.toggle_placeholder(True))
-
-        # open file dialog
-        group = tk.Button(self, text='<--  Choose a Subtitle File', command=self.select_a_file)
-        group.grid(column=1, row=ROW_SRT_PATH, sticky=tk.NSEW, padx=5, pady=5)
-
-        # group a number of widgets together (targeted range)
-        group = tk.LabelFrame(self, text="Option: Targeted Range")
-        group.rowconfigure(0, weight=1)
-        group.rowconfigure(1, weight=1)
-        group.columnconfigure(0, weight=1)
-        group.columnconfigure(1, weight=1)
-        group.grid(column=0, row=ROW_RANGE_AND_TIME, sticky=tk.NSEW, padx=5, pady=5)
-
-        #
-        ctrl = tk.Label(group, text='begin from', justify=tk.LEFT)
-        ctrl.grid(column=0, row=0, sticky=tk.NSEW, padx=5, pady=5)
-
-        # input where to start
-        self.start_number = tk.IntVar(value=1)
-        ctrl = tk.Entry(group, justify=tk.CENTER, textvariable=self.start_number)
-        ctrl.grid(column=1, row=0, sticky=tk.NSEW, padx=5, pady=5)
-
-        ctrl = tk.Label(group, text='stop until', justify=tk.LEFT)
-        ctrl.grid(column=0, row=1, sticky=tk.NSEW, padx=5, pady=5)
-
-        # input where to stop
-        self.stop_number = tk.IntVar(value=0)
-        ctrl = tk.Entry(group, justify=tk.CENTER, textvariable=self.stop_number)
-        ctrl.grid(column=1, row=1, sticky=tk.NSEW, padx=5, pady=5)
-
-        # group a number of widgets together (how much time be shifted)
-        group = tk.LabelFrame(self, text="Option: Time Shift")
-        group.rowconfigure(0, weight=1)
-        group.rowconfigure(1, weight=1)
-        group.grid(column=1, row=ROW_RANGE_AND_TIME, sticky=tk.NSEW, padx=5, pady=5)
-
-        # input how much time to shift
-        self.shift_time = tk.DoubleVar(value=0)
-        ctrl = tk.Entry(group, justify=tk.CENTER, textvariable=self.shift_time)
-        ctrl.grid(row=0, sticky=tk.NSEW, padx=5, pady=5)
-
-        #
-        ctrl = tk.Label(group, text='Seconds (integer)')
-        ctrl.grid(row=1, sticky=tk.NSEW, padx=5, pady=5)
-
-        # group actions together
-        group = tk.LabelFrame(self, text='Supported Actions')
-        group.rowconfigure(0, weight=1)
-        group.rowconfigure(1, weight=1)
-        group.columnconfigure(0, weight=1)
-        group.columnconfigure(1, weight=1)
-        group.columnconfigure(2, weight=1)
-        group.grid(column=0, row=ROW_START, sticky=tk.NSEW, padx=5, pady=5)
-
-        #
-        self.action = tk.IntVar()
-        radio = tk.Radiobutton(group, text='Sync Timestamps', variable=self.action, value=0)
-        radio.grid(column=0, columnspan=2, row=0, sticky=tk.N+tk.S+tk.W, padx=5, pady=5)
-        radio = tk.Radiobutton(group, text='Remove Subtitles', variable=self.action, value=1)
-        radio.grid(column=0, columnspan=2, row=1, sticky=tk.N+tk.S+tk.W, padx=5, pady=5)
-        radio = tk.Radiobutton(group, text='Save File', variable=self.action, value=2)
-        radio.grid(column=0, columnspan=2, row=2, sticky=tk.N+tk.S+tk.W, padx=5, pady=5)
-
-        #
-        ctrl = tk.Button(group, text='Start Action', command=self.start_action)
-        ctrl.grid(column=2, row=0, rowspan=2, sticky=tk.NSEW, padx=5, pady=5)
-
-        #
-        group = tk.LabelFrame(self, text='Subtitle File Encoding')
-        group.rowconfigure(0, weight=1)
-        group.rowconfigure(1, weight=1)
-        group.rowconfigure(2, weight=0)
-        group.columnconfigure(0, weight=1)
-        group.columnconfigure(1, weight=3)
-        group.grid(column=1, row=ROW_START, sticky=tk.NSEW, padx=5, pady=5)
-
-        self.file_encoding = tk.StringVar(value='File encoding: ?')
-        ctrl = tk.Label(group, textvariable=self.file_encoding)
-        ctrl.grid(row=0, columnspan=2, sticky=tk.N+tk.S+tk.W, padx=5, pady=5)
-        ctrl = tk.Label(group, text='Save Encoding: ')
-        ctrl.grid(row=1, column=0, sticky=tk.NSEW, padx=5, pady=5)
-        encodings = ('utf-8', 'utf-16')  # both works well in KODI-player
-        self.save_encoding = tk.StringVar(value=encodings[0])
-        ctrl = tk.OptionMenu(group, self.save_encoding, *encodings)
-        ctrl.grid(row=1, column=1, sticky=tk.NSEW, padx=5, pady=5)
-        tk.Button(group, text='About Kodi Player', command=lambda : tkMessageBox.showinfo('For the Record', '''
-Kodi-player supports below encoding:
- -utf-16le (with BOM)
- -utf-8 (without BOM)
- -GB2312
-Kodi-player recognizes language by naming conventions like these:
- -Chinese: *.chi.ass
- -English: *.eng.srt
-It's ISO 639-2 language code.
-        ''')).grid(row=2, column=0)
-
-        #
-        group = tk.LabelFrame(self, text='Subtitle Preview')
-        group.rowconfigure(0, weight=1)
-        group.rowconfigure(1, weight=1)
-        group.columnconfigure(0, weight=1)
-        group.grid(row=ROW_PREVIEW, columnspan=2, sticky=tk.NSEW, padx=5, pady=5)
-
-        self.idx_selector = tk.Scale(group, showvalue=1, orient=tk.HORIZONTAL, command=self.scale_changed)
-        self.set_scale(1, 10)
-        self.idx_selector.grid(sticky=tk.NSEW)
-        self.bind('<Left>', self.scale_dec)
-        self.bind('<Right>', self.scale_inc)
-
-        self.subtitle_text = tk.StringVar()
-        ctrl = tk.Label(group, textvariable=self.subtitle_text, height=3, justify=tk.CENTER, bg='grey')
-        ctrl.grid(sticky=tk.NSEW)
-
-        #
-        self.subtitle_nfo = None
-
-    def select_a_file(self):
-        filename = tkFileDialog.askopenfilename(filetypes=[('All files', '*'), ('srt', '.srt'), ('ass', '.ass')])
-        if not filename:
-            return
-        try:
-            with open(filename, 'r') as fo:
-                raw = fo.read()
-            encoding = Formatter.detect_encoding_by_bom(raw)
-            if encoding:
-                content = raw.decode(encoding=encoding)
-            else:
-                for enc in ['utf-8', 'utf-16', 'utf-32', 'gb2312', 'big5', 'big5hkscs', 'gbk', 'gb18030']:
-                    try:
-                        content = raw.decode(encoding=enc)
-                        encoding = enc
-                        break
-                    except UnicodeDecodeError as e:
-                        pass
-                else:
-                    raise Exception('UnicodeDecodeError', 'cannot decode file content')
-
-            self.subtitle_filename.set(filename)
-            self.file_encoding.set('File encoding: ' + encoding)
-            self.subtitle_nfo = SubtitleFile(filename, content.splitlines(True))
-            self.stop_number.set(self.subtitle_nfo.subtitles_count)
-            self.start_number.set(1)
-            self.shift_time.set(0)
-            self.set_scale(1, self.subtitle_nfo.subtitles_count)
-            self.scale_changed(1)
-        except Exception as e:
-            tkMessageBox.showerror('Unknown Decoding', 'Error: %s' % e)
-
-    def start_action(self): 
-        # check file existence
-        try:
-            if not self.subtitle_nfo:
-                raise Exception('IO Error', 'No subtitle file specified')
-
-            # check range validity
-            begin = self.start_number.get()
-            end = self.stop_number.get()
-            if begin < 1 or end > self.subtitle_nfo.subtitles_count:
-                raise Exception('Wrong Range', 'Check range.\r\nNotice file contains %d subtitles in total' % (
-                    self.subtitle_nfo.subtitles_count))
-
-            action = self.action.get()
-            if action == 0:
-                shift = self.shift_time.get()
-                if shift == 0:
-                    raise Exception('Wrong Shift', 'Check shift.\r\nShift can\'t be ZERO')
-                self.subtitle_nfo.shift_ts(begin, end, shift)
-            elif action == 1:
-                self.subtitle_nfo.remove_subtitles(begin, end)
-                self.set_scale(1, self.subtitle_nfo.subtitles_count)
-            elif action == 2:
-                self.subtitle_nfo.save(self.save_encoding.get())
-        except ValueError as e:
-            tkMessageBox.showerror('ValueError', "Error: {}".format(e.message))
-        except Exception as e:
-            tkMessageBox.showerror(e.args[0], e.args[1])
+        return self.formatter.pure_sub(idx)
+
+    def find_sub(self, seconds):
+        """
+        for scrubbing, O(log n) by time index
+        @return: subtitle's order shown at time, or the next one if none is shown, 0 if there's no subtitle
+        """
+        return self.formatter.times.find(int(round(seconds * 1000))) + 1
+
+    def check_timing(self, min_gap=0):
+        """
+        @param min_gap: seconds
+        @return: orders of subtitles overlapping an earlier one, and (order, seconds) of gaps before subtitles
+        """
+        overlaps, gaps = self.formatter.times.sweep(int(round(min_gap * 1000)))
+        return [i + 1 for i in overlaps], [(i + 1, ms / 1000.0) for i, ms in gaps]
+
+    def save(self, encoding, newline='\r\n'):
+        """
+        @param newline: '\r\n', '\n', or None to keep line endings as read
+        """
+        self.formatter.save(self.filepath, encoding, newline)
+
+    def save_as(self, filename, encoding='utf-8', newline='\r\n'):
+        """
+        save in format of filename's extension, e.g. .vtt for HTML5 video
+        """
+        source = self.formatter
+        target = SubtitleFile.formatter_of(filename)
+        if type(target) is type(source):
+            target = source  # header of ASS is kept
+        Formatter.write_atomic(filename, target.dumps(source, encoding, newline))
+
+
+class SubtitleAligner(object):
+    """
+    Audio-free resync: a subtitle is fitted to a correctly timed reference (another language or release)
+    by cross-correlating their activity signals, which are 1 while a subtitle is shown.
+    Common framerate conversions are tried as drift, then residual drift is fitted by offsets of a few windows.
+    Correlation is done by FFT if NumPy is installed, or by a histogram of start/end differences if not.
+    """
+    RESOLUTION = 100  # milliseconds per sample of activity signal
+    SAMPLES = 128       # cues of histogram over the whole search range, without NumPy
+    FRAMERATES = (1.0, 25 / 23.976, 23.976 / 25, 25 / 24.0, 24 / 25.0, 24 / 23.976, 23.976 / 24,
+                  30 / 29.97, 29.97 / 30)
+    WINDOWS = 8         # for residual drift
+    WINDOW_LAG = 5000   # milliseconds, search range of a window around global offset
+
+    def __init__(self, reference, max_offset=600):
+        """
+        @param reference: SubtitleFile, which is correctly timed
+        @param max_offset: seconds
+        """
+        self.ref_starts, self.ref_ends = reference.formatter.times.tolist()
+        if len(self.ref_starts) == 0:
+            raise ValueError('no subtitles in reference')
+        self.max_offset = int(max_offset * 1000)
+        if numpy is not None:
+            self.length = (max(self.ref_ends) + self.max_offset) // SubtitleAligner.RESOLUTION + 1
+            self.size = 1
+            while self.size < self.length * 2:  # no wrap-around of circular correlation
+                self.size *= 2
+            self.ref_fft = numpy.fft.rfft(self.signal(self.ref_starts, self.ref_ends), self.size)
         else:
-            tkMessageBox.showinfo('xxx', "Job's done")
-
-    def set_scale(self, frm, to):
-        self.idx_selector.configure(from_=frm, to=to, tickinterval=(to-frm)/4)
-        self.idx_selector.set(1)
-
-    def scale_changed(self, value):
-        value = int(value)
-        if not self.subtitle_nfo:
-            self.subtitle_text.set('<< nothing >>')
-        elif value <= self.subtitle_nfo.subtitles_count:
-            txt = self.subtitle_nfo.get_sub(value-1)
-            txt = txt.replace(u'\r\n', u'\n').rstrip()
-            self.subtitle_text.set(txt)
-        self.scale_value = value
-
-    def scale_inc(self, event):
-        if not self.subtitle_nfo:
-            return
-        if self.scale_value < self.subtitle_nfo.subtitles_count:
-            self.idx_selector.set(self.scale_value+1)
+            self.ref_starts, self.ref_ends = sorted(self.ref_starts), sorted(self.ref_ends)
 
-    def scale_dec(self, event):
-        if self.scale_value > 1:
-            self.idx_selector.set(self.scale_value-1)
+    def signal(self, starts, ends):
+        """
+        @return: activity signal (NumPy array)
+        """
+        resolution = SubtitleAligner.RESOLUTION
+        starts = numpy.clip(numpy.asarray(starts, dtype=numpy.int64) // resolution, 0, self.length)
+        ends = numpy.clip(numpy.asarray(ends, dtype=numpy.int64) // resolution, 0, self.length)
+        delta = numpy.zeros(self.length + 1)
+        numpy.add.at(delta, starts, 1)
+        numpy.add.at(delta, ends, -1)
+        return (numpy.cumsum(delta)[:self.length] > 0).astype(numpy.float64)
+
+    def correlate(self, starts, ends, lo, hi):
+        """
+        @param starts, ends: milliseconds of subtitle to be aligned
+        @param lo, hi: range of offset (milliseconds) to be searched
+        @return: best offset (milliseconds) and its score (ratio of subtitle matched)
+        """
+        resolution = SubtitleAligner.RESOLUTION
+        if numpy is not None:
+            activity = self.signal(starts, ends)
+            total = activity.sum()
+            if total == 0:
+                return 0, 0.0
+            # corr[k] = sum(ref[t + k] * sub[t]): sub delayed by k matches ref
+            corr = numpy.fft.irfft(self.ref_fft * numpy.conj(numpy.fft.rfft(activity, self.size)), self.size)
+            lags = numpy.arange(lo // resolution, hi // resolution + 1)
+            values = corr[lags % self.size]
+            k = int(numpy.argmax(values))
+            return int(lags[k]) * resolution, float(values[k]) / total
+        # histogram of differences to reference by a few cues spread over subtitle: its peak stands out
+        # of hi - lo, while cost is cues x reference cues in range
+        step = max(len(starts) // SubtitleAligner.SAMPLES, 1)
+        votes = {}
+        for times, ref in ((starts[::step], self.ref_starts), (ends[::step], self.ref_ends)):
+            for t in times:
+                for r in ref[bisect.bisect_left(ref, t + lo):bisect.bisect_right(ref, t + hi)]:
+                    k = int((r - t) // resolution)
+                    votes[k] = votes.get(k, 0) + 1
+        if len(votes) == 0:
+            return 0, 0.0
+        best = max(votes, key=lambda k: votes.get(k - 1, 0) + votes[k] + votes.get(k + 1, 0))
+        # all cues around the peak, whose median difference is the offset
+        lo, hi = max((best - 1) * resolution, lo), min((best + 2) * resolution, hi)
+        matched = []
+        for times, ref in ((starts, self.ref_starts), (ends, self.ref_ends)):
+            for t in times:
+                matched.extend(r - t for r in ref[bisect.bisect_left(ref, t + lo):bisect.bisect_left(ref, t + hi)])
+        if len(matched) == 0:
+            return 0, 0.0
+        matched.sort()
+        return int(round(matched[len(matched) // 2])), len(matched) / (2.0 * len(starts))
+
+    def align(self, subtitle):
+        """
+        @param subtitle: SubtitleFile to be aligned
+        @return: (shift in seconds, scale), so that t --> t * scale + shift, see SubtitleFile.shift_ts
+        """
+        starts, ends = subtitle.formatter.times.tolist()
+        if len(starts) == 0:
+            return 0.0, 1.0
+        best = None
+        for factor in SubtitleAligner.FRAMERATES:
+            offset, score = self.correlate([t * factor for t in starts], [t * factor for t in ends],
+                                           -self.max_offset, self.max_offset)
+            if best is None or score > best[2]:
+                best = (factor, offset, score)
+        factor, offset, _ = best
+        # residual drift: offsets of windows fitted by weighted least squares
+        points = []
+        size = max(len(starts) // SubtitleAligner.WINDOWS, 1)
+        for i in range(0, len(starts), size):
+            window_starts = [t * factor + offset for t in starts[i:i + size]]
+            window_ends = [t * factor + offset for t in ends[i:i + size]]
+            lag, score = self.correlate(window_starts, window_ends,
+                                        -SubtitleAligner.WINDOW_LAG, SubtitleAligner.WINDOW_LAG)
+            if score > 0:
+                points.append(((window_starts[0] + window_ends[-1]) / 2.0, lag, score))
+        if len(points) >= 3:
+            weight = sum(w for _, _, w in points)
+            mean_x = sum(x * w for x, _, w in points) / weight
+            mean_y = sum(y * w for _, y, w in points) / weight
+            variance = sum(w * (x - mean_x) ** 2 for x, _, w in points)
+            if variance > 0:
+                slope = sum(w * (x - mean_x) * (y - mean_y) for x, y, w in points) / variance
+                intercept = mean_y - slope * mean_x
+                # t1 = t * factor + offset, t2 = t1 + intercept + slope * t1
+                factor, offset = factor * (1 + slope), offset * (1 + slope) + intercept
+        return offset / 1000.0, factor
+
+
+def parse_anchors(text):
+    """
+    @param text: anchors separated by ';' or blanks, e.g. '1=12.5; 420=25:10,000; 421=0:30:00'
+                 time is seconds or [hours:]minutes:seconds
+    @return: list of (subtitle's order, seconds), see SubtitleFile.warp_ts
+    """
+    anchors = []
+    for item in re.split(r'[;\s]+', text.strip()):
+        if not item:
+            continue
+        order, _, stamp = item.partition('=')
+        anchors.append((int(order), seconds_from_str(stamp)))
+    return anchors
 
-    def toggle_placeholder(self, show=True):
-        filename = self.subtitle_filename.get()
-        if show:
-            if len(filename) == 0:
-                self.subtitle_filename.set(self.PLACE_HOLDER)
-        elif filename == self.PLACE_HOLDER:
-            self.subtitle_filename.set('')
+
+def seconds_from_str(stamp):
+    """
+    @param stamp: seconds or [hours:]minutes:seconds, e.g. '83.5', '1:23,5' or '0:01:23.500'
+    """
+    seconds = 0.0
+    for part in stamp.strip().replace(',', '.').split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+SUBTITLE_EXTENSIONS = ('.srt', '.ass', '.ssa', '.vtt')
+NEWLINES = {'crlf': '\r\n', 'lf': '\n', 'keep': None}
+BATCH_CACHE = '.subtitle_resync.json'  # content hash of files done by last batch run, in top directory
+
+
+def file_digest(filename):
+    """
+    hashed chunk by chunk, so a huge file isn't held in memory
+    """
+    digest = hashlib.md5()
+    with io.open(filename, 'rb') as fo:
+        for chunk in iter(lambda: fo.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stream_resync(filename, options, encoding=None):
+    """
+    Subtitles are read, changed and written one by one to a temporary file, which replaces the file at last,
+    so memory doesn't grow with file size, e.g. concatenated karaoke files of hundreds of MB.
+    Shift, removal and conversion are done in the same pass.
+    Anchors need a first pass to find start times of their subtitles.
+    @param options: see resync_file. If 'format' is given, e.g. 'vtt', file is kept and the converted file is
+                    written next to it.
+    @param encoding: of file, guessed if None
+    @return: number of subtitles written, and encoding of file read
+    """
+    try:
+        return stream_pass(filename, options, encoding)
+    except UnicodeDecodeError:  # guessed by first 64KB, or cached, but fails later in file
+        return stream_pass(filename, options, Formatter.detect_encoding(filename))
+
+
+def stream_pass(filename, options, encoding):
+    """
+    stream_resync by an encoding, which is guessed by first 64KB if None.
+    Temporary file is removed if decoding fails, so it can be done again by another encoding.
+    """
+    anchors = dict(options.get('anchors') or [])
+    slopes = None
+    if anchors:
+        found = {}
+        lines, encoding = Formatter.open_lines(filename, encoding)
+        with lines:
+            for i, (start, _, _) in enumerate(SubtitleFile.formatter_of(filename).cues(lines)):
+                if i + 1 in anchors:
+                    found[i + 1] = start
+        missing = sorted(set(anchors) - set(found))
+        if missing:
+            raise ValueError('anchors out of range: %s' % missing)
+        orders = sorted(anchors)
+        indices = [n - 1 for n in orders]
+        sources = [found[n] for n in orders]
+        targets = [int(round(anchors[n] * 1000)) for n in orders]
+        slopes = TimeTable.slopes(indices, sources, targets)
+    shift = int(round(options.get('shift', 0) * 1000))
+    shift_from, shift_to = options.get('range') or (1, sys.maxsize)
+    remove_from, remove_to = options.get('remove') or (0, -1)
+    save_encoding = options.get('encoding', 'utf-8')
+    newline = options.get('newline', '\r\n')
+
+    formatter = SubtitleFile.formatter_of(filename)
+    target, output = formatter, filename
+    if options.get('format'):
+        output = '%s.%s' % (os.path.splitext(filename)[0], options['format'])
+        target = SubtitleFile.formatter_of(output)
+        if type(target) is type(formatter):
+            target = formatter  # header of ASS is kept
+    temp = output + '.tmp'
+    count = written = 0
+    passed = ''  # lines passed through before removed subtitles
+    lines, encoding = Formatter.open_lines(filename, encoding)
+    try:
+        with lines, open(temp, 'wb', 1 << 20) as fo:
+            for start, end, text in formatter.cues(lines):
+                count += 1
+                if slopes is not None:
+                    k = min(max(bisect.bisect_right(indices, count - 1) - 1, 0), len(slopes) - 1)
+                    start = int(round((start - sources[k]) * slopes[k])) + targets[k]
+                    end = int(round((end - sources[k]) * slopes[k])) + targets[k]
+                if shift_from <= count <= shift_to:
+                    start += shift
+                    end += shift
+                if remove_from <= count <= remove_to:
+                    passed += formatter.passed_lines(text)
+                    continue
+                if passed:
+                    text, passed = formatter.keep_passed(passed, text), ''
+                if written == 0:
+                    target.newline = formatter.newline
+                    target.write_head(fo, save_encoding, newline)  # header of ASS is known after its first dialogue
+                written += 1
+                target.write_cue(fo, written, start, end, target.convert(text, formatter), save_encoding, newline)
+            if passed:
+                formatter.keep_passed(passed)
+            if count > 0 and written == 0:
+                target.newline = formatter.newline
+                target.write_head(fo, save_encoding, newline)
+            target.write_tail(fo, save_encoding, newline)
+            fo.flush()
+            os.fsync(fo.fileno())
+        if count == 0:
+            raise ValueError('no subtitles found')  # not to overwrite it with an empty file
+        os.replace(temp, output)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+    return written, encoding
+
+
+def resync_file(task):
+    """
+    batch job, run in a worker process.
+    @param task: (filename, options, encoding of file or None), options is a dict of
+                 'anchors', 'shift', 'range', 'remove', 'format' (to be converted to), 'encoding' (to be saved)
+                 and 'newline' ('\r\n', '\n' or None to keep)
+    @return: (filename, error message or None, content hash of file, encoding of file)
+    """
+    filename, options, encoding = task
+    try:
+        _, encoding = stream_resync(filename, options, encoding)
+        if not options.get('format'):
+            encoding = options.get('encoding', 'utf-8')  # overwritten
+        return filename, None, file_digest(filename), encoding
+    except Exception as e:
+        return filename, str(e), None, None
+
+
+def batch_resync(top, options, processes=None, force=False):
+    """
+    Shift, remove, re-encode or convert all subtitle files in a directory tree, by a process pool.
+    Files unchanged since last run (same content hash and same options) are skipped.
+    When converted, files already in target format are taken as results and skipped.
+    Encoding saved by last run is kept with content hash, so that it isn't guessed again for new options.
+    @return: number of files done, skipped and failed
+    """
+    cache_file = os.path.join(top, BATCH_CACHE)
+    cache = {}
+    if not force and os.path.exists(cache_file):
+        with io.open(cache_file, 'r', encoding='utf-8') as fo:
+            cache = json.load(fo)
+    signature = json.dumps(options, sort_keys=True)
+    start = time.time()
+    tasks = []
+    skipped = 0
+    for folder, _, files in os.walk(top):
+        for name in sorted(files):
+            extension = os.path.splitext(name)[1].lower()
+            if extension not in SUBTITLE_EXTENSIONS or extension == '.%s' % options.get('format'):
+                continue
+            filename = os.path.join(folder, name)
+            key = os.path.relpath(filename, top)
+            digest = file_digest(filename)
+            entry = cache.get(key) or []  # [content hash, options, encoding]
+            if entry[:2] == [digest, signature]:
+                skipped += 1
+                continue
+            encoding = entry[2] if len(entry) > 2 and entry[0] == digest else None
+            tasks.append((filename, options, encoding))
+    done = failed = 0
+    pool = multiprocessing.Pool(processes)
+    try:
+        for filename, error, digest, encoding in pool.imap_unordered(resync_file, tasks):
+            if error is None:
+                done += 1
+                cache[os.path.relpath(filename, top)] = [digest, signature, encoding]
+            else:
+                failed += 1
+                print('%s: %s' % (filename, error))
+    finally:
+        pool.close()
+        pool.join()
+    with io.open(cache_file, 'wb') as fo:
+        fo.write(json.dumps(cache, indent=1, sort_keys=True).encode('utf-8'))
+    elapsed = max(time.time() - start, 1e-6)
+    total = done + skipped + failed
+    print('%d files (%d done, %d skipped, %d failed) in %.2f seconds, %.1f files/sec' % (
+        total, done, skipped, failed, elapsed, total / elapsed))
+    return done, skipped, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Resynchronize subtitles. GUI is shown if no directory is given.')
+    parser.add_argument('dir', nargs='?', help='batch mode: all .srt/.ass files in this directory tree')
+    parser.add_argument('--shift', type=float, default=0, help='seconds, negative means earlier')
+    parser.add_argument('--range', type=int, nargs=2, metavar=('FROM', 'TO'), help='subtitles to be shifted (1-based)')
+    parser.add_argument('--anchor', action='append', metavar='ORDER=TIME',
+                        help='piecewise time map, subtitle ORDER starts at TIME ([h:]mm:ss,fff or seconds), repeatable')
+    parser.add_argument('--remove', type=int, nargs=2, metavar=('FROM', 'TO'), help='subtitles to be removed')
+    parser.add_argument('--encoding', default='utf-8', help='save encoding, e.g. utf-8 or utf-16')
+    parser.add_argument('--to', choices=('srt', 'ass', 'vtt'), help='convert to format, written next to each file')
+    parser.add_argument('--newline', choices=('crlf', 'lf', 'keep'), default='crlf', help='line endings when saved')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('-f', '--force', action='store_true', help='ignore files done by last run')
+    args = parser.parse_args()
+    if args.dir is None:
+        import SubTitleResyncGui  # Tk is needed by GUI only, not by batch mode on a headless host
+        SubTitleResyncGui.main()
+        logging.info('Script is done executing.')
+        return
+    options = {'anchors': parse_anchors(' '.join(args.anchor or [])),
+               'shift': args.shift, 'range': args.range, 'remove': args.remove, 'format': args.to,
+               'encoding': args.encoding, 'newline': NEWLINES[args.newline]}
+    _, _, failed = batch_resync(args.dir, options, args.jobs, args.force)
+    if failed > 0:
+        sys.exit(1)
 
 if __name__ == "__main__":
-    gui = GUI(className=' Subtitle Resync Tool') # extra blank to avoid lowercase caption
-    gui.mainloop()
-    logging.info('Script is done executing.')
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+Benchmark of SubTitleResync engine: parse, shift, save and one-pass batch resync of generated
+SRT and ASS files of 1k, 10k and 100k subtitles.
+
+Results are appended to a history file (one JSON object per line), and compared with the last run,
+so throughput can be tracked release over release:
+  SubTitleResyncBench.py --label v1.2
+  SubTitleResyncBench.py --sizes 1000 10000 --rounds 5 --history /tmp/bench.jsonl -o result.json
+"""
+
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+
+import SubTitleResync
+from SubTitleResync import SubtitleFile, stream_resync
+
+SIZES = (1000, 10000, 100000)
+FORMATS = ('srt', 'ass')
+TEXTS = ('我们现在就走吧。', 'Where are you going?', '你知道他在哪里吗？\n<i>I don\'t know.</i>',
+         '沒有人會來的。', 'Wait for me!\nPlease...')
+
+
+def generate(folder, fmt, size, seed=1):
+    """
+    write a subtitle file of random texts and times, same for same seed
+    @return: file's path
+    """
+    rng = random.Random(seed)
+    formatter = SubtitleFile.formatter_of('x.' + fmt)
+    source = SubtitleFile.formatter_of('x.srt')
+    path = os.path.join(folder, '%d.%s' % (size, fmt))
+    start = 0
+    with open(path, 'wb') as fo:
+        formatter.write_head(fo)
+        for no in range(1, size + 1):
+            start += rng.randint(500, 4000)
+            text = formatter.convert(source.from_plain(rng.choice(TEXTS)), source)
+            formatter.write_cue(fo, no, start, start + rng.randint(800, 5000), text)
+    return path
+
+
+def best_of(rounds, fn):
+    """
+    @return: shortest seconds of a few runs, which is least disturbed by other processes
+    """
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_file(path, size, rounds):
+    """
+    @return: cues/sec of each operation
+    """
+    subtitle, _ = SubtitleFile.load(path)
+    count = subtitle.subtitles_count
+
+    def shift():
+        subtitle.shift_ts(1, count, 1.5)
+        subtitle.shift_ts(count // 4, count // 2, -0.25)
+        subtitle.undo()
+        subtitle.undo()
+
+    def stream():
+        shutil.copyfile(path, work)
+        stream_resync(work, {'shift': 1.5, 'remove': [5, 7]})
+
+    work = path + '.work' + os.path.splitext(path)[1]
+    subtitle.filepath = work
+    seconds = {'parse': best_of(rounds, lambda: SubtitleFile.load(path)),
+               'shift': best_of(rounds, shift),
+               'save': best_of(rounds, lambda: subtitle.save('utf-8')),
+               'stream': best_of(rounds, stream)}
+    os.remove(work)
+    return dict(('%s cues/sec' % op, size / elapsed) for op, elapsed in seconds.items())
+
+
+def git_label():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def last_run(history):
+    if not os.path.exists(history):
+        return None
+    last = None
+    with io.open(history, 'r', encoding='utf8') as file:
+        for line in file:
+            if line.strip():
+                last = json.loads(line)
+    return last
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark SubTitleResync on generated subtitle files.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='subtitles per file')
+    parser.add_argument('--formats', nargs='+', default=FORMATS, choices=FORMATS)
+    parser.add_argument('--rounds', type=int, default=3, help='best of rounds is taken')
+    parser.add_argument('--label', help='release or commit of this run (default: git describe)')
+    parser.add_argument('--history', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                          'SubTitleResyncBench.jsonl'),
+                        help='results of runs, one JSON per line')
+    parser.add_argument('-o', '--output', help='write results (JSON)')
+    args = parser.parse_args()
+    #
+    previous = last_run(args.history)
+    results = {'label': args.label or git_label() or 'unknown',
+               'date': datetime.datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(),
+               'numpy': SubTitleResync.numpy is not None,
+               'files': {}}
+    folder = tempfile.mkdtemp(prefix='subtitle_bench_')
+    try:
+        for fmt in args.formats:
+            for size in args.sizes:
+                name = '%d.%s' % (size, fmt)
+                result = bench_file(generate(folder, fmt, size), size, args.rounds)
+                results['files'][name] = result
+                line = ', '.join('%s %.0f' % (op, value) for op, value in sorted(result.items()))
+                if previous is not None and name in previous['files']:
+                    ratios = ['%s x%.2f' % (op.split()[0], value / previous['files'][name][op])
+                              for op, value in sorted(result.items()) if op in previous['files'][name]]
+                    line += ' | vs %s: %s' % (previous['label'], ', '.join(ratios))
+                print('%s: %s' % (name, line))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    with io.open(args.history, 'a', encoding='utf8') as file:
+        file.write(json.dumps(results, sort_keys=True) + '\n')
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf8') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+  GUI of SubTitleResync: shift, align, check and convert one subtitle file.
+  Kept apart from SubTitleResync, so that batch mode runs on a host without Tk.
+"""
+
+import tkinter as tk
+from tkinter import filedialog, messagebox
+
+from SubTitleResync import SubtitleFile, SubtitleAligner, NEWLINES, parse_anchors, seconds_from_str
+
+
+class GUI(tk.Tk):
+    def __init__(self, *args, **kwargs):
+        tk.Tk.__init__(self, *args, **kwargs)
+
+        ROW_SRT_PATH = 0
+        ROW_RANGE_AND_TIME = 1
+        ROW_START = 2
+        ROW_PREVIEW = 3
+
+        self.PLACE_HOLDER = "<file's path>"
+
+        # make children widget are auto-resizable when window's size is changed
+        self.rowconfigure(ROW_SRT_PATH, weight=1)
+        self.rowconfigure(ROW_RANGE_AND_TIME, weight=2)
+        self.rowconfigure(ROW_START, weight=2)
+        self.rowconfigure(ROW_PREVIEW, weight=2)
+        self.columnconfigure(0, weight=2)
+        self.columnconfigure(1, weight=1)
+
+        # application's whole path and extra parameters
+        self.subtitle_filename = tk.StringVar(value=self.PLACE_HOLDER)
+        ctrl = tk.Entry(self, textvariable=self.subtitle_filename)
+        ctrl.grid(column=0, row=ROW_SRT_PATH, sticky=tk.NSEW, padx=5, pady=5)
+        ctrl.bind('<FocusIn>', lambda e: self.toggle_placeholder(False))
+        ctrl.bind('<FocusOut>', lambda e: self.toggle_placeholder(True))
+
+        # open file dialog
+        group = tk.Button(self, text='<--  Choose a Subtitle File', command=self.select_a_file)
+        group.grid(column=1, row=ROW_SRT_PATH, sticky=tk.NSEW, padx=5, pady=5)
+
+        # group a number of widgets together (targeted range)
+        group = tk.LabelFrame(self, text="Option: Targeted Range")
+        group.rowconfigure(0, weight=1)
+        group.rowconfigure(1, weight=1)
+        group.columnconfigure(0, weight=1)
+        group.columnconfigure(1, weight=1)
+        group.grid(column=0, row=ROW_RANGE_AND_TIME, sticky=tk.NSEW, padx=5, pady=5)
+
+        #
+        ctrl = tk.Label(group, text='begin from', justify=tk.LEFT)
+        ctrl.grid(column=0, row=0, sticky=tk.NSEW, padx=5, pady=5)
+
+        # input where to start
+        self.start_number = tk.IntVar(value=1)
+        ctrl = tk.Entry(group, justify=tk.CENTER, textvariable=self.start_number)
+        ctrl.grid(column=1, row=0, sticky=tk.NSEW, padx=5, pady=5)
+
+        ctrl = tk.Label(group, text='stop until', justify=tk.LEFT)
+        ctrl.grid(column=0, row=1, sticky=tk.NSEW, padx=5, pady=5)
+
+        # input where to stop
+        self.stop_number = tk.IntVar(value=0)
+        ctrl = tk.Entry(group, justify=tk.CENTER, textvariable=self.stop_number)
+        ctrl.grid(column=1, row=1, sticky=tk.NSEW, padx=5, pady=5)
+
+        # group a number of widgets together (how much time be shifted)
+        group = tk.LabelFrame(self, text="Option: Time Shift")
+        group.rowconfigure(0, weight=1)
+        group.rowconfigure(1, weight=1)
+        group.rowconfigure(2, weight=1)
+        group.rowconfigure(3, weight=1)
+        group.grid(column=1, row=ROW_RANGE_AND_TIME, sticky=tk.NSEW, padx=5, pady=5)
+
+        # input how much time to shift
+        self.shift_time = tk.DoubleVar(value=0)
+        ctrl = tk.Entry(group, justify=tk.CENTER, textvariable=self.shift_time)
+        ctrl.grid(row=0, sticky=tk.NSEW, padx=5, pady=5)
+
+        #
+        ctrl = tk.Label(group, text='Seconds (integer)')
+        ctrl.grid(row=1, sticky=tk.NSEW, padx=5, pady=5)
+
+        # anchors of piecewise time map
+        self.anchors = tk.StringVar(value='')
+        ctrl = tk.Entry(group, justify=tk.CENTER, textvariable=self.anchors)
+        ctrl.grid(row=2, sticky=tk.NSEW, padx=5, pady=5)
+
+        ctrl = tk.Label(group, text='Anchors (order=h:mm:ss,fff; ...)')
+        ctrl.grid(row=3, sticky=tk.NSEW, padx=5, pady=5)
+
+        # group actions together
+        group = tk.LabelFrame(self, text='Supported Actions')
+        group.rowconfigure(0, weight=1)
+        group.rowconfigure(1, weight=1)
+        group.columnconfigure(0, weight=1)
+        group.columnconfigure(1, weight=1)
+        group.columnconfigure(2, weight=1)
+        group.grid(column=0, row=ROW_START, sticky=tk.NSEW, padx=5, pady=5)
+
+        #
+        self.action = tk.IntVar()
+        radio = tk.Radiobutton(group, text='Sync Timestamps', variable=self.action, value=0)
+        radio.grid(column=0, columnspan=2, row=0, sticky=tk.N+tk.S+tk.W, padx=5, pady=5)
+        radio = tk.Radiobutton(group, text='Remove Subtitles', variable=self.action, value=1)
+        radio.grid(column=0, columnspan=2, row=1, sticky=tk.N+tk.S+tk.W, padx=5, pady=5)
+        radio = tk.Radiobutton(group, text='Save File', variable=self.action, value=2)
+        radio.grid(column=0, columnspan=2, row=2, sticky=tk.N+tk.S+tk.W, padx=5, pady=5)
+        radio = tk.Radiobutton(group, text='Align to Reference', variable=self.action, value=3)
+        radio.grid(column=0, columnspan=2, row=3, sticky=tk.N+tk.S+tk.W, padx=5, pady=5)
+        radio = tk.Radiobutton(group, text='Map by Anchors', variable=self.action, value=4)
+        radio.grid(column=0, columnspan=2, row=4, sticky=tk.N+tk.S+tk.W, padx=5, pady=5)
+        radio = tk.Radiobutton(group, text='Check Overlaps', variable=self.action, value=5)
+        radio.grid(column=0, columnspan=2, row=5, sticky=tk.N+tk.S+tk.W, padx=5, pady=5)
+        radio = tk.Radiobutton(group, text='Save As (convert)', variable=self.action, value=6)
+        radio.grid(column=0, columnspan=2, row=6, sticky=tk.N+tk.S+tk.W, padx=5, pady=5)
+
+        #
+        ctrl = tk.Button(group, text='Start Action', command=self.start_action)
+        ctrl.grid(column=2, row=0, rowspan=2, sticky=tk.NSEW, padx=5, pady=5)
+        ctrl = tk.Button(group, text='Undo', command=self.undo_action)
+        ctrl.grid(column=2, row=2, rowspan=2, sticky=tk.NSEW, padx=5, pady=5)
+        self.bind('<Control-z>', lambda e: self.undo_action())
+
+        #
+        group = tk.LabelFrame(self, text='Subtitle File Encoding')
+        group.rowconfigure(0, weight=1)
+        group.rowconfigure(1, weight=1)
+        group.rowconfigure(2, weight=1)
+        group.rowconfigure(3, weight=0)
+        group.columnconfigure(0, weight=1)
+        group.columnconfigure(1, weight=3)
+        group.grid(column=1, row=ROW_START, sticky=tk.NSEW, padx=5, pady=5)
+
+        self.file_encoding = tk.StringVar(value='File encoding: ?')
+        ctrl = tk.Label(group, textvariable=self.file_encoding)
+        ctrl.grid(row=0, columnspan=2, sticky=tk.N+tk.S+tk.W, padx=5, pady=5)
+        ctrl = tk.Label(group, text='Save Encoding: ')
+        ctrl.grid(row=1, column=0, sticky=tk.NSEW, padx=5, pady=5)
+        encodings = ('utf-8', 'utf-16')  # both works well in KODI-player
+        self.save_encoding = tk.StringVar(value=encodings[0])
+        ctrl = tk.OptionMenu(group, self.save_encoding, *encodings)
+        ctrl.grid(row=1, column=1, sticky=tk.NSEW, padx=5, pady=5)
+        ctrl = tk.Label(group, text='Line Ending: ')
+        ctrl.grid(row=2, column=0, sticky=tk.NSEW, padx=5, pady=5)
+        self.save_newline = tk.StringVar(value='crlf')
+        ctrl = tk.OptionMenu(group, self.save_newline, *sorted(NEWLINES))
+        ctrl.grid(row=2, column=1, sticky=tk.NSEW, padx=5, pady=5)
+        tk.Button(group, text='About Kodi Player', command=lambda : messagebox.showinfo('For the Record', '''
+Kodi-player supports below encoding:
+ -utf-16le (with BOM)
+ -utf-8 (without BOM)
+ -GB2312
+Kodi-player recognizes language by naming conventions like these:
+ -Chinese: *.chi.ass
+ -English: *.eng.srt
+It's ISO 639-2 language code.
+        ''')).grid(row=3, column=0)
+
+        #
+        group = tk.LabelFrame(self, text='Subtitle Preview')
+        group.rowconfigure(0, weight=1)
+        group.rowconfigure(1, weight=1)
+        group.columnconfigure(0, weight=1)
+        group.grid(row=ROW_PREVIEW, columnspan=2, sticky=tk.NSEW, padx=5, pady=5)
+
+        self.idx_selector = tk.Scale(group, showvalue=1, orient=tk.HORIZONTAL, command=self.scale_changed)
+        self.set_scale(1, 10)
+        self.idx_selector.grid(sticky=tk.NSEW)
+        self.bind('<Left>', self.scale_dec)
+        self.bind('<Right>', self.scale_inc)
+
+        self.subtitle_text = tk.StringVar()
+        ctrl = tk.Label(group, textvariable=self.subtitle_text, height=3, justify=tk.CENTER, bg='grey')
+        ctrl.grid(sticky=tk.NSEW)
+
+        # jump to subtitle shown at a time
+        frame = tk.Frame(group)
+        frame.grid(sticky=tk.NSEW)
+        tk.Label(frame, text='Go to time:').pack(side=tk.LEFT, padx=5, pady=5)
+        self.goto_time = tk.StringVar(value='0:00:00,000')
+        ctrl = tk.Entry(frame, justify=tk.CENTER, textvariable=self.goto_time)
+        ctrl.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5, pady=5)
+        ctrl.bind('<Return>', self.goto_changed)
+
+        #
+        self.subtitle_nfo = None
+
+    def select_a_file(self):
+        filename = filedialog.askopenfilename(filetypes=[('All files', '*'), ('srt', '.srt'), ('ass', '.ass'),
+                                                           ('vtt', '.vtt')])
+        if not filename:
+            return
+        try:
+            subtitle, encoding = SubtitleFile.load(filename)
+            self.subtitle_filename.set(filename)
+            self.file_encoding.set('File encoding: ' + encoding)
+            self.subtitle_nfo = subtitle
+            self.stop_number.set(self.subtitle_nfo.subtitles_count)
+            self.start_number.set(1)
+            self.shift_time.set(0)
+            self.set_scale(1, self.subtitle_nfo.subtitles_count)
+            self.scale_changed(1)
+        except Exception as e:
+            messagebox.showerror('Unknown Decoding', 'Error: %s' % e)
+
+    def start_action(self): 
+        # check file existence
+        try:
+            if not self.subtitle_nfo:
+                raise Exception('IO Error', 'No subtitle file specified')
+
+            # check range validity
+            begin = self.start_number.get()
+            end = self.stop_number.get()
+            if begin < 1 or end > self.subtitle_nfo.subtitles_count:
+                raise Exception('Wrong Range', 'Check range.\r\nNotice file contains %d subtitles in total' % (
+                    self.subtitle_nfo.subtitles_count))
+
+            action = self.action.get()
+            if action == 0:
+                shift = self.shift_time.get()
+                if shift == 0:
+                    raise Exception('Wrong Shift', 'Check shift.\r\nShift can\'t be ZERO')
+                self.subtitle_nfo.shift_ts(begin, end, shift)
+            elif action == 1:
+                self.subtitle_nfo.remove_subtitles(begin, end)
+                self.set_scale(1, self.subtitle_nfo.subtitles_count)
+            elif action == 2:
+                self.subtitle_nfo.save(self.save_encoding.get(), NEWLINES[self.save_newline.get()])
+            elif action == 3:
+                filename = filedialog.askopenfilename(title='Reference Subtitle (correctly timed)',
+                                                      filetypes=[('All files', '*'), ('srt', '.srt'), ('ass', '.ass'),
+                                                                 ('vtt', '.vtt')])
+                if not filename:
+                    return
+                reference, _ = SubtitleFile.load(filename)
+                shift, scale = SubtitleAligner(reference).align(self.subtitle_nfo)
+                self.subtitle_nfo.shift_ts(1, self.subtitle_nfo.subtitles_count, shift, scale)
+                messagebox.showinfo('Aligned', 'Shift: %.3f seconds\r\nScale: %.6f' % (shift, scale))
+                return
+            elif action == 4:
+                anchors = parse_anchors(self.anchors.get())
+                if len(anchors) == 0:
+                    raise Exception('Wrong Anchors', 'Check anchors.\r\ne.g. 1=0:00:12,500; 420=0:25:10,000')
+                self.subtitle_nfo.warp_ts(anchors)
+            elif action == 5:
+                overlaps, gaps = self.subtitle_nfo.check_timing(min_gap=10)
+                messagebox.showinfo('Timing', 'Overlapped subtitles: %d %s\r\nGaps over 10 seconds: %d %s' % (
+                    len(overlaps), overlaps[:10], len(gaps), [n for n, _ in gaps[:10]]))
+                return
+            elif action == 6:
+                filename = filedialog.asksaveasfilename(filetypes=[('srt', '.srt'), ('ass', '.ass'), ('vtt', '.vtt')])
+                if not filename:
+                    return
+                self.subtitle_nfo.save_as(filename, self.save_encoding.get(), NEWLINES[self.save_newline.get()])
+        except ValueError as e:
+            messagebox.showerror('ValueError', "Error: {}".format(e))
+        except Exception as e:
+            messagebox.showerror(e.args[0], e.args[1])
+        else:
+            messagebox.showinfo('xxx', "Job's done")
+
+    def undo_action(self):
+        if not self.subtitle_nfo or not self.subtitle_nfo.undo():
+            messagebox.showinfo('Undo', 'Nothing to undo')
+            return
+        self.stop_number.set(self.subtitle_nfo.subtitles_count)
+        self.set_scale(1, self.subtitle_nfo.subtitles_count)
+        self.scale_changed(1)
+
+    def set_scale(self, frm, to):
+        self.idx_selector.configure(from_=frm, to=to, tickinterval=(to-frm)/4)
+        self.idx_selector.set(1)
+
+    def scale_changed(self, value):
+        value = int(value)
+        if not self.subtitle_nfo:
+            self.subtitle_text.set('<< nothing >>')
+        elif value <= self.subtitle_nfo.subtitles_count:
+            txt = self.subtitle_nfo.get_sub(value-1)
+            txt = txt.replace('\r\n', '\n').rstrip()
+            self.subtitle_text.set(txt)
+        self.scale_value = value
+
+    def goto_changed(self, event):
+        if not self.subtitle_nfo:
+            return
+        try:
+            seconds = seconds_from_str(self.goto_time.get())
+        except ValueError:
+            messagebox.showerror('Wrong Time', 'Check time.\r\ne.g. 1:23:45,600')
+            return
+        order = self.subtitle_nfo.find_sub(seconds)
+        if order > 0:
+            self.idx_selector.set(order)
+
+    def scale_inc(self, event):
+        if not self.subtitle_nfo:
+            return
+        if self.scale_value < self.subtitle_nfo.subtitles_count:
+            self.idx_selector.set(self.scale_value+1)
+
+    def scale_dec(self, event):
+        if self.scale_value > 1:
+            self.idx_selector.set(self.scale_value-1)
+
+    def toggle_placeholder(self, show=True):
+        filename = self.subtitle_filename.get()
+        if show:
+            if len(filename) == 0:
+                self.subtitle_filename.set(self.PLACE_HOLDER)
+        elif filename == self.PLACE_HOLDER:
+            self.subtitle_filename.set('')
+
+
+def main():
+    gui = GUI(className=' Subtitle Resync Tool') # extra blank to avoid lowercase caption
+    gui.mainloop()
+
+
+if __name__ == "__main__":
+    main()
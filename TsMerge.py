@@ -6,20 +6,14 @@ from tkinter import ttk
 from tkinter import filedialog
 from tkinter import messagebox
 import os
-from urllib.request import urlopen
-from urllib.request import Request
 from urllib.parse import urlparse, quote, ParseResult
 import queue
 import threading
-from hashlib import md5
 import time
 import re
 from Crypto.Cipher import AES
-from sys import version_info
 
-
-import ssl
-ssl._create_default_https_context = ssl._create_unverified_context
+from download_core import ThreadDownloader, http_get
 
 
 global_cipher = None
@@ -48,10 +42,6 @@ def url_basename(url):
     return url[start+1:]
 
 
-def new_request(url):
-    user_agent = {'User-Agent': 'Mozilla/5.0 (Macintosh; U; Intel Mac OS X 10_6_8; en-us) AppleWebKit/534.50'}
-    return Request(url, headers=user_agent, unverifiable=True)
-
 def url_escape(url):
     obj = urlparse(url)
     assert isinstance(obj, ParseResult)
@@ -135,54 +125,14 @@ class DownloadStats(object):
         return seconds_per_block * (self._total_blocks - self._downloaded_blocks)
 
 
-class ThreadDownloader(threading.Thread):
-    def __init__(self, url, dst, timeout=3):
-        threading.Thread.__init__(self)
-        self._url = url  # source URL
-        self._dst = dst  # destination folder
-        self._timeout = timeout
-        self._size = 0
-
-    def run(self):
-        try:
-            ifo = urlopen(new_request(self._url), timeout=self._timeout)
-            content = ifo.read()
-            ifo.close()
-            global global_cipher
-            if global_cipher is not None:
-                content = global_cipher.decrypt(content)
-            self._size = len(content)
-            if self.file_exists(content):
-                return
-            with open(self._dst, 'wb') as ofo:
-                ofo.write(content)
-        except Exception as e:
-            print('%s: %s' % (self._url, e))
-
-    def downloaded_size(self):
-        return self._size
+def decrypt_segment(job):
+    """
+    download callback (transform hook): decrypt AES-128 segment before it's written to disk.
+    """
+    if not job.is_downloaded() or job.is_reused() or global_cipher is None:
+        return
+    job.set_content(global_cipher.decrypt(job.content()))
 
-    def file_exists(self, content):
-        """
-        check if file exists already on local disk.
-        @param filename: local disk filename (full dir + base name)
-        @param content: is belonging to remote resource.
-        @return: True if it exists
-        """
-        if not os.path.exists(self._dst):
-            return False
-        if not os.path.isfile(self._dst):
-            return False
-        if os.path.getsize(self._dst) != len(content):
-            return False
-        with open(self._dst, 'rb') as ofo:
-            old = ofo.read()
-            digest1 = md5(old).digest()
-            digest2 = md5(content).digest()
-            return digest1 == digest2
-
-    if version_info >= (3, 9):
-        def isAlive(self) -> bool: return self.is_alive()
 
 class Main(tk.Frame):
     WND_TITLE = 'TS Merger'
@@ -246,6 +196,9 @@ class Main(tk.Frame):
         tk.Label(frame, text='Timeout:').pack(side=tk.LEFT)
         self._timeout = tk.IntVar()
         tk.Spinbox(frame, textvariable=self._timeout, from_=3, to=9, width=2).pack(side=tk.LEFT)
+        tk.Label(frame, text='Retry:').pack(side=tk.LEFT)
+        self._retry = tk.IntVar(value=3)
+        tk.Spinbox(frame, textvariable=self._retry, from_=1, to=9, width=2).pack(side=tk.LEFT)
         self._btn = tk.Button(frame, text='Download', command=self.onclick_download_segments)
         self._btn.pack(side=tk.LEFT)
         tk.Button(frame, text='Delete Local Segments', command=self.onclick_del_segments).pack(side=tk.RIGHT)
@@ -290,9 +243,7 @@ class Main(tk.Frame):
             return
         try:
             # download
-            ifo = urlopen(new_request(index_url), timeout=timeout)
-            content = ifo.read()
-            ifo.close()
+            content = http_get(index_url, timeout)
             # write to local disk
             dst = os.path.join(cache_dir, Main.INDEX_FILE)
             ofo = open(dst, 'wb')
@@ -374,10 +325,9 @@ class Main(tk.Frame):
             for i in jobs[:]:
                 if i.isAlive():
                     continue
-                sz = i.downloaded_size()
-                self._stats.update(sz)
+                self._stats.update(i.downloaded_size())
                 # visualize task state: completion or failure
-                if sz > 0:
+                if i.is_successful():
                     self._segments.delete(i.iid)
                 else:
                     self._segments.set(i.iid, column='state', value='X')
@@ -389,6 +339,7 @@ class Main(tk.Frame):
                 self._msg_queue.put(progress)
             # if user changes settings of concurrent jobs
             timeout = self._timeout.get()
+            retry = self._retry.get()
             free_slots = max(self._job_num.get() - len(jobs), 0)
             added = min(free_slots, self._job_queue.qsize())
             for i in range(0, added):
@@ -400,7 +351,7 @@ class Main(tk.Frame):
                 # In short, be careful of below 'sn' in this app.
                 sn, url, state = self._segments.item(iid, 'values')
                 dst = os.path.join(cache, 'out%04d.ts' % int(sn))
-                job = ThreadDownloader(url_escape(url), dst, timeout)
+                job = ThreadDownloader(url_escape(url), dst, timeout, retry, decrypt_segment)
                 job.iid = iid  # attach a temporary attribute
                 jobs.append(job)
                 job.start()
@@ -631,9 +582,7 @@ class Main(tk.Frame):
                 ifo.close
             else:
                 key_url = '{}{}'.format(domain, link)
-                ifo = urlopen(new_request(key_url), timeout=self._timeout.get())
-                content = ifo.read()
-                ifo.close()
+                content = http_get(key_url, self._timeout.get(), compress=False)
                 ofo = open(key_file, 'wb')
                 ofo.write(content)
                 ofo.close()
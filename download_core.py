@@ -0,0 +1,780 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+Download core shared by MangaCrawler and TsMerge:
+keep-alive HTTP session, resumable downloader with retries, politeness scheduler, and metrics hooks.
+"""
+
+import threading
+import time
+from concurrent.futures import Future
+import heapq
+import itertools
+from urllib.error import HTTPError
+from urllib.parse import unquote, urlparse, urlsplit, urljoin
+from urllib.request import getproxies, proxy_bypass
+from base64 import b64encode
+import http.client
+import zlib
+from hashlib import md5
+import os
+from enum import Enum
+from email.utils import parsedate_to_datetime
+from io import BytesIO
+from sys import version_info
+
+try:
+    import brotli  # optional: 'br' compressed web pages
+except ImportError:
+    brotli = None
+
+import ssl
+ssl._create_default_https_context = ssl._create_unverified_context
+
+
+class DownloadMetrics:
+    """
+    Counters of all downloads: requests, bytes, retries, connections reused, etc.
+    Hooks are called on every update, so a GUI or a benchmark can watch them.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = dict()
+        self._hooks = []
+
+    def add_hook(self, hook):
+        """
+        @param hook: callback(name, value), called in downloader threads
+        """
+        with self._lock:
+            self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        with self._lock:
+            self._hooks.remove(hook)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+            hooks = list(self._hooks)
+        for hook in hooks:
+            hook(name, value)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+
+METRICS = DownloadMetrics()
+
+
+class ByteBudget:
+    """
+    Global budget of bytes in flight: a semaphore sized in bytes.
+    Every download reserves its Content-Length before reading body, and waits until enough bytes are released,
+    so high concurrency doesn't blow up memory with big pages.
+    Bodies kept in memory after their downloads, e.g. pages waiting for their turn in an archive, are held
+    in budget too, until they're written.
+    """
+    UNKNOWN_SIZE = 1024 * 1024  # reserved for body without Content-Length
+
+    def __init__(self, limit=0):
+        """
+        @param limit: bytes. 0 means no limit.
+        """
+        self._limit = limit
+        self._used = 0
+        self._held = 0  # bytes of bodies downloaded but still in memory, part of self._used
+        self._cond = threading.Condition()
+
+    def set_limit(self, limit):
+        with self._cond:
+            self._limit = limit
+            self._cond.notify_all()
+
+    def acquire(self, size):
+        """
+        @param size: bytes, or None if unknown
+        @return: bytes reserved, to be released later
+        """
+        size = ByteBudget.UNKNOWN_SIZE if size is None else size
+        with self._cond:
+            # body bigger than budget waits until no other body is downloading.
+            # Over budget by held bodies, downloads go one by one, so the page they wait for still gets through.
+            while 0 < self._limit < self._used + size and self._used > self._held:
+                self._cond.wait()
+            self._used += size
+        return size
+
+    def release(self, size):
+        if size == 0:
+            return
+        with self._cond:
+            self._used -= size
+            self._cond.notify_all()
+
+    def hold(self, size):
+        """
+        charge a downloaded body kept in memory, without waiting: its download has reserved it already.
+        """
+        if size == 0:
+            return
+        with self._cond:
+            self._used += size
+            self._held += size
+
+    def unhold(self, size):
+        if size == 0:
+            return
+        with self._cond:
+            self._used -= size
+            self._held -= size
+            self._cond.notify_all()
+
+    def used(self):
+        return self._used
+
+
+BUDGET = ByteBudget()
+
+
+class HttpResponse:
+    """
+    Response of HttpSession, read like urlopen's. Body is decoded if it's compressed.
+    Connection goes back to pool when response is read to the end and closed.
+    """
+    def __init__(self, session, key, conn, resp, url):
+        self._session = session
+        self._key = key
+        self._conn = conn
+        self._resp = resp
+        self.url = url
+        self.status = resp.status
+        self.reason = resp.reason
+        self.headers = resp.headers
+        encoding = resp.headers.get('Content-Encoding', 'identity').strip().lower()
+        self._decompress = None  # callback(compressed bytes) --> bytes
+        self._finished = None    # callback() --> True if compressed body is complete
+        if encoding in ('gzip', 'deflate'):
+            decoder = zlib.decompressobj(16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS)
+            self._decompress, self._finished = decoder.decompress, lambda: decoder.eof
+        elif encoding == 'br' and brotli is not None:
+            decoder = brotli.Decompressor()
+            self._decompress, self._finished = decoder.process, decoder.is_finished
+        elif encoding != 'identity':
+            resp.close()
+            conn.close()
+            raise IOError('unsupported content encoding: %s' % encoding)
+        length = resp.headers.get('Content-Length')
+        # Content-Length of compressed body isn't length of content
+        self.content_length = int(length) if length is not None and self._decompress is None else None
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = None
+        if self._decompress is None:
+            return self._resp.read(size)
+        result = []
+        while True:
+            raw = self._resp.read(size)
+            if not raw:
+                if not self._finished():
+                    raise IOError('incomplete compressed body')
+                break
+            data = self._decompress(raw)
+            result.append(data)
+            if size is not None and len(data) > 0:
+                break
+        return b''.join(result)
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        if self._resp.isclosed() and not self._resp.will_close:
+            self._session.release(self._key, conn)  # body is read to the end: keep alive
+        else:
+            self._resp.close()
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *a):
+        self.close()
+
+
+class HttpSession:
+    """
+    Shared by all downloaders: HTTP/1.1 connections are kept alive and reused per host,
+    so a chapter of images doesn't pay a TCP and TLS handshake per page.
+    Text responses may be compressed (gzip, deflate, and br if brotli is installed).
+    Proxies are those urlopen uses: HTTP_PROXY, HTTPS_PROXY and NO_PROXY of environment, or system settings.
+    """
+    REDIRECT_CODES = (301, 302, 303, 307, 308)
+    MAX_REDIRECTS = 5
+    MAX_IDLE = 8  # idle connections kept per host
+    ACCEPT_ENCODING = 'gzip, deflate, br' if brotli is not None else 'gzip, deflate'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = dict()  # (scheme, netloc) --> list of idle connections
+
+    @staticmethod
+    def proxy_of(key):
+        """
+        @param key: (scheme, netloc) of url
+        @return: (host, port, headers to proxy) of proxy for url, or None to connect directly
+        """
+        scheme, netloc = key
+        proxy = getproxies().get(scheme)
+        if not proxy or proxy_bypass(netloc):
+            return None
+        if '://' not in proxy:
+            proxy = 'http://' + proxy
+        parts = urlsplit(proxy)
+        headers = dict()
+        if parts.username is not None:
+            credentials = '%s:%s' % (unquote(parts.username), unquote(parts.password or ''))
+            headers['Proxy-Authorization'] = 'Basic ' + b64encode(credentials.encode('utf-8')).decode('ascii')
+        return parts.hostname, parts.port, headers
+
+    def acquire(self, key, timeout, proxy=None):
+        """
+        @param proxy: (host, port, headers) of proxy_of, for a new connection
+        @return: (connection, True if it's reused)
+        """
+        with self._lock:
+            idle = self._idle.get(key)
+            conn = idle.pop() if idle else None
+        if conn is not None:
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            METRICS.count('reused')
+            return conn, True
+        METRICS.count('connections')
+        scheme, netloc = key
+        if proxy is None:
+            if scheme == 'https':
+                return http.client.HTTPSConnection(netloc, timeout=timeout), False
+            return http.client.HTTPConnection(netloc, timeout=timeout), False
+        host, port, headers = proxy
+        if scheme == 'https':  # CONNECT tunnel through proxy, TLS with the server
+            conn = http.client.HTTPSConnection(host, port, timeout=timeout)
+            conn.set_tunnel(netloc, headers=headers)
+            return conn, False
+        return http.client.HTTPConnection(host, port, timeout=timeout), False
+
+    def release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < HttpSession.MAX_IDLE:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, dict()
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def open(self, url, headers=None, timeout=10, compress=False):
+        """
+        GET url, following redirects.
+        @param compress: ask for compressed body. Not asked for in Range requests,
+                         so that offset of a partial file is of decoded content.
+        @return: HttpResponse of status 2xx; HTTPError is raised for 4xx/5xx like urlopen.
+        """
+        headers = dict(headers or {})
+        if compress and 'Range' not in headers:
+            headers['Accept-Encoding'] = HttpSession.ACCEPT_ENCODING
+        for _ in range(HttpSession.MAX_REDIRECTS + 1):
+            resp = self.request(url, headers, timeout)
+            if resp.status in HttpSession.REDIRECT_CODES and resp.headers.get('Location') is not None:
+                with resp:
+                    resp.read()
+                url = urljoin(url, resp.headers['Location'])
+                continue
+            if resp.status >= 400:
+                with resp:
+                    resp.read()
+                raise HTTPError(url, resp.status, resp.reason, resp.headers, None)
+            return resp
+        raise IOError('too many redirects: %s' % url)
+
+    def request(self, url, headers, timeout):
+        parts = urlsplit(url)
+        key = (parts.scheme, unquote(parts.netloc))
+        target = parts.path or '/'
+        if parts.query:
+            target = '%s?%s' % (target, parts.query)
+        proxy = HttpSession.proxy_of(key)
+        if proxy is not None and parts.scheme == 'http':  # plain proxy gets absolute url
+            target = '%s://%s%s' % (parts.scheme, parts.netloc, target)
+            headers = dict(headers, **proxy[2])
+        while True:
+            conn, reused = self.acquire(key, timeout, proxy)
+            try:
+                conn.request('GET', target, headers=headers)
+                resp = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if reused:
+                    continue  # server closed idle connection: try another one
+                raise
+            except Exception:
+                conn.close()
+                raise
+            return HttpResponse(self, key, conn, resp, url)
+
+
+SESSION = HttpSession()
+
+
+def http_get(url, timeout=10, compress=True):
+    """
+    download a small text file at once, e.g. an index file.
+    @return: bytes of content
+    """
+    headers = {'User-Agent': ThreadDownloader.USER_AGENT}
+    with SESSION.open(url, headers, timeout, compress) as ifo:
+        return ifo.read()
+
+
+class DownloadStatus(Enum):
+    Unknown = 0
+    Failed = 1
+    Downloaded = 2
+    Successful = 3
+
+
+class ThreadDownloader(threading.Thread):
+    """
+    Download a URL into dst by streaming, with retries. Callback is called when content is downloaded
+    (transform hook, e.g. transcode or decrypt by set_content), then when it's written or failed.
+    """
+    USER_AGENT = 'Mozilla/5.0 (Macintosh; U; Intel Mac OS X 10_6_8; en-us) AppleWebKit/534.50'
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, url, dst, timeout=3, retry=1, callback=None, throttle=None, in_memory=False, on_chunk=None,
+                 compress=False):
+        threading.Thread.__init__(self)
+        self._url = url  # source URL
+        self._dst = dst  # destination folder
+        self._part = dst + '.part'  # body is streamed into it, then renamed to dst
+        self._timeout = timeout
+        self._retry = retry
+        self._cb = callback
+        self._throttle = throttle  # HostScheduler, to be polite to web sites
+        self._status = DownloadStatus.Unknown
+        self._size = 0
+        self._buffer = BytesIO() if in_memory else None  # body is kept in memory instead of written to dst
+        self._on_chunk = on_chunk  # callback(bytes) while body is streaming; callback(None) if body restarts
+        self._fed = 0  # bytes passed to on_chunk
+        self._discarded = False  # content isn't wanted, e.g. it's a duplicate
+        self._md5 = None  # digest of content, computed while streaming
+        self._compress = compress  # ask for compressed body, e.g. web page
+        self._reused = False  # content is of dst, which is complete already
+        self._written = False  # self._part is written by this run, to be renamed to dst
+        self._reserved = 0  # bytes reserved in BUDGET
+
+    def discard(self):
+        """
+        Content won't be written to dst. If called before start, nothing is downloaded.
+        Job is still regarded as successful.
+        """
+        self._discarded = True
+
+    def is_discarded(self):
+        return self._discarded
+
+    def is_in_memory(self):
+        return self._buffer is not None
+
+    def is_reused(self):
+        """
+        @return: True if dst is complete already and content is of it, e.g. transformed by last run.
+        """
+        return self._reused
+
+    def run(self):
+        try:
+            self.download()
+        finally:
+            BUDGET.release(self._reserved)
+            self._reserved = 0
+
+    def download(self):
+        if self._discarded:
+            self._status = DownloadStatus.Successful
+            if self._cb is not None:
+                self._cb(self)
+            return
+        for i in range(0, self._retry):
+            if i > 0:
+                METRICS.count('retries')
+            try:
+                if self._throttle is not None:
+                    self._throttle.before_request(self._url)
+                METRICS.count('requests')
+                self.fetch()
+                self._status = DownloadStatus.Downloaded
+                break
+            except HTTPError as e:
+                print('%s: %s' % (self._url, e))
+                if self._throttle is not None:
+                    self._throttle.after_response(self._url, e.code, e.headers.get('Retry-After'))
+                if e.code == 416 and os.path.exists(self._part):  # broken partial file
+                    os.remove(self._part)
+                if e.code == 404:  # no need to retry, e.g. probing a chapter not published yet
+                    break
+            except Exception as e:
+                print('%s: %s' % (self._url, e))
+        # 失败
+        if self._status != DownloadStatus.Downloaded:
+            self._status = DownloadStatus.Failed
+            METRICS.count('failures')
+            if self._cb is not None:
+                self._cb(self)
+            return
+        # 成功下载，有一次回调
+        if self._cb is not None:
+            self._cb(self)
+        # 写完本地文件，有一次回调
+        if self._buffer is None and self._written and os.path.exists(self._part):
+            if self._discarded:
+                os.remove(self._part)
+            elif self.file_exists():
+                os.remove(self._part)
+            else:
+                os.replace(self._part, self._dst)  # atomic: dst is either old or complete
+        self._status = DownloadStatus.Successful
+        METRICS.count('downloads')
+        if self._cb is not None:
+            self._cb(self)
+
+    def fetch(self):
+        """
+        stream response body into temporary file.
+        A partial temporary file left by last run is resumed by HTTP Range request.
+        """
+        headers = {'User-Agent': ThreadDownloader.USER_AGENT}
+        self._written = False
+        offset = 0
+        if self._buffer is None and os.path.isfile(self._part):
+            offset = os.path.getsize(self._part)
+        if offset > 0:
+            headers['Range'] = 'bytes=%d-' % offset
+        with SESSION.open(self._url, headers, self._timeout, self._compress) as ifo:
+            if self._throttle is not None:
+                self._throttle.after_response(self._url, ifo.status)
+            length = ifo.content_length
+            BUDGET.release(self._reserved)  # reserved by last try
+            self._reserved = 0
+            self._reserved = BUDGET.acquire(length)
+            content_range = ifo.headers.get('Content-Range', '')
+            if ifo.status != 206 or not content_range.startswith('bytes %d-' % offset):
+                offset = 0  # server sends whole body
+                if self._buffer is None and length is not None and self.is_dst_current(ifo.headers, length):
+                    # no need to download again: dst is renamed from a complete file
+                    if os.path.exists(self._part):
+                        os.remove(self._part)  # stale, not to be renamed over dst
+                    self._size = length
+                    self._reused = True
+                    METRICS.count('reused files')
+                    self.replay(self._dst, length)
+                    return
+            if offset > 0:
+                METRICS.count('resumed')
+            self.replay(self._part, offset)
+            self._md5 = md5()
+            if offset > 0:
+                with open(self._part, 'rb') as part:
+                    for chunk in iter(lambda: part.read(min(ThreadDownloader.CHUNK_SIZE, offset - part.tell())), b''):
+                        self._md5.update(chunk)
+            if self._buffer is not None:
+                self._buffer = BytesIO()
+                self.copy_body(ifo, self._buffer)
+                self._size = self._buffer.tell()
+            else:
+                with open(self._part, 'ab' if offset > 0 else 'wb') as ofo:
+                    self.copy_body(ifo, ofo)
+                    ofo.flush()
+                    os.fsync(ofo.fileno())
+                    self._size = ofo.tell()
+                self._written = True
+        if length is not None and self._size != offset + length:
+            raise IOError('incomplete body: %d of %d bytes' % (self._size, offset + length))
+
+    def is_dst_current(self, headers, length):
+        """
+        Same size doesn't tell a complete file of another version, e.g. a segment not decrypted yet.
+        dst is current if it's of same size and written after Last-Modified of content on server.
+        Without Last-Modified, content is downloaded again.
+        """
+        if not os.path.isfile(self._dst) or os.path.getsize(self._dst) != length:
+            return False
+        try:
+            modified = parsedate_to_datetime(headers['Last-Modified']).timestamp()
+        except (KeyError, TypeError, ValueError):
+            return False
+        return os.path.getmtime(self._dst) >= modified
+
+    def copy_body(self, ifo, ofo):
+        while True:
+            chunk = ifo.read(ThreadDownloader.CHUNK_SIZE)
+            if not chunk:
+                break
+            ofo.write(chunk)
+            self._md5.update(chunk)
+            METRICS.count('bytes', len(chunk))
+            if self._on_chunk is not None:
+                self._on_chunk(chunk)
+                self._fed += len(chunk)
+
+    def replay(self, path, offset):
+        """
+        keep on_chunk callback in step with body before offset, which isn't received by this request.
+        """
+        if self._on_chunk is None:
+            return
+        if offset < self._fed:
+            self._on_chunk(None)  # body restarts
+            self._fed = 0
+        if offset > self._fed:
+            with open(path, 'rb') as ifo:
+                ifo.seek(self._fed)
+                while self._fed < offset:
+                    chunk = ifo.read(min(ThreadDownloader.CHUNK_SIZE, offset - self._fed))
+                    if not chunk:
+                        break
+                    self._on_chunk(chunk)
+                    self._fed += len(chunk)
+
+    def content(self):
+        """
+        @return: bytes of downloaded file
+        """
+        if self._buffer is not None:
+            return self._buffer.getvalue()
+        path = self._part if self._written and os.path.exists(self._part) else self._dst
+        with open(path, 'rb') as ifo:
+            return ifo.read()
+
+    def set_content(self, data, dst=None):
+        """
+        replace downloaded content before it's written to dst, e.g. by a transcoding callback.
+        @param dst: new destination file, if its name is changed too.
+        """
+        self._md5 = md5(data)
+        if self._buffer is not None:
+            self._buffer = BytesIO(data)
+        elif os.path.exists(self._part):
+            os.remove(self._part)
+        if dst is not None:
+            self._dst = dst
+            self._part = dst + '.part'
+        if self._buffer is None:
+            with open(self._part, 'wb') as ofo:
+                ofo.write(data)
+                ofo.flush()
+                os.fsync(ofo.fileno())
+            self._written = True
+
+    def free(self):
+        """
+        content is no longer needed, e.g. it's added into an archive: memory is freed at once,
+        even if the job itself is kept for a while.
+        """
+        if self._buffer is not None:
+            self._buffer = BytesIO()
+
+    def downloaded_size(self):
+        return self._size
+
+    def digest(self):
+        """
+        @return: MD5 of content (hex)
+        """
+        if self._md5 is None:  # content isn't downloaded again
+            self._md5 = md5(self.content())
+        return self._md5.hexdigest()
+
+    def file_exists(self):
+        """
+        check if temporary file exists already on local disk as destination file.
+        @return: True if it exists
+        """
+        if not os.path.exists(self._dst):
+            return False
+        if not os.path.isfile(self._dst):
+            return False
+        if os.path.getsize(self._dst) != os.path.getsize(self._part):
+            return False
+        digests = []
+        for path in (self._dst, self._part):
+            digest = md5()
+            with open(path, 'rb') as ifo:
+                for chunk in iter(lambda: ifo.read(ThreadDownloader.CHUNK_SIZE), b''):
+                    digest.update(chunk)
+            digests.append(digest.digest())
+        return digests[0] == digests[1]
+
+    def is_successful(self):
+        return self._status == DownloadStatus.Successful
+
+    def is_downloaded(self):
+        return self._status == DownloadStatus.Downloaded
+
+    def is_failed(self):
+        return self._status == DownloadStatus.Failed
+
+    def file_path(self):
+        return self._dst
+
+    if version_info >= (3, 9):
+        def isAlive(self) -> bool: return self.is_alive()
+
+
+class HostState:
+    def __init__(self, delay):
+        self.pending = []       # heap of (priority, sequence, future, fn, args, kwargs) waiting for dispatch
+        self.active = 0         # jobs being run
+        self.delay = delay      # current inter-request delay, grows when host complains
+        self.ready_at = 0.0     # time.monotonic() when next request may be sent
+
+
+class HostScheduler:
+    """
+    Politeness scheduler: jobs are queued per host and dispatched by a fixed number of workers.
+    A host never runs more than 'per_host' jobs at a time, and requests to it are at least 'delay' apart.
+    Hosts answering 429/503 are backed off exponentially (or as told by Retry-After),
+    and recover gradually after successful responses.
+    Workers aren't blocked by a busy host: they go on with jobs of other hosts instead.
+    Jobs of a host are dispatched by priority, e.g. page number, so the first pages of a chapter arrive first.
+    """
+    BACKOFF_CODES = (429, 503)
+
+    def __init__(self, workers=8, per_host=2, delay=0.5, max_delay=60.0):
+        self._per_host = per_host
+        self._delay = delay
+        self._max_delay = max_delay
+        self._hosts = dict()
+        self._rotation = 0  # round-robin among hosts
+        self._sequence = itertools.count()  # FIFO among jobs of the same priority
+        self._cond = threading.Condition()
+        self._closed = False
+        self._workers = [threading.Thread(target=self.worker_thread, daemon=True) for _ in range(workers)]
+        for i in self._workers:
+            i.start()
+
+    @staticmethod
+    def host_of(url):
+        return urlparse(url).netloc
+
+    def host(self, url):
+        """
+        @return: HostState of URL. Caller must hold self._cond.
+        """
+        name = HostScheduler.host_of(url)
+        if name not in self._hosts:
+            self._hosts[name] = HostState(self._delay)
+        return self._hosts[name]
+
+    def submit(self, url, fn, *a, **kw):
+        """
+        queue fn(*a, **kw) as a job for URL's host.
+        @return: concurrent.futures.Future
+        """
+        return self.submit_priority(url, 0, fn, *a, **kw)
+
+    def submit_priority(self, url, priority, fn, *a, **kw):
+        """
+        queue fn(*a, **kw) as a job for URL's host, ahead of jobs of larger priority value.
+        @return: concurrent.futures.Future
+        """
+        future = Future()
+        with self._cond:
+            heapq.heappush(self.host(url).pending, (priority, next(self._sequence), future, fn, a, kw))
+            self._cond.notify()
+        return future
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for i in self._workers:
+            i.join()
+
+    def next_job(self):
+        with self._cond:
+            while True:
+                if self._closed:
+                    return None, None
+                now = time.monotonic()
+                wait = None
+                hosts = list(self._hosts.values())
+                for n in range(len(hosts)):
+                    host = hosts[(self._rotation + n) % len(hosts)]
+                    if len(host.pending) == 0 or host.active >= self._per_host:
+                        continue
+                    if host.ready_at <= now:
+                        self._rotation = (self._rotation + n + 1) % len(hosts)
+                        host.active += 1
+                        return host, heapq.heappop(host.pending)[2:]
+                    wait = host.ready_at - now if wait is None else min(wait, host.ready_at - now)
+                self._cond.wait(wait)
+
+    def worker_thread(self):
+        while True:
+            host, job = self.next_job()
+            if job is None:
+                return
+            future, fn, a, kw = job
+            try:
+                if future.set_running_or_notify_cancel():
+                    future.set_result(fn(*a, **kw))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._cond:
+                    host.active -= 1
+                    self._cond.notify_all()
+
+    def before_request(self, url):
+        """
+        called right before every request (retries included): wait for the host's turn.
+        """
+        with self._cond:
+            host = self.host(url)
+            now = time.monotonic()
+            start = max(now, host.ready_at)
+            host.ready_at = start + host.delay
+        if start > now:
+            time.sleep(start - now)
+
+    def after_response(self, url, code, retry_after=None):
+        """
+        adaptive backoff according to HTTP status code of response
+        @param retry_after: value of 'Retry-After' header, if any
+        """
+        with self._cond:
+            host = self.host(url)
+            if code in HostScheduler.BACKOFF_CODES:
+                host.delay = min(max(host.delay * 2, 1.0), self._max_delay)
+                pause = host.delay
+                if retry_after is not None and retry_after.strip().isdigit():
+                    pause = min(max(pause, int(retry_after)), self._max_delay)
+                host.ready_at = max(host.ready_at, time.monotonic() + pause)
+                print('[%s] backing off: %.1f seconds' % (HostScheduler.host_of(url), pause))
+            elif host.delay > self._delay:
+                host.delay = max(self._delay, host.delay / 2)
+            self._cond.notify_all()
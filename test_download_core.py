@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+Tests of download_core against a local replay server, by standard library only:
+  python -m unittest test_download_core
+"""
+
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from email.utils import formatdate
+from hashlib import md5
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.error import HTTPError
+from urllib.parse import unquote, urlparse
+
+from download_core import SESSION, HttpSession, ThreadDownloader, HostScheduler
+
+HOST = 'example.com'
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    replay server: serves fixtures/<path> for /<path>, with Range requests,
+    redirects /redirect/<path> to /<path>, answers /busy/ by 503,
+    and records (path, Range header, client port) of requests
+    """
+    fixtures = None
+    requests = []
+    ranges = True  # False: whole body is sent for Range requests, as some servers do
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *a):
+        pass
+
+    def reply(self, code, headers=(), body=b''):
+        self.send_response(code)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        Handler.requests.append((self.path, self.headers.get('Range'), self.client_address[1]))
+        if self.path.startswith('/redirect/'):
+            self.reply(302, [('Location', self.path[len('/redirect'):])])
+            return
+        if self.path.startswith('/busy/'):
+            self.reply(503, [('Retry-After', '1')])
+            return
+        path = os.path.join(self.fixtures, unquote(urlparse(self.path).path).lstrip('/'))
+        if not os.path.isfile(path):
+            self.reply(404)
+            return
+        with open(path, 'rb') as ifo:
+            content = ifo.read()
+        modified = ('Last-Modified', formatdate(os.path.getmtime(path), usegmt=True))
+        match = re.match(r'bytes=(\d+)-', self.headers.get('Range', ''))
+        if match is not None and int(match.group(1)) < len(content) and self.ranges:
+            start = int(match.group(1))
+            self.reply(206, [modified, ('Content-Range', 'bytes %d-%d/%d' % (start, len(content) - 1, len(content)))],
+                       content[start:])
+        else:
+            self.reply(200, [modified], content)
+
+
+class DownloadCoreTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp(prefix='download_core_')
+        Handler.fixtures = os.path.join(cls.folder, 'fixtures')
+        os.makedirs(os.path.join(Handler.fixtures, HOST))
+        cls.content = os.urandom(300 * 1024)
+        with open(os.path.join(Handler.fixtures, HOST, 'page.bin'), 'wb') as fo:
+            fo.write(cls.content)
+        cls.modified = time.time() - 3600  # Last-Modified on server
+        os.utime(os.path.join(Handler.fixtures, HOST, 'page.bin'), (cls.modified, cls.modified))
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base = 'http://127.0.0.1:%d/' % cls.server.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        SESSION.close()
+        shutil.rmtree(cls.folder, ignore_errors=True)
+
+    def setUp(self):
+        Handler.requests = []
+        Handler.ranges = True
+        self.output = tempfile.mkdtemp(dir=self.folder)
+
+    def url(self, path):
+        return self.base + path
+
+    def download(self, path, dst, **kw):
+        job = ThreadDownloader(self.url(path), dst, timeout=5, **kw)
+        job.start()
+        job.join()
+        return job
+
+    def test_keep_alive(self):
+        session = HttpSession()
+        try:
+            for _ in range(3):
+                with session.open(self.url(HOST + '/page.bin')) as resp:
+                    self.assertEqual(resp.read(), self.content)
+        finally:
+            session.close()
+        self.assertEqual(len({port for _, _, port in Handler.requests}), 1)  # one connection for all
+
+    def test_redirect(self):
+        session = HttpSession()
+        try:
+            with session.open(self.url('redirect/%s/page.bin' % HOST)) as resp:
+                self.assertEqual(resp.status, 200)
+                self.assertEqual(resp.url, self.url(HOST + '/page.bin'))
+                self.assertEqual(resp.read(), self.content)
+        finally:
+            session.close()
+
+    def test_http_error(self):
+        session = HttpSession()
+        try:
+            with self.assertRaises(HTTPError) as context:
+                session.open(self.url(HOST + '/missing.bin'))
+            self.assertEqual(context.exception.code, 404)
+            with session.open(self.url(HOST + '/page.bin')) as resp:  # connection is still usable
+                self.assertEqual(resp.read(), self.content)
+        finally:
+            session.close()
+
+    def test_proxy(self):
+        session = HttpSession()
+        try:
+            with mock.patch.dict(os.environ, {'http_proxy': self.base, 'no_proxy': ''}):
+                with session.open('http://unreachable.invalid/%s/page.bin' % HOST) as resp:  # only by proxy
+                    self.assertEqual(resp.read(), self.content)
+            self.assertEqual(Handler.requests[-1][0], 'http://unreachable.invalid/%s/page.bin' % HOST)
+            with mock.patch.dict(os.environ, {'http_proxy': 'http://127.0.0.1:9/', 'no_proxy': '127.0.0.1'}):
+                with session.open(self.url(HOST + '/page.bin')) as resp:  # bypassed
+                    self.assertEqual(resp.read(), self.content)
+            self.assertEqual(Handler.requests[-1][0], '/%s/page.bin' % HOST)
+        finally:
+            session.close()
+
+    def test_resume(self):
+        dst = os.path.join(self.output, 'page.bin')
+        with open(dst + '.part', 'wb') as fo:  # left by last run
+            fo.write(self.content[:1000])
+        job = self.download(HOST + '/page.bin', dst)
+        self.assertTrue(job.is_successful())
+        self.assertEqual(Handler.requests[-1][1], 'bytes=1000-')
+        with open(dst, 'rb') as fo:
+            self.assertEqual(fo.read(), self.content)
+        self.assertEqual(job.digest(), md5(self.content).hexdigest())  # part before offset is hashed too
+
+    def test_stale_part_reused_dst(self):
+        dst = os.path.join(self.output, 'page.bin')
+        with open(dst, 'wb') as fo:  # complete by last run
+            fo.write(self.content)
+        with open(dst + '.part', 'wb') as fo:  # stale
+            fo.write(self.content[:1000])
+        Handler.ranges = False
+        chunks = []
+        job = self.download(HOST + '/page.bin', dst, on_chunk=chunks.append)
+        self.assertTrue(job.is_successful())
+        self.assertTrue(job.is_reused())
+        self.assertFalse(os.path.exists(dst + '.part'))
+        with open(dst, 'rb') as fo:
+            self.assertEqual(fo.read(), self.content)  # not replaced by stale part
+        self.assertEqual(job.content(), self.content)
+        self.assertEqual(b''.join(chunks), self.content)
+
+    def test_same_size_older_dst(self):
+        dst = os.path.join(self.output, 'page.bin')
+        with open(dst, 'wb') as fo:  # e.g. another version, or a segment not decrypted
+            fo.write(bytes(len(self.content)))
+        os.utime(dst, (self.modified - 60, self.modified - 60))
+        job = self.download(HOST + '/page.bin', dst)
+        self.assertTrue(job.is_successful())
+        self.assertFalse(job.is_reused())
+        with open(dst, 'rb') as fo:
+            self.assertEqual(fo.read(), self.content)
+
+    def test_atomic_rename(self):
+        dst = os.path.join(self.output, 'page.bin')
+        seen = []
+
+        def callback(job):
+            if job.is_downloaded():  # body is complete, but not yet renamed
+                seen.append((os.path.exists(dst), os.path.getsize(dst + '.part')))
+        job = self.download(HOST + '/page.bin', dst, callback=callback)
+        self.assertTrue(job.is_successful())
+        self.assertEqual(seen, [(False, len(self.content))])
+        self.assertFalse(os.path.exists(dst + '.part'))
+        self.assertEqual(os.path.getsize(dst), len(self.content))
+
+    def test_failed_keeps_nothing(self):
+        dst = os.path.join(self.output, 'missing.bin')
+        job = self.download(HOST + '/missing.bin', dst, retry=3)
+        self.assertTrue(job.is_failed())
+        self.assertEqual(len(Handler.requests), 1)  # 404 isn't retried
+        self.assertFalse(os.path.exists(dst))
+
+    def test_backoff(self):
+        scheduler = HostScheduler(workers=2, per_host=1, delay=0.0, max_delay=2.0)
+        try:
+            url = self.url('busy/page.bin')
+            start = time.monotonic()
+            job = scheduler.submit(url, self.download, 'busy/page.bin', os.path.join(self.output, 'page.bin'),
+                                   retry=2, throttle=scheduler).result()
+            elapsed = time.monotonic() - start
+            self.assertTrue(job.is_failed())
+            self.assertEqual(len(Handler.requests), 2)
+            self.assertGreaterEqual(elapsed, 0.9)  # retry waits for Retry-After
+            host = scheduler.host(url)
+            self.assertEqual(host.delay, 2.0)  # doubled twice, capped by max_delay
+            scheduler.after_response(url, 200)
+            self.assertEqual(host.delay, 1.0)  # recovers gradually
+        finally:
+            scheduler.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()